@@ -0,0 +1,287 @@
+"""Compression of the responses of the API, negotiated with the Accept-Encoding header of each request
+
+Responses smaller than a minimum size are sent as they are, since compressing them costs more than it saves.
+The compressed bodies of the GET responses that have an ETag are cached by URL and ETag, so that a hot song
+is compressed once per version and encoding, not on every request.
+"""
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# the encodings supported, in the order of preference when the client accepts several equally
+ENCODINGS = ("br", "gzip")
+_compressible_media_types = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+}
+
+
+class _StreamCompressor:
+    """Compresses a body chunk by chunk in the given encoding"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.__encoding = encoding
+        if encoding == "br":
+            self.__compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self.__compressor = zlib.compressobj(
+                gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses the next chunk, returning the compressed bytes that are ready, if any"""
+        if self.__encoding == "br":
+            return self.__compressor.process(data)
+        return self.__compressor.compress(data)
+
+    def finish(self) -> bytes:
+        """Returns the rest of the compressed bytes, ending the body"""
+        if self.__encoding == "br":
+            return self.__compressor.finish()
+        return self.__compressor.flush()
+
+
+class ResponseCompressor:
+    """The settings for compressing responses, and the cache of the compressed bodies of the cacheable ones"""
+
+    def __init__(
+        self,
+        minimum_size: int = 500,
+        cache_size: int = 1000,
+        gzip_level: int = 6,
+        brotli_quality: int = 5,
+    ):
+        """
+        Args:
+            minimum_size: the number of bytes below which bodies are not compressed
+            cache_size: the maximum number of compressed bodies cached, the least recently used dropped first;
+                0 disables the cache
+            gzip_level: the gzip compression level from 1 to 9
+            brotli_quality: the brotli compression quality from 0 to 11
+        """
+        self.minimum_size = minimum_size
+        self.__cache_size = cache_size
+        self.__gzip_level = gzip_level
+        self.__brotli_quality = brotli_quality
+        self.__cache: OrderedDict[Tuple, bytes] = OrderedDict()
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        """Chooses the encoding of the response given the Accept-Encoding header of the request
+
+        Args:
+            accept_encoding: the Accept-Encoding header e.g. 'gzip, deflate, br;q=0.9'
+
+        Returns:
+            the supported encoding with the highest quality value, or None if none is acceptable
+        """
+        accepted: Dict[str, float] = {}
+        for item in accept_encoding.split(","):
+            name, *params = item.strip().split(";")
+            quality = 1.0
+            for param in params:
+                key, _, value = param.strip().partition("=")
+                if key == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            accepted[name.strip().lower()] = quality
+
+        wildcard = accepted.get("*", 0.0)
+        qualities = [(accepted.get(v, wildcard), v) for v in ENCODINGS]
+        best_quality, best = max(
+            qualities, key=lambda v: (v[0], -ENCODINGS.index(v[1]))
+        )
+        return best if best_quality > 0 else None
+
+    def get_stream_compressor(self, encoding: str) -> _StreamCompressor:
+        """Gets a compressor for a body that is sent in chunks"""
+        return _StreamCompressor(
+            encoding, gzip_level=self.__gzip_level, brotli_quality=self.__brotli_quality
+        )
+
+    def compress(
+        self, body: bytes, encoding: str, cache_key: Optional[Tuple] = None
+    ) -> bytes:
+        """Compresses the whole body, getting it from the cache if it was compressed already
+
+        Args:
+            body: the body of the response
+            encoding: the encoding to compress with
+            cache_key: the key identifying the body e.g. its URL and ETag, or None if it is not to be cached
+
+        Returns:
+            the compressed body
+        """
+        if cache_key is None or self.__cache_size <= 0:
+            return self.__compress(body, encoding)
+
+        key = (*cache_key, encoding)
+        try:
+            self.__cache.move_to_end(key)
+            return self.__cache[key]
+        except KeyError:
+            pass
+
+        data = self.__compress(body, encoding)
+        self.__cache[key] = data
+        if len(self.__cache) > self.__cache_size:
+            self.__cache.popitem(last=False)
+        return data
+
+    def clear(self):
+        """Clears the cache of compressed bodies"""
+        self.__cache.clear()
+
+    def __compress(self, body: bytes, encoding: str) -> bytes:
+        """Compresses the body in the given encoding"""
+        compressor = self.get_stream_compressor(encoding)
+        return compressor.compress(body) + compressor.finish()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing the responses with the ResponseCompressor at `app.state.compressor`
+
+    Requests are passed through untouched until the compressor is set, e.g. on startup.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        compressor: Optional[ResponseCompressor] = None
+        if scope["type"] == "http":
+            compressor = getattr(scope["app"].state, "compressor", None)
+
+        if compressor is None:
+            return await self.app(scope, receive, send)
+
+        encoding = compressor.negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        responder = _CompressionResponder(scope, compressor, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    """Intercepts the messages of one response, compressing its body if it is compressible and large enough"""
+
+    def __init__(
+        self,
+        scope: Scope,
+        compressor: ResponseCompressor,
+        encoding: str,
+        send: Send,
+    ):
+        self.__scope = scope
+        self.__compressor = compressor
+        self.__encoding = encoding
+        self.__send = send
+        self.__start_message: Optional[Message] = None
+        self.__etag: Optional[str] = None
+        self.__is_compressing = False
+        self.__is_passing_through = False
+        self.__stream_compressor: Optional[_StreamCompressor] = None
+
+    async def send(self, message: Message):
+        """Sends the message, holding back the start of the response until the first part of its body is got"""
+        if self.__is_passing_through:
+            return await self.__send(message)
+
+        if message["type"] == "http.response.start":
+            self.__start_message = message
+            self.__etag = _weaken_etag(MutableHeaders(raw=message["headers"]))
+            return
+
+        if message["type"] != "http.response.body":
+            return await self.__send(message)
+
+        if self.__is_compressing:
+            return await self.__send_compressed_chunk(message)
+
+        body: bytes = message.get("body", b"")
+        more_body: bool = message.get("more_body", False)
+        headers = MutableHeaders(raw=self.__start_message["headers"])
+
+        if not self.__is_compressible(headers, body=body, more_body=more_body):
+            self.__is_passing_through = True
+            if self.__start_message["status"] < 300:
+                headers.add_vary_header("Accept-Encoding")
+            await self.__send(self.__start_message)
+            return await self.__send(message)
+
+        headers["Content-Encoding"] = self.__encoding
+        headers.add_vary_header("Accept-Encoding")
+
+        if not more_body:
+            data = self.__compressor.compress(
+                body, self.__encoding, cache_key=self.__get_cache_key(self.__etag)
+            )
+            headers["Content-Length"] = f"{len(data)}"
+            await self.__send(self.__start_message)
+            return await self.__send({**message, "body": data})
+
+        self.__is_compressing = True
+        self.__stream_compressor = self.__compressor.get_stream_compressor(
+            self.__encoding
+        )
+        del headers["Content-Length"]
+        await self.__send(self.__start_message)
+        await self.__send_compressed_chunk(message)
+
+    async def __send_compressed_chunk(self, message: Message):
+        """Compresses and sends the next part of a body sent in chunks"""
+        data = self.__stream_compressor.compress(message.get("body", b""))
+        more_body = message.get("more_body", False)
+        if not more_body:
+            data += self.__stream_compressor.finish()
+        if data or not more_body:
+            await self.__send({**message, "body": data})
+
+    def __is_compressible(self, headers: Headers, body: bytes, more_body: bool) -> bool:
+        """Checks whether the response is worth compressing"""
+        status = self.__start_message["status"]
+        if status < 200 or status in (204, 304) or "content-encoding" in headers:
+            return False
+
+        media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        if not (
+            media_type.startswith("text/") or media_type in _compressible_media_types
+        ):
+            return False
+
+        if more_body:
+            content_length = headers.get("content-length")
+            return (
+                content_length is None
+                or int(content_length) >= self.__compressor.minimum_size
+            )
+        return len(body) >= self.__compressor.minimum_size
+
+    def __get_cache_key(self, etag: Optional[str]) -> Optional[Tuple]:
+        """Gets the key by which the compressed body is cached, or None if the response is not cacheable"""
+        if etag is None or self.__scope["method"] != "GET":
+            return None
+        if self.__start_message["status"] != 200:
+            return None
+        return self.__scope["path"], self.__scope.get("query_string", b""), etag
+
+
+def _weaken_etag(headers: MutableHeaders) -> Optional[str]:
+    """Marks the ETag of a response, whose body may be compressed, as weak, returning the ETag as it was
+
+    A compressed body is equivalent to, but not byte-for-byte identical with, the uncompressed one.
+    As If-None-Match is compared weakly, the weak ETag still matches the one got by the routes.
+    The ETag of every response negotiating an encoding is weakened, compressed or not, including 304 responses,
+    so that it is the same whatever the size of the body.
+    """
+    etag = headers.get("etag")
+    if etag is not None and not etag.startswith("W/"):
+        headers["ETag"] = f"W/{etag}"
+    return etag
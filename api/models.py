@@ -1,10 +1,21 @@
-from typing import List, Optional, Dict
+from enum import Enum
+from typing import List, Optional, Dict, Union, Any
 
-from pydantic import BaseModel
+from pydantic import BaseModel, root_validator
 
-from services.hymns.models import LineSection, Song
+from services.hymns.models import (
+    LineSection,
+    Song,
+    CompactSong,
+    SongSummary,
+    SongView,
+    PaginatedResponse,
+)
 from services.types import MusicalNote
 
+# the maximum number of operations in one batch request
+MAX_BATCH_OPERATIONS = 50
+
 
 class PartialSong(BaseModel):
     key: Optional[MusicalNote]
@@ -13,10 +24,58 @@ class PartialSong(BaseModel):
 
 class SongDetail(BaseModel):
     number: int
-    translations: Dict[str, Song]
+    # CompactSong comes first as Song would otherwise decode its lines
+    translations: Dict[str, Union[CompactSong, Song, SongSummary]]
 
 
 class OTPRequest(BaseModel):
     """The One time password request sent to verify a login"""
 
     otp: str
+
+
+class BatchOperationType(str, Enum):
+    """The kinds of read operations that can be batched in one request"""
+
+    GET_BY_NUMBER = "get-by-number"
+    GET_BY_TITLE = "get-by-title"
+    FIND_BY_NUMBER = "find-by-number"
+    FIND_BY_TITLE = "find-by-title"
+
+
+class BatchOperation(BaseModel):
+    """A read operation of a batch request, `q` being the number or title to get, or the search term
+
+    `skip`, `limit` and `with_total` apply only to the searches.
+    """
+
+    op: BatchOperationType
+    language: str
+    q: str
+    skip: int = 0
+    limit: int = 0
+    with_total: bool = False
+    view: SongView = SongView.FULL
+
+    @root_validator(skip_on_failure=True)
+    def check_number(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Checks that `q` is an integer for the operations by number"""
+        by_number = (
+            BatchOperationType.GET_BY_NUMBER,
+            BatchOperationType.FIND_BY_NUMBER,
+        )
+        if values["op"] in by_number:
+            try:
+                int(values["q"])
+            except ValueError:
+                raise ValueError(f"q must be a song number to {values['op'].value}")
+        return values
+
+
+class BatchResult(BaseModel):
+    """The outcome of one operation of a batch request; its data if it succeeded or the error detail if not"""
+
+    status: int
+    # CompactSong comes first as Song would otherwise decode its lines
+    data: Optional[Union[CompactSong, Song, SongSummary, PaginatedResponse]] = None
+    detail: Optional[str] = None
@@ -1,30 +1,47 @@
 """The RESTful API and the admin site
 """
+import asyncio
 import gc
-from typing import Optional, List
+from typing import Optional, List, Union, Dict
 
 from fastapi import FastAPI, Query, Security, HTTPException, status, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.security.api_key import APIKeyHeader
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.requests import Request
 from fastapi.templating import Jinja2Templates
 from slowapi.middleware import SlowAPIMiddleware
 
 
 import settings
+from api.compression import CompressionMiddleware, ResponseCompressor
 from api.models import (
     Song,
     SongDetail,
     PartialSong,
     OTPRequest,
+    BatchOperation,
+    BatchOperationType,
+    BatchResult,
+    MAX_BATCH_OPERATIONS,
+)
+from api.utils import (
+    try_to,
+    raise_http_error,
+    stream_json_array,
+    stream_ndjson,
+    get_etag,
+    get_validator_headers,
+    is_not_modified,
+    get_not_modified_response,
 )
-from api.utils import try_to
 from services import hymns, config, auth
+from services.hymns.utils.bulk import parse_records
 
 from services.auth import is_valid_api_key
+from services.errors import StoreTimeoutError, StoreOverloadedError
 
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
@@ -37,8 +54,15 @@ from services.auth.models import (
     ChangePasswordRequest,
     Application,
 )
-from services.hymns.models import PaginatedResponse
-from services.store import Store
+from services.hymns.models import (
+    PaginatedResponse,
+    SongView,
+    CompactSong,
+    SongSummary,
+    SongPatch,
+    ImportReport,
+)
+from services.store import Store, unit_of_work, consistent_reads
 
 api_key_header = APIKeyHeader(name="x-api-key")
 
@@ -56,6 +80,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
@@ -64,15 +89,38 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 async def _get_api_key(header_key: str = Security(api_key_header)):
     """Dependency for retrieving and validating the API key from the header or cookie"""
-    if await is_valid_api_key(auth_service, header_key):
+    try:
+        is_valid = await is_valid_api_key(auth_service, header_key)
+    except (StoreTimeoutError, StoreOverloadedError) as exp:
+        raise_http_error(exp)
+
+    if is_valid:
         return header_key
     raise HTTPException(
         status_code=status.HTTP_403_FORBIDDEN, detail="could not validate credentials"
     )
 
 
-async def _get_current_user(token: str = Depends(oauth2_scheme)) -> UserDTO:
-    """Gets the current logged in user
+async def _unit_of_work():
+    """Dependency running the store operations of a request on one connection per database, committed once.
+
+    The changes are rolled back if the request fails.
+    """
+    async with unit_of_work():
+        yield
+
+
+async def _consistent_reads():
+    """Dependency running the reads of a request on one replica, or in one causally consistent session, per database.
+
+    The songs are thus at least as new as the version of them read before, from which the ETag is got.
+    """
+    async with consistent_reads():
+        yield
+
+
+async def _get_authenticated_user(token: str = Depends(oauth2_scheme)) -> UserDTO:
+    """Gets the current logged in user, without a unit of work e.g. for the bulk import committed batch by batch
 
     Args:
         token: the JWT token got from the oauth headers
@@ -88,6 +136,22 @@ async def _get_current_user(token: str = Depends(oauth2_scheme)) -> UserDTO:
     return convert_to_user(resp)
 
 
+async def _get_current_user(
+    user: UserDTO = Depends(_get_authenticated_user),
+    _uow: None = Depends(_unit_of_work),
+) -> UserDTO:
+    """Gets the current logged in user
+
+    Args:
+        user: the User who is logged in
+        _uow: the unit of work of the request, shared by the admin routes depending on this
+
+    Returns:
+        the User who is logged in
+    """
+    return user
+
+
 @app.on_event("startup")
 async def start():
     """Initializes the hymns service"""
@@ -111,7 +175,11 @@ async def start():
 
     # hymns service
     global hymns_service
-    hymns_service = await hymns.initialize(hymns_db_uri)
+    hymns_service = await hymns.initialize(
+        hymns_db_uri,
+        edge_db_uri=settings.get_edge_db_uri(),
+        sync_interval=settings.get_edge_sync_interval(),
+    )
 
     # auth service
     global auth_service
@@ -127,6 +195,12 @@ async def start():
     app.state.auth_service = auth_service
     app.state.otp_verification_url = otp_verification_url
 
+    # response compression
+    app.state.compressor = ResponseCompressor(
+        minimum_size=settings.get_compression_min_size(),
+        cache_size=settings.get_compression_cache_size(),
+    )
+
     # API limiter
     app.state.limiter = Limiter(
         key_func=get_remote_address,
@@ -138,6 +212,9 @@ async def start():
 @app.on_event("shutdown")
 async def shutdown():
     """Shuts down the application"""
+    if hymns_service is not None:
+        await hymns.shutdown(hymns_service)
+
     # Shut down all stores
     await Store.destroy_stores()
     gc.collect()
@@ -186,51 +263,200 @@ async def api_register_app():
     return transform(res)
 
 
+@app.post(
+    "/api/batch", response_model=List[BatchResult], response_model_exclude_none=True
+)
+async def api_batch(
+    operations: List[BatchOperation], api_key: str = Security(_get_api_key)
+):
+    """Runs up to 50 read operations, i.e. gets and searches by number or title, concurrently in one request.
+
+    The API key is validated, and the request rate-limited, once for the whole batch.
+    The result of each operation, in the order of the operations, has its status code and its data or error detail,
+    so that failed operations do not fail the rest.
+    """
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"a batch can have at most {MAX_BATCH_OPERATIONS} operations",
+        )
+
+    return await asyncio.gather(*(_run_batch_operation(op) for op in operations))
+
+
+@app.get(
+    "/api/{language}/range",
+    response_model=List[Union[CompactSong, Song, SongSummary]],
+)
+async def api_query_by_number_range(
+    language: str,
+    start: int = Query(alias="from", ge=0),
+    end: int = Query(alias="to", ge=0),
+    view: SongView = SongView.FULL,
+    api_key: str = Security(_get_api_key),
+):
+    """Returns the songs whose numbers are between `from` and `to`, both inclusive, ordered by number.
+
+    The songs are streamed as a JSON array, a batch at a time, so that large ranges use bounded memory.
+    If `view` is 'summary', the songs are returned without their lines.
+    If `view` is 'compact', the lines are encoded as arrays of note codes, words and line offsets
+    """
+    res = await hymns.query_songs_by_number_range(
+        hymns_service, start=start, end=end, language=language, view=view
+    )
+    transform = try_to(lambda v: v)
+    return await stream_json_array(transform(res))
+
+
+@app.get("/api/{language}/export", response_class=StreamingResponse)
+async def api_export_songs(
+    language: str,
+    since_number: Optional[int] = Query(default=None, ge=0),
+    since_title: Optional[str] = None,
+    view: SongView = SongView.FULL,
+    api_key: str = Security(_get_api_key),
+):
+    """Streams all the songs of the language as newline-delimited JSON, one song per line, ordered by number and title.
+
+    The songs are read a batch at a time, so that the whole hymnal is exported in bounded memory.
+    An interrupted export is resumed by passing the number and title of the last song got
+    as `since_number` and `since_title`; without `since_title`, all the songs of `since_number` are skipped.
+    If `view` is 'summary', the songs are returned without their lines.
+    If `view` is 'compact', the lines are encoded as arrays of note codes, words and line offsets
+    """
+    res = await hymns.export_songs(
+        hymns_service,
+        language=language,
+        since_number=since_number,
+        since_title=since_title,
+        view=view,
+    )
+    transform = try_to(lambda v: v)
+    return await stream_ndjson(transform(res))
+
+
 @app.get("/api/{language}/{number}", response_model=SongDetail)
 async def api_get_song_detail(
+    request: Request,
+    response: Response,
     language: str,
     number: int,
     translation: List[str] = Query(default=()),
+    view: SongView = SongView.FULL,
     api_key: str = Security(_get_api_key),
+    _reads: None = Depends(_consistent_reads),
 ):
-    """Displays the details of the song whose number is given"""
+    """Displays the details of the song whose number is given
+
+    If `view` is 'summary', the songs are returned without their lines.
+    If `view` is 'compact', the lines are encoded as arrays of note codes, words and line offsets.
+    The response has an ETag and a Last-Modified header, got from the times the songs were last changed,
+    such that a conditional request for unchanged songs gets a 304 Not Modified without the songs being fetched.
+    """
     languages = [language, *translation]
+    res = await hymns.get_song_versions(
+        hymns_service, number=number, languages=languages
+    )
+    versions = try_to(lambda v: v)(res)
+    updated_times = [v.updated_at for v in versions]
+    if None not in updated_times:
+        last_modified = max(updated_times)
+        etag = get_etag(number, view, [(v.language, v.updated_at) for v in versions])
+        headers = get_validator_headers(etag, last_modified=last_modified)
+        if is_not_modified(request, etag=etag, last_modified=last_modified):
+            return get_not_modified_response(headers)
+        response.headers.update(headers)
+
     song = SongDetail(number=number, translations={})
 
     for lang in languages:
         _translation = await _get_song(language=lang, number=number)
-        song.translations[lang] = _translation
+        song.translations[lang] = _to_view(_translation, view=view)
 
     return song
 
 
-@app.get("/api/{language}/find-by-title/{q}", response_model=PaginatedResponse)
+@app.get(
+    "/api/{language}/find-by-title/{q}",
+    response_model=PaginatedResponse,
+    response_model_exclude_none=True,
+)
 async def api_query_by_title(
+    request: Request,
+    response: Response,
     language: str,
     q: str,
     skip: int = 0,
     limit: int = 0,
+    with_total: bool = False,
+    view: SongView = SongView.FULL,
     api_key: str = Security(_get_api_key),
+    _reads: None = Depends(_consistent_reads),
 ):
-    """Returns list of songs whose titles match the search term `q`"""
+    """Returns list of songs whose titles match the search term `q`.
+
+    If `with_total` is true, the total number of matching songs, capped at 10,000, is also returned.
+    If `view` is 'summary', the songs are returned without their lines.
+    If `view` is 'compact', the lines are encoded as arrays of note codes, words and line offsets.
+    The response has an ETag got from the version of the songs of the language, such that a conditional
+    request gets a 304 Not Modified without searching if no song of the language has changed since.
+    """
+    headers = await _get_language_validator_headers(language)
+    if is_not_modified(request, etag=headers["ETag"]):
+        return get_not_modified_response(headers)
+    response.headers.update(headers)
+
     res = await hymns.query_songs_by_title(
-        hymns_service, q=q, language=language, skip=skip, limit=limit
+        hymns_service,
+        q=q,
+        language=language,
+        skip=skip,
+        limit=limit,
+        with_total=with_total,
+        view=view,
     )
     transform = try_to(lambda v: v)
     return transform(res)
 
 
-@app.get("/api/{language}/find-by-number/{q}", response_model=PaginatedResponse)
+@app.get(
+    "/api/{language}/find-by-number/{q}",
+    response_model=PaginatedResponse,
+    response_model_exclude_none=True,
+)
 async def api_query_by_number(
+    request: Request,
+    response: Response,
     language: str,
     q: int,
     skip: int = 0,
     limit: int = 0,
+    with_total: bool = False,
+    view: SongView = SongView.FULL,
     api_key: str = Security(_get_api_key),
+    _reads: None = Depends(_consistent_reads),
 ):
-    """Returns list of songs whose numbers match the search term `q`"""
+    """Returns list of songs whose numbers match the search term `q`.
+
+    If `with_total` is true, the total number of matching songs, capped at 10,000, is also returned.
+    If `view` is 'summary', the songs are returned without their lines.
+    If `view` is 'compact', the lines are encoded as arrays of note codes, words and line offsets.
+    The response has an ETag got from the version of the songs of the language, such that a conditional
+    request gets a 304 Not Modified without searching if no song of the language has changed since.
+    """
+    headers = await _get_language_validator_headers(language)
+    if is_not_modified(request, etag=headers["ETag"]):
+        return get_not_modified_response(headers)
+    response.headers.update(headers)
+
     res = await hymns.query_songs_by_number(
-        hymns_service, q=q, language=language, skip=skip, limit=limit
+        hymns_service,
+        q=q,
+        language=language,
+        skip=skip,
+        limit=limit,
+        with_total=with_total,
+        view=view,
     )
     transform = try_to(lambda v: v)
     return transform(res)
@@ -252,6 +478,24 @@ async def api_update_song(
     return transform(res)
 
 
+@app.patch("/api/{language}/{number}", response_model=Song)
+async def api_patch_song(
+    language: str,
+    number: int,
+    patch: SongPatch,
+    user: UserDTO = Depends(_get_current_user),
+):
+    """Changes the key and replaces, inserts or deletes lines of the song whose number is given.
+
+    The line operations are applied in order within the database, without resending or rewriting the whole song.
+    """
+    res = await hymns.patch_song(
+        hymns_service, number=number, language=language, patch=patch
+    )
+    transform = try_to(lambda v: v)
+    return transform(res)
+
+
 @app.delete("/api/{language}/{number}", response_model=List[Song])
 async def api_delete_song(
     language: str, number: int, user: UserDTO = Depends(_get_current_user)
@@ -270,6 +514,25 @@ async def api_create_song(song: Song, user: UserDTO = Depends(_get_current_user)
     return transform(res)
 
 
+@app.post("/api/bulk", response_model=ImportReport)
+async def api_import_songs(
+    request: Request,
+    batch_size: int = Query(default=1_000, ge=1),
+    user: UserDTO = Depends(_get_authenticated_user),
+):
+    """API route that imports the songs of a JSON array or of newline-delimited JSON in the request body.
+
+    The body is parsed as it is received, and the songs are upserted in batches, one round trip per language.
+    Each batch is committed on its own, not in a unit of work, so a failing batch leaves the earlier ones imported.
+    The errors of the invalid records are returned by their positions, the rest of the songs being imported.
+    """
+    res = await hymns.import_songs(
+        hymns_service, records=parse_records(request.stream()), batch_size=batch_size
+    )
+    transform = try_to(lambda v: v)
+    return transform(res)
+
+
 @app.get("/login", response_class=HTMLResponse)
 async def login(request: Request):
     """HTML template route that logins in admin users"""
@@ -312,6 +575,63 @@ async def admin_home(request: Request, user: UserDTO = Depends(_get_current_user
     return templates.TemplateResponse("index.html", {"request": request})
 
 
+def _to_view(song: Song, view: SongView) -> Union[Song, SongSummary, CompactSong]:
+    """Converts the song into the given view"""
+    if view == SongView.COMPACT:
+        return CompactSong.from_song(song)
+    elif view == SongView.SUMMARY:
+        return SongSummary(**song.dict())
+    return song
+
+
+async def _run_batch_operation(operation: BatchOperation) -> BatchResult:
+    """Runs one read operation of a batch request, converting its errors into its result"""
+    op, language, view = operation.op, operation.language, operation.view
+    search_params = dict(
+        skip=operation.skip,
+        limit=operation.limit,
+        with_total=operation.with_total,
+        view=view,
+    )
+
+    if op == BatchOperationType.GET_BY_NUMBER:
+        res = await hymns.get_song_by_number(
+            hymns_service, number=int(operation.q), language=language
+        )
+        transform = try_to(lambda v: _to_view(v, view=view))
+    elif op == BatchOperationType.GET_BY_TITLE:
+        res = await hymns.get_song_by_title(
+            hymns_service, title=operation.q, language=language
+        )
+        transform = try_to(lambda v: _to_view(v, view=view))
+    elif op == BatchOperationType.FIND_BY_NUMBER:
+        res = await hymns.query_songs_by_number(
+            hymns_service, q=int(operation.q), language=language, **search_params
+        )
+        transform = try_to(lambda v: v)
+    else:
+        res = await hymns.query_songs_by_title(
+            hymns_service, q=operation.q, language=language, **search_params
+        )
+        transform = try_to(lambda v: v)
+
+    try:
+        return BatchResult(status=status.HTTP_200_OK, data=transform(res))
+    except HTTPException as exp:
+        return BatchResult(status=exp.status_code, detail=exp.detail)
+
+
+async def _get_language_validator_headers(language: str) -> Dict[str, str]:
+    """Gets the ETag header of the searches of the songs of the given language, got from its version
+
+    The version is read before the songs, within the consistent reads of the request, so the songs got
+    afterwards, from the same replica or in the same causally consistent session, are at least as new as the ETag.
+    """
+    res = await hymns.get_language_version(hymns_service, language=language)
+    version = try_to(lambda v: v)(res)
+    return get_validator_headers(get_etag(language, version))
+
+
 async def _get_song(language: str, number: int) -> Song:
     """Gets the song for the given language and song number"""
     res = await hymns.get_song_by_number(
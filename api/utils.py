@@ -1,7 +1,14 @@
-from typing import Any, Callable, TypeVar
+import hashlib
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Callable, TypeVar, AsyncIterator, List, Optional, Dict
 
 import funml as ml
 from fastapi import HTTPException, status
+from fastapi.requests import Request
+from fastapi.responses import StreamingResponse, Response
+from pydantic import BaseModel
 
 import services
 
@@ -36,12 +43,177 @@ def raise_http_error(exp: Exception):
         HTTPException: the `exp` with an appropriate status code
     """
     code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    headers = None
 
     if isinstance(exp, services.errors.NotFoundError):
         code = status.HTTP_404_NOT_FOUND
     elif isinstance(exp, services.hymns.errors.ValidationError):
         code = status.HTTP_400_BAD_REQUEST
+    elif isinstance(exp, services.hymns.errors.ReadOnlyError):
+        code = status.HTTP_405_METHOD_NOT_ALLOWED
     elif isinstance(exp, services.auth.errors.AuthenticationError):
         code = status.HTTP_403_FORBIDDEN
+    elif isinstance(exp, services.errors.StoreOverloadedError):
+        code = status.HTTP_503_SERVICE_UNAVAILABLE
+        headers = {"Retry-After": f"{exp.retry_after}"}
+    elif isinstance(exp, services.errors.StoreTimeoutError):
+        code = status.HTTP_504_GATEWAY_TIMEOUT
 
-    raise HTTPException(status_code=code, detail=f"{exp}")
+    raise HTTPException(status_code=code, detail=f"{exp}", headers=headers)
+
+
+async def stream_json_array(
+    batches: AsyncIterator[List[BaseModel]],
+) -> StreamingResponse:
+    """Creates a response streaming the batches of models as one JSON array, a batch at a time.
+
+    The first batch is got before responding so that its errors are raised as HTTP exceptions.
+    Later errors can only cut the array short, as the status code has been sent by then.
+
+    Args:
+        batches: the async iterator of the batches of models
+
+    Returns:
+        the StreamingResponse whose body is the JSON array of all the models
+
+    Raises:
+        HTTPException: the error got while getting the first batch, with an appropriate status code
+    """
+    try:
+        first_batch = await anext(batches, [])
+    except Exception as exp:
+        raise_http_error(exp)
+
+    return StreamingResponse(
+        _iter_json_array(first_batch, batches), media_type="application/json"
+    )
+
+
+async def _iter_json_array(
+    first_batch: List[BaseModel], batches: AsyncIterator[List[BaseModel]]
+) -> AsyncIterator[str]:
+    """Iterates over the chunks of the JSON array of the models of the first batch and of the rest of the batches"""
+    yield "["
+    separator = ""
+    batch = first_batch
+    while True:
+        if len(batch) > 0:
+            yield separator + ",".join(item.json() for item in batch)
+            separator = ","
+
+        batch = await anext(batches, None)
+        if batch is None:
+            break
+    yield "]"
+
+
+async def stream_ndjson(
+    batches: AsyncIterator[List[BaseModel]],
+) -> StreamingResponse:
+    """Creates a response streaming the batches of models as newline-delimited JSON, one model per line.
+
+    The first batch is got before responding so that its errors are raised as HTTP exceptions.
+    Later errors can only cut the stream short, as the status code has been sent by then,
+    but every line sent is a whole model, so clients can resume after the last one they got.
+
+    Args:
+        batches: the async iterator of the batches of models
+
+    Returns:
+        the StreamingResponse whose body has the JSON of each model on its own line
+
+    Raises:
+        HTTPException: the error got while getting the first batch, with an appropriate status code
+    """
+    try:
+        first_batch = await anext(batches, [])
+    except Exception as exp:
+        raise_http_error(exp)
+
+    return StreamingResponse(
+        _iter_ndjson(first_batch, batches), media_type="application/x-ndjson"
+    )
+
+
+async def _iter_ndjson(
+    first_batch: List[BaseModel], batches: AsyncIterator[List[BaseModel]]
+) -> AsyncIterator[str]:
+    """Iterates over the chunks of the NDJSON of the models of the first batch and of the rest of the batches"""
+    batch = first_batch
+    while batch is not None:
+        if len(batch) > 0:
+            yield "".join(f"{item.json()}\n" for item in batch)
+        batch = await anext(batches, None)
+
+
+def get_etag(*parts: Any) -> str:
+    """Gets the strong entity tag of the response identified by the given JSON-serializable parts e.g. versions
+
+    Args:
+        parts: the values that change whenever the response changes
+
+    Returns:
+        the quoted entity tag for the ETag header
+    """
+    data = json.dumps(parts, default=str, separators=(",", ":"))
+    return f'"{hashlib.sha256(data.encode()).hexdigest()[:32]}"'
+
+
+def get_validator_headers(
+    etag: str, last_modified: Optional[datetime] = None
+) -> Dict[str, str]:
+    """Gets the ETag and, if `last_modified` is given, the Last-Modified headers of a response"""
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(_to_utc(last_modified), usegmt=True)
+    return headers
+
+
+def is_not_modified(
+    request: Request, etag: str, last_modified: Optional[datetime] = None
+) -> bool:
+    """Checks whether the client already has the current response, given its conditional headers.
+
+    If-None-Match takes precedence over If-Modified-Since, as the latter is only precise to the second.
+
+    Args:
+        request: the request, with If-None-Match or If-Modified-Since headers or not
+        etag: the entity tag of the current response
+        last_modified: the time the current response last changed, if known
+
+    Returns:
+        True if the client's copy is current and a 304 Not Modified response can be sent
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {_strip_weak_prefix(tag.strip()) for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+    # Last-Modified is sent with a precision of seconds
+    return _to_utc(last_modified).replace(microsecond=0) <= _to_utc(since)
+
+
+def get_not_modified_response(headers: Dict[str, str]) -> Response:
+    """Creates the body-less 304 Not Modified response with the given validator headers"""
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+
+def _strip_weak_prefix(tag: str) -> str:
+    """Removes the W/ prefix of a weak entity tag, as If-None-Match is compared weakly"""
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def _to_utc(value: datetime) -> datetime:
+    """Converts the datetime to UTC, treating naive datetimes as UTC already"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
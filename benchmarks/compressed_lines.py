@@ -0,0 +1,183 @@
+"""Compares the size and read latency of songs whose lines are saved uncompressed and dictionary-compressed
+
+Usage:
+    python -m benchmarks.compressed_lines [postgres-uri] [iterations]
+
+The songs are written to the `Benchmark` language of the database at the given uri,
+and deleted afterwards.
+"""
+import asyncio
+import random
+import statistics
+import sys
+import time
+import zlib
+from typing import Callable, Awaitable, List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from services.hymns.models import Song, LineSection
+from services.store import Store, PgConfig, PgStore
+from services.store.utils.compression import (
+    conv_lines_to_json,
+    train_dictionary,
+    compress,
+    decompress,
+)
+from services.store.utils.uri import get_pg_async_uri
+from services.types import MusicalNote
+
+_language = "Benchmark"
+_number_of_songs = 500
+_phrases = [
+    "Praise the Lord",
+    "Hallelujah",
+    "Glory to God in the highest",
+    "Amen",
+    "Holy, holy, holy",
+    "Lord God Almighty",
+    "O come let us adore Him",
+    "Great is Thy faithfulness",
+    "Blessed assurance, Jesus is mine",
+    "How great Thou art",
+    "Jesus loves me, this I know",
+    "Morning by morning new mercies I see",
+]
+
+
+def _get_songs() -> List[Song]:
+    """Gets songs whose verses and choruses repeat the same phrases, as hymns do"""
+    rand = random.Random(42)
+    notes = [*MusicalNote][:8]
+
+    def get_line(suffix: str = "") -> List[LineSection]:
+        return [
+            LineSection(
+                note=rand.choice(notes), words=f"{rand.choice(_phrases)}{suffix}"
+            )
+            for _ in range(4)
+        ]
+
+    songs = []
+    for number in range(1, _number_of_songs + 1):
+        chorus = [get_line() for _ in range(2)]
+        lines = []
+        for verse in range(rand.randint(2, 5)):
+            lines.extend(get_line(f" {verse}") for _ in range(3))
+            lines.extend(chorus)
+
+        songs.append(
+            Song(
+                number=number,
+                language=_language,
+                title=f"Song {number}",
+                key=MusicalNote.C_MAJOR,
+                lines=lines,
+            )
+        )
+    return songs
+
+
+async def _measure(name: str, iterations: int, fn: Callable[[int], Awaitable]):
+    """Runs `fn` sequentially for the given number of iterations, printing the latency and CPU time per call"""
+    latencies = []
+    cpu_start = time.process_time()
+    for i in range(iterations):
+        start = time.perf_counter()
+        await fn(i)
+        latencies.append(time.perf_counter() - start)
+    cpu_per_call = (time.process_time() - cpu_start) / iterations
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1_000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1_000
+    print(
+        f"{name:<32} p50: {p50:.3f}ms  p99: {p99:.3f}ms  cpu/call: {cpu_per_call * 1_000:.3f}ms"
+    )
+
+
+def _compare_payloads(songs: List[Song]):
+    """Prints the sizes of the lines, deflated with and without a dictionary, and the cost of inflating them"""
+    payloads = [conv_lines_to_json(song.lines, compact=False) for song in songs]
+    dictionary = train_dictionary(payload.encode() for payload in payloads)
+    compressed = [compress(payload, dictionary) for payload in payloads]
+
+    raw_size = sum(len(payload.encode()) for payload in payloads)
+    deflated_size = sum(len(zlib.compress(p.encode(), 9)) for p in payloads)
+    compressed_size = sum(len(data) for data in compressed)
+    print(f"{'lines as JSON':<32} {raw_size / len(songs):.0f} bytes/song")
+    print(f"{'deflated':<32} {deflated_size / len(songs):.0f} bytes/song")
+    print(
+        f"{'deflated with dictionary':<32} {compressed_size / len(songs):.0f} bytes/song"
+        f"  ratio: {raw_size / compressed_size:.1f}"
+    )
+
+    start = time.perf_counter()
+    for data in compressed:
+        decompress(data, dictionary)
+    per_song = (time.perf_counter() - start) / len(compressed)
+    print(f"{'inflate with dictionary':<32} {per_song * 1_000_000:.1f}us/song")
+
+
+async def _get_stored_size(uri: str) -> int:
+    """Gets the number of bytes taken by the lines of the benchmark songs in the database"""
+    engine = create_async_engine(get_pg_async_uri(uri))
+    try:
+        async with engine.connect() as conn:
+            res = await conn.execute(
+                text(
+                    "SELECT sum(coalesce(pg_column_size(lines), 0) "
+                    "+ coalesce(pg_column_size(compressed_lines), 0)) "
+                    "FROM songs WHERE language = :lang"
+                ),
+                {"lang": _language},
+            )
+            return res.scalar() or 0
+    finally:
+        await engine.dispose()
+
+
+async def _run(uri: str, iterations: int):
+    """Benchmarks the reads of uncompressed and compressed songs"""
+    songs = _get_songs()
+    _compare_payloads(songs)
+
+    for compress_lines in (False, True):
+        conf = PgConfig(compress_lines=compress_lines)
+        titles_store = Store.retrieve_store(
+            uri=uri, name=f"{_language}_title", model=Song, options=conf
+        )
+        await titles_store.set_many([(song.title, song) for song in songs])
+        if compress_lines:
+            await titles_store.train_compression_dictionary()
+            await titles_store.set_many([(song.title, song) for song in songs])
+
+        label = "compressed" if compress_lines else "uncompressed"
+        stored_size = await _get_stored_size(uri)
+        print(f"{label + ' stored':<32} {stored_size / len(songs):.0f} bytes/song")
+
+        async def get_by_title(i: int):
+            await titles_store.get(f"Song {i % _number_of_songs + 1}")
+
+        async def search_by_title(i: int):
+            await titles_store.search(f"song {i % 50 + 1}", limit=10)
+
+        # warm up the pool and the dictionary cache
+        await _measure(f"{label} warm-up", 50, get_by_title)
+        await _measure(f"{label} get by title", iterations, get_by_title)
+        await _measure(f"{label} search by title", iterations, search_by_title)
+
+        for song in songs:
+            await titles_store.delete(song.title)
+        await PgStore._clean_up()
+
+
+if __name__ == "__main__":
+    db_uri = (
+        sys.argv[1]
+        if len(sys.argv) > 1
+        else "postgresql://postgres@127.0.0.1:5432/test_hymns_api_db"
+    )
+    number_of_iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+    asyncio.run(_run(db_uri, number_of_iterations))
@@ -0,0 +1,103 @@
+"""Compares the per-request latency and CPU time of postgres song reads via SQLAlchemy and via the asyncpg fast path
+
+Usage:
+    python -m benchmarks.pg_fast_reads [postgres-uri] [iterations]
+
+The songs are written to the `Benchmark` language of the database at the given uri,
+and deleted afterwards.
+"""
+import asyncio
+import statistics
+import sys
+import time
+from typing import Callable, Awaitable, List
+
+from services.hymns.models import Song, LineSection
+from services.store import Store, PgConfig, PgStore
+from services.types import MusicalNote
+
+_language = "Benchmark"
+_number_of_songs = 500
+
+
+def _get_songs() -> List[Song]:
+    """Gets the songs to read during the benchmark"""
+    lines = [
+        [
+            LineSection(note=MusicalNote.C_MAJOR, words="The song"),
+            LineSection(note=MusicalNote.G_MAJOR, words="is starting"),
+            LineSection(note=MusicalNote.A_MINOR, words="It really"),
+            LineSection(note=MusicalNote.F_MAJOR, words="is starting"),
+        ]
+    ] * 8
+    return [
+        Song(
+            number=number,
+            language=_language,
+            title=f"Song {number}",
+            key=MusicalNote.C_MAJOR,
+            lines=lines,
+        )
+        for number in range(1, _number_of_songs + 1)
+    ]
+
+
+async def _measure(name: str, iterations: int, fn: Callable[[int], Awaitable]):
+    """Runs `fn` sequentially for the given number of iterations, printing the latency and CPU time per call"""
+    latencies = []
+    cpu_start = time.process_time()
+    for i in range(iterations):
+        start = time.perf_counter()
+        await fn(i)
+        latencies.append(time.perf_counter() - start)
+    cpu_per_call = (time.process_time() - cpu_start) / iterations
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1_000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1_000
+    print(
+        f"{name:<32} p50: {p50:.3f}ms  p99: {p99:.3f}ms  cpu/call: {cpu_per_call * 1_000:.3f}ms"
+    )
+
+
+async def _run(uri: str, iterations: int):
+    """Benchmarks the reads via SQLAlchemy and via the fast path"""
+    songs = _get_songs()
+
+    for fast_reads in (False, True):
+        conf = PgConfig(fast_reads=fast_reads)
+        numbers_store = Store.retrieve_store(
+            uri=uri, name=f"{_language}_number", model=Song, options=conf
+        )
+        titles_store = Store.retrieve_store(
+            uri=uri, name=f"{_language}_title", model=Song, options=conf
+        )
+        for song in songs:
+            await numbers_store.set(f"{song.number}", song)
+
+        label = "asyncpg" if fast_reads else "sqlalchemy"
+
+        async def get_by_number(i: int):
+            await numbers_store.get(f"{i % _number_of_songs + 1}")
+
+        async def search_by_title(i: int):
+            await titles_store.search(f"song {i % 50 + 1}", limit=10)
+
+        # warm up the pools and the statement caches
+        await _measure(f"{label} warm-up", 50, get_by_number)
+        await _measure(f"{label} get by number", iterations, get_by_number)
+        await _measure(f"{label} search by title", iterations, search_by_title)
+
+        for song in songs:
+            await numbers_store.delete(f"{song.number}")
+        await PgStore._clean_up()
+
+
+if __name__ == "__main__":
+    db_uri = (
+        sys.argv[1]
+        if len(sys.argv) > 1
+        else "postgresql://postgres@127.0.0.1:5432/test_hymns_api_db"
+    )
+    number_of_iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+    asyncio.run(_run(db_uri, number_of_iterations))
@@ -6,6 +6,9 @@ from .auth import (
     initialize,
     shutdown,
 )
+from .migrate import dump, restore, copy
+from .compression import train_dictionaries
+from .songs import import_songs
 
 __all__ = [
     "change_password",
@@ -14,4 +17,9 @@ __all__ = [
     "login",
     "initialize",
     "shutdown",
+    "dump",
+    "restore",
+    "copy",
+    "train_dictionaries",
+    "import_songs",
 ]
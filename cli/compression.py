@@ -0,0 +1,56 @@
+"""CLI utilities for compressing the lines of songs with dictionaries trained on each language"""
+import dataclasses
+from typing import List, Optional
+
+import settings
+from services.hymns.utils.init import initialize_one_language_store
+
+
+@dataclasses.dataclass
+class TrainedDictionary:
+    """The dictionary trained on the songs of one language"""
+
+    language: str
+    dictionary_id: str
+    recompressed: int
+
+
+async def train_dictionaries(
+    languages: Optional[List[str]] = None,
+    sample_size: int = 1_000,
+    recompress: bool = False,
+    batch_size: int = 500,
+) -> List[TrainedDictionary]:
+    """Trains a compression dictionary on the songs of each language, with which new songs are compressed
+
+    Args:
+        languages: the languages to train dictionaries for. Default: all languages in the settings
+        sample_size: the maximum number of songs per language to train on
+        recompress: whether to re-save all songs so that they are compressed with the new dictionary
+        batch_size: the number of songs re-saved at a time when recompressing
+
+    Returns:
+        the dictionary of each language, with the number of songs recompressed
+    """
+    settings.initialize()
+    # compression is forced on so that the dictionaries are trained even before the setting is rolled out
+    conf = settings.get_hymns_service_config().copy(update={"compress_lines": True})
+    uri = settings.get_hymns_db_uri()
+
+    results = []
+    for lang in languages or conf.languages:
+        store = initialize_one_language_store(
+            conf=conf, uri=uri, lang=lang
+        ).titles_store
+        dictionary_id = await store.train_compression_dictionary(sample_size)
+        if dictionary_id is None:
+            raise ValueError(f"the store of {lang} does not support compression")
+
+        recompressed = 0
+        if recompress:
+            async for batch, _ in store.scan(batch_size=batch_size):
+                await store.set_many([(song.title, song) for song in batch])
+                recompressed += len(batch)
+
+        results.append(TrainedDictionary(lang, dictionary_id, recompressed))
+    return results
@@ -0,0 +1,514 @@
+"""CLI utilities for dumping, restoring and copying all the data of the app across databases"""
+import asyncio
+import dataclasses
+import hashlib
+import json
+import os
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+from urllib.parse import quote
+
+from pydantic import BaseModel
+
+from services import config
+from services.auth.models import Application, UserInDb
+from services.hymns.models import Song
+from services.hymns.utils.init import initialize_one_language_store
+from services.hymns.utils.versions import bump_language_version
+from services.store import Store
+
+_manifest_file_name = "manifest.json"
+_dump_version = 1
+_songs_dataset_prefix = "songs."
+# digests are sums of the hashes of the records, so that they do not depend on the order of the records
+_digest_modulus = 2**256
+
+Cursor = Optional[List[Any]]
+
+
+@dataclasses.dataclass
+class TransferStats:
+    """The outcome of the transfer of one dataset e.g. the songs of one language"""
+
+    name: str
+    count: int
+    seconds: float
+    digest: str
+
+    @property
+    def throughput(self) -> float:
+        """The number of records transferred per second"""
+        return self.count / self.seconds if self.seconds > 0 else float(self.count)
+
+
+@dataclasses.dataclass
+class _Dataset:
+    """A set of records stored together e.g. users, or the songs of one language"""
+
+    name: str
+    model: Type[BaseModel]
+    get_key: Callable[[Any], str]
+    get_store: Callable[[config.ServiceConfig, str], Store]
+
+
+def _get_dataset(name: str) -> _Dataset:
+    """Gets the dataset of the given name e.g. config, users, apps, songs.English"""
+    if name == "config":
+        return _Dataset(
+            name,
+            model=config.ServiceConfig,
+            get_key=lambda _: "config",
+            get_store=lambda _, uri: config.get_config_store(uri),
+        )
+    elif name == "users":
+        return _Dataset(
+            name,
+            model=UserInDb,
+            get_key=lambda v: v.username,
+            get_store=config.get_users_store,
+        )
+    elif name == "apps":
+        return _Dataset(
+            name,
+            model=Application,
+            get_key=lambda v: v.key,
+            get_store=config.get_auth_store,
+        )
+
+    lang = name[len(_songs_dataset_prefix) :]
+    return _Dataset(
+        name,
+        model=Song,
+        get_key=lambda v: v.title,
+        get_store=lambda conf, uri: initialize_one_language_store(
+            conf, uri, lang
+        ).titles_store,
+    )
+
+
+class _StoreEndpoint:
+    """Reads and writes the datasets of the database at the given uri through its stores"""
+
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.__conf: Optional[config.ServiceConfig] = None
+
+    async def get_service_config(self) -> config.ServiceConfig:
+        """Gets the saved config of the database e.g. with the databases of its languages, or the default one"""
+        if self.__conf is None:
+            try:
+                self.__conf = await config.get_service_config(self.uri)
+            except ValueError:
+                return config.ServiceConfig()
+        return self.__conf
+
+    async def get_dataset_names(self) -> List[str]:
+        """Gets the names of the datasets in the database; the languages are those of its config"""
+        try:
+            conf = await config.get_service_config(self.uri)
+        except ValueError:
+            return ["users", "apps"]
+
+        songs = [f"{_songs_dataset_prefix}{lang}" for lang in conf.languages]
+        return ["config", "users", "apps", *songs]
+
+    async def open(self, name: str, state: Dict[str, Any]):
+        """Prepares the dataset for writing, resuming from the given checkpoint state"""
+
+    async def read(
+        self, name: str, batch_size: int, cursor: Cursor
+    ) -> AsyncIterator[Tuple[List[BaseModel], Cursor]]:
+        """Streams the records of the dataset in batches, each with the cursor of its last record"""
+        dataset = _get_dataset(name)
+        store = dataset.get_store(await self.get_service_config(), self.uri)
+        async for batch, after in store.scan(batch_size=batch_size, after=cursor):
+            yield batch, after
+
+    async def write(self, name: str, batch: List[BaseModel]) -> Dict[str, Any]:
+        """Upserts the batch of records in one round trip, returning the state to checkpoint"""
+        dataset = _get_dataset(name)
+        conf = await self.get_service_config()
+        store = dataset.get_store(conf, self.uri)
+        await store.set_many([(dataset.get_key(v), v) for v in batch])
+        if name == "config":
+            # the stores of the other datasets are to follow the config just written
+            self.__conf = None
+        elif name.startswith(_songs_dataset_prefix):
+            lang = name[len(_songs_dataset_prefix) :]
+            lang_store = initialize_one_language_store(conf, self.uri, lang)
+            await bump_language_version(lang_store.versions_store, lang)
+        return {}
+
+
+class _DumpEndpoint:
+    """Reads and writes the datasets as newline-delimited JSON files in the dump folder at the given path"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @property
+    def manifest_path(self) -> str:
+        """The path to the manifest listing the datasets of the dump with their counts and digests"""
+        return os.path.join(self.path, _manifest_file_name)
+
+    def get_manifest(self) -> Dict[str, Any]:
+        """Gets the manifest of the dump
+
+        Raises:
+            ValueError: the dump is incomplete or was made by an incompatible version
+        """
+        try:
+            with open(self.manifest_path) as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            raise ValueError(f"no complete dump found at {self.path}")
+
+        if manifest.get("version") != _dump_version:
+            raise ValueError(f"unsupported dump version {manifest.get('version')}")
+        return manifest
+
+    def save_manifest(self, stats: List[TransferStats]):
+        """Saves the manifest of the complete dump"""
+        manifest = {
+            "version": _dump_version,
+            "datasets": {s.name: {"count": s.count, "digest": s.digest} for s in stats},
+        }
+        _write_json_atomically(self.manifest_path, manifest)
+
+    async def get_dataset_names(self) -> List[str]:
+        """Gets the names of the datasets in the dump"""
+        return [*self.get_manifest()["datasets"].keys()]
+
+    async def open(self, name: str, state: Dict[str, Any]):
+        """Discards whatever was written to the dataset's file after the last checkpointed batch"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.__get_file_path(name), "ab") as file:
+            file.truncate(state.get("offset", 0))
+
+    async def read(
+        self, name: str, batch_size: int, cursor: Cursor
+    ) -> AsyncIterator[Tuple[List[BaseModel], Cursor]]:
+        """Streams the records of the dataset's file in batches; the cursor is the number of lines read"""
+        model = _get_dataset(name).model
+        lines_read = 0 if cursor is None else cursor[0]
+
+        with open(self.__get_file_path(name), "rb") as file:
+            for _ in range(lines_read):
+                file.readline()
+
+            batch = []
+            for line in file:
+                batch.append(model.parse_raw(line))
+                if len(batch) == batch_size:
+                    lines_read += len(batch)
+                    yield batch, [lines_read]
+                    batch = []
+
+            if len(batch) > 0:
+                yield batch, [lines_read + len(batch)]
+
+    async def write(self, name: str, batch: List[BaseModel]) -> Dict[str, Any]:
+        """Appends the batch of records to the dataset's file, returning the file size to checkpoint"""
+        data = b"".join(f"{_to_canonical_json(v)}\n".encode() for v in batch)
+        with open(self.__get_file_path(name), "ab") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+            return {"offset": file.tell()}
+
+    def __get_file_path(self, name: str) -> str:
+        """Gets the path of the file of the given dataset"""
+        return os.path.join(self.path, f"{quote(name, safe='')}.ndjson")
+
+
+class _Checkpoint:
+    """The progress of each dataset of a run, saved after each batch so that an interrupted run can resume"""
+
+    def __init__(self, path: str):
+        self.__path = path
+        try:
+            with open(path) as file:
+                self.__states: Dict[str, Dict[str, Any]] = json.load(file)
+        except FileNotFoundError:
+            self.__states = {}
+
+    def get(self, name: str) -> Dict[str, Any]:
+        """Gets the saved state of the given dataset"""
+        return self.__states.get(name, {})
+
+    def update(self, name: str, **state: Any):
+        """Updates the state of the given dataset, saving it"""
+        self.__states[name] = {**self.get(name), **state}
+        _write_json_atomically(self.__path, self.__states)
+
+    def remove(self):
+        """Removes the saved checkpoint after a successful run"""
+        if os.path.exists(self.__path):
+            os.remove(self.__path)
+
+
+async def dump(
+    uri: str,
+    path: str,
+    batch_size: int = 500,
+    concurrency: int = 4,
+    checkpoint_path: Optional[str] = None,
+) -> List[TransferStats]:
+    """Dumps the config, users, apps and songs of the database at `uri` into the dump folder at `path`
+
+    Args:
+        uri: the uri of the database
+        path: the path to the dump folder, created if it does not exist
+        batch_size: the number of records read and written at a time
+        concurrency: the number of datasets e.g. languages transferred concurrently
+        checkpoint_path: the path of the checkpoint for resuming. Default: a file in the dump folder
+
+    Returns:
+        the statistics of each dataset
+    """
+    sink = _DumpEndpoint(path)
+    if checkpoint_path is None:
+        os.makedirs(path, exist_ok=True)
+        checkpoint_path = os.path.join(path, ".checkpoint.json")
+
+    checkpoint = _Checkpoint(checkpoint_path)
+    stats = await _transfer_all(
+        _StoreEndpoint(uri),
+        sink,
+        checkpoint=checkpoint,
+        batch_size=batch_size,
+        concurrency=concurrency,
+    )
+    sink.save_manifest(stats)
+    checkpoint.remove()
+    return stats
+
+
+async def restore(
+    path: str,
+    uri: str,
+    batch_size: int = 500,
+    concurrency: int = 4,
+    checkpoint_path: Optional[str] = None,
+) -> List[TransferStats]:
+    """Restores the dump at `path` into the database at `uri`, upserting its records
+
+    Args:
+        path: the path to the dump folder
+        uri: the uri of the database
+        batch_size: the number of records read and written at a time
+        concurrency: the number of datasets e.g. languages transferred concurrently
+        checkpoint_path: the path of the checkpoint for resuming. Default: a file in the dump folder
+
+    Returns:
+        the statistics of each dataset
+
+    Raises:
+        ValueError: the dump is incomplete or its records do not match the counts and checksums of its manifest
+    """
+    source = _DumpEndpoint(path)
+    expected = source.get_manifest()["datasets"]
+    if checkpoint_path is None:
+        checkpoint_path = os.path.join(path, ".restore-checkpoint.json")
+
+    checkpoint = _Checkpoint(checkpoint_path)
+    stats = await _transfer_all(
+        source,
+        _StoreEndpoint(uri),
+        checkpoint=checkpoint,
+        batch_size=batch_size,
+        concurrency=concurrency,
+    )
+    _verify(stats, expected=expected)
+    checkpoint.remove()
+    return stats
+
+
+async def copy(
+    from_uri: str,
+    to_uri: str,
+    batch_size: int = 500,
+    concurrency: int = 4,
+    checkpoint_path: str = ".copy-checkpoint.json",
+    verify: bool = True,
+) -> List[TransferStats]:
+    """Copies the config, users, apps and songs of the database at `from_uri` into the one at `to_uri`
+
+    Args:
+        from_uri: the uri of the database to copy from
+        to_uri: the uri of the database to copy to, whose records of the same keys are overwritten
+        batch_size: the number of records read and written at a time
+        concurrency: the number of datasets e.g. languages transferred concurrently
+        checkpoint_path: the path of the checkpoint for resuming
+        verify: whether to read back the datasets from `to_uri` and compare their counts and checksums
+
+    Returns:
+        the statistics of each dataset
+
+    Raises:
+        ValueError: the copied datasets do not match those read
+    """
+    sink = _StoreEndpoint(to_uri)
+    checkpoint = _Checkpoint(checkpoint_path)
+    stats = await _transfer_all(
+        _StoreEndpoint(from_uri),
+        sink,
+        checkpoint=checkpoint,
+        batch_size=batch_size,
+        concurrency=concurrency,
+    )
+
+    if verify:
+        copied = await asyncio.gather(
+            *(_summarize(sink, s.name, batch_size=batch_size) for s in stats)
+        )
+        _verify(
+            copied,
+            expected={s.name: {"count": s.count, "digest": s.digest} for s in stats},
+        )
+
+    checkpoint.remove()
+    return stats
+
+
+async def _transfer_all(
+    source: Union[_StoreEndpoint, _DumpEndpoint],
+    sink: Union[_StoreEndpoint, _DumpEndpoint],
+    checkpoint: _Checkpoint,
+    batch_size: int,
+    concurrency: int,
+) -> List[TransferStats]:
+    """Transfers all datasets of the source to the sink, a few datasets at a time.
+
+    The config is transferred first, as it routes the songs of the sink's languages to their databases.
+    """
+    names = await source.get_dataset_names()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def transfer(name: str) -> TransferStats:
+        async with semaphore:
+            return await _transfer(source, sink, name, checkpoint, batch_size)
+
+    stats = []
+    if "config" in names:
+        names = [v for v in names if v != "config"]
+        stats.append(await transfer("config"))
+
+    stats.extend(await asyncio.gather(*(transfer(name) for name in names)))
+    return stats
+
+
+async def _transfer(
+    source: Union[_StoreEndpoint, _DumpEndpoint],
+    sink: Union[_StoreEndpoint, _DumpEndpoint],
+    name: str,
+    checkpoint: _Checkpoint,
+    batch_size: int,
+) -> TransferStats:
+    """Streams the dataset from the source to the sink, checkpointing after each batch.
+
+    The next batch is read while the current one is written, and at most two batches are queued,
+    so memory use is bounded by the batch size, not the size of the dataset.
+    """
+    state = checkpoint.get(name)
+    count = state.get("count", 0)
+    digest = int(state.get("digest", "0"), 16)
+    seconds = state.get("seconds", 0.0)
+    if state.get("done", False):
+        return TransferStats(name, count=count, seconds=seconds, digest=f"{digest:x}")
+
+    await sink.open(name, state)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+
+    async def produce():
+        async for item in source.read(name, batch_size, state.get("cursor")):
+            await queue.put(item)
+        await queue.put(None)
+
+    start = time.perf_counter()
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+
+            batch, cursor = item
+            sink_state = await sink.write(name, batch)
+            count += len(batch)
+            digest = (digest + _get_digest(batch)) % _digest_modulus
+            checkpoint.update(
+                name,
+                cursor=cursor,
+                count=count,
+                digest=f"{digest:x}",
+                seconds=seconds + time.perf_counter() - start,
+                **sink_state,
+            )
+        await producer
+    finally:
+        producer.cancel()
+
+    seconds += time.perf_counter() - start
+    checkpoint.update(name, done=True, seconds=seconds)
+    return TransferStats(name, count=count, seconds=seconds, digest=f"{digest:x}")
+
+
+async def _summarize(
+    endpoint: _StoreEndpoint, name: str, batch_size: int
+) -> TransferStats:
+    """Reads back the whole dataset, counting its records and computing its digest"""
+    count, digest = 0, 0
+    start = time.perf_counter()
+    async for batch, _ in endpoint.read(name, batch_size, None):
+        count += len(batch)
+        digest = (digest + _get_digest(batch)) % _digest_modulus
+    seconds = time.perf_counter() - start
+    return TransferStats(name, count=count, seconds=seconds, digest=f"{digest:x}")
+
+
+def _verify(stats: List[TransferStats], expected: Dict[str, Dict[str, Any]]):
+    """Checks that the counts and digests of the datasets are as expected
+
+    Raises:
+        ValueError: some datasets have unexpected counts or digests
+    """
+    mismatched = [
+        s.name
+        for s in stats
+        if s.count != expected[s.name]["count"]
+        or s.digest != expected[s.name]["digest"]
+    ]
+    if len(mismatched) > 0:
+        raise ValueError(f"checksum mismatch for: {', '.join(mismatched)}")
+
+
+def _get_digest(batch: List[BaseModel]) -> int:
+    """Gets the order-independent digest of the records of the batch"""
+    return sum(
+        int(hashlib.sha256(_to_canonical_json(v).encode()).hexdigest(), 16)
+        for v in batch
+    )
+
+
+def _to_canonical_json(value: BaseModel) -> str:
+    """Converts the record to JSON whose text is the same whichever store it was read from"""
+    return value.json(sort_keys=True, separators=(",", ":"))
+
+
+def _write_json_atomically(path: str, data: Any):
+    """Writes the data as JSON to the file, replacing it only once fully written"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
@@ -0,0 +1,69 @@
+"""CLI utilities for importing songs in bulk"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Optional
+
+import funml as ml
+
+import settings
+from services import config, hymns
+from services.hymns.models import ImportReport
+from services.hymns.utils.bulk import parse_records
+
+_chunk_size = 64 * 1024
+
+
+async def import_songs(
+    path: str, batch_size: int = 1_000, workers: int = 4
+) -> ImportReport:
+    """Imports the songs of the JSON array or newline-delimited JSON file at `path` into the hymns database
+
+    Args:
+        path: the path to the file of the songs
+        batch_size: the number of songs validated and upserted at a time
+        workers: the number of processes validating the songs; if 0, they are validated inline
+
+    Returns:
+        the report of the number of songs imported and the errors of the records that failed
+    """
+    settings.initialize()
+    config_db_uri = settings.get_config_db_uri()
+    try:
+        await config.get_service_config(config_db_uri)
+    except ValueError:
+        await config.save_service_config(
+            config_db_uri, settings.get_hymns_service_config()
+        )
+
+    service = await hymns.initialize(settings.get_hymns_db_uri())
+    executor: Optional[ProcessPoolExecutor] = None
+    if workers > 0:
+        executor = ProcessPoolExecutor(max_workers=workers)
+
+    try:
+        res = await hymns.import_songs(
+            service,
+            records=parse_records(_read_chunks(path)),
+            batch_size=batch_size,
+            executor=executor,
+        )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return (
+        ml.match(res)
+        .case(ml.Result.ERR(Exception), do=_raise_exception)
+        .case(ml.Result.OK(...), do=lambda v: v)()
+    )
+
+
+async def _read_chunks(path: str) -> AsyncIterator[bytes]:
+    """Reads the file a chunk at a time, so that it is never wholly in memory"""
+    with open(path, "rb") as file:
+        while chunk := file.read(_chunk_size):
+            yield chunk
+
+
+def _raise_exception(exp: Exception):
+    """Raises the given exception"""
+    raise exp
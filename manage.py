@@ -1,10 +1,14 @@
 """CLI managing the application
 """
 import asyncio
+import time
+from typing import List, Optional
 
 import typer
 
 import cli
+import settings
+from cli.migrate import TransferStats
 
 app = typer.Typer(pretty_exceptions_show_locals=False)
 
@@ -55,6 +59,161 @@ def change_password(
         asyncio.run(cli.shutdown())
 
 
+@app.command()
+def dump(
+    path: str = typer.Argument(..., help="the folder to dump the data into"),
+    from_uri: Optional[str] = typer.Option(
+        None, "--from", help="the uri of the database. Default: DB_PATH"
+    ),
+    batch_size: int = typer.Option(500, help="the number of records per batch"),
+    concurrency: int = typer.Option(4, help="the number of datasets copied at once"),
+    checkpoint: Optional[str] = typer.Option(
+        None, help="the checkpoint file for resuming. Default: in the dump folder"
+    ),
+):
+    """Dumps the config, users, apps and songs of the database into a folder, resuming any interrupted dump"""
+    try:
+        start = time.perf_counter()
+        stats = asyncio.run(
+            cli.dump(
+                uri=from_uri or settings.get_db_uri(),
+                path=path,
+                batch_size=batch_size,
+                concurrency=concurrency,
+                checkpoint_path=checkpoint,
+            )
+        )
+        _echo_stats(stats, seconds=time.perf_counter() - start)
+        typer.echo("dumped successfully")
+    finally:
+        asyncio.run(cli.shutdown())
+
+
+@app.command()
+def restore(
+    path: str = typer.Argument(..., help="the folder containing the dump"),
+    to_uri: Optional[str] = typer.Option(
+        None, "--to", help="the uri of the database. Default: DB_PATH"
+    ),
+    batch_size: int = typer.Option(500, help="the number of records per batch"),
+    concurrency: int = typer.Option(4, help="the number of datasets copied at once"),
+    checkpoint: Optional[str] = typer.Option(
+        None, help="the checkpoint file for resuming. Default: in the dump folder"
+    ),
+):
+    """Restores a dump into the database, verifying its checksums and resuming any interrupted restore"""
+    try:
+        start = time.perf_counter()
+        stats = asyncio.run(
+            cli.restore(
+                path=path,
+                uri=to_uri or settings.get_db_uri(),
+                batch_size=batch_size,
+                concurrency=concurrency,
+                checkpoint_path=checkpoint,
+            )
+        )
+        _echo_stats(stats, seconds=time.perf_counter() - start)
+        typer.echo("restored successfully")
+    finally:
+        asyncio.run(cli.shutdown())
+
+
+@app.command()
+def copy(
+    from_uri: str = typer.Option(..., "--from", help="the uri to copy from"),
+    to_uri: str = typer.Option(..., "--to", help="the uri to copy to"),
+    batch_size: int = typer.Option(500, help="the number of records per batch"),
+    concurrency: int = typer.Option(4, help="the number of datasets copied at once"),
+    checkpoint: str = typer.Option(
+        ".copy-checkpoint.json", help="the checkpoint file for resuming"
+    ),
+    verify: bool = typer.Option(True, help="whether to compare the checksums"),
+):
+    """Copies the config, users, apps and songs from one database to another, resuming any interrupted copy"""
+    try:
+        start = time.perf_counter()
+        stats = asyncio.run(
+            cli.copy(
+                from_uri=from_uri,
+                to_uri=to_uri,
+                batch_size=batch_size,
+                concurrency=concurrency,
+                checkpoint_path=checkpoint,
+                verify=verify,
+            )
+        )
+        _echo_stats(stats, seconds=time.perf_counter() - start)
+        typer.echo("copied successfully")
+    finally:
+        asyncio.run(cli.shutdown())
+
+
+@app.command()
+def train_dictionaries(
+    language: Optional[List[str]] = typer.Option(
+        None, help="the languages to train for. Default: all"
+    ),
+    sample_size: int = typer.Option(1_000, help="the number of songs to train on"),
+    recompress: bool = typer.Option(
+        False, help="whether to re-save the songs compressed with the new dictionaries"
+    ),
+):
+    """Trains the dictionaries with which the lines of songs are compressed, one per language"""
+    try:
+        results = asyncio.run(
+            cli.train_dictionaries(
+                languages=language, sample_size=sample_size, recompress=recompress
+            )
+        )
+        for item in results:
+            typer.echo(
+                f"{item.language}: dictionary {item.dictionary_id}, "
+                f"{item.recompressed} songs recompressed"
+            )
+        typer.echo("dictionaries trained successfully")
+    finally:
+        asyncio.run(cli.shutdown())
+
+
+@app.command()
+def import_songs(
+    path: str = typer.Argument(..., help="the JSON array or NDJSON file of the songs"),
+    batch_size: int = typer.Option(1_000, help="the number of songs per batch"),
+    workers: int = typer.Option(
+        4, help="the number of processes validating the songs; 0 for none"
+    ),
+):
+    """Imports the songs of a JSON array or NDJSON file, upserting them in batches per language"""
+    try:
+        report = asyncio.run(
+            cli.import_songs(path=path, batch_size=batch_size, workers=workers)
+        )
+        for error in report.errors:
+            typer.echo(f"record {error.index}: {error.detail}")
+
+        typer.echo(
+            f"imported: {report.imported} songs, failed: {report.failed} records "
+            f"in {report.seconds:.2f}s ({report.throughput:.1f} songs/s)"
+        )
+        typer.echo("songs imported successfully")
+    finally:
+        asyncio.run(cli.shutdown())
+
+
+def _echo_stats(stats: List[TransferStats], seconds: float):
+    """Prints the number of records copied per dataset and the throughput"""
+    for item in stats:
+        typer.echo(
+            f"{item.name}: {item.count} records in {item.seconds:.2f}s "
+            f"({item.throughput:.1f} records/s)"
+        )
+
+    count = sum(item.count for item in stats)
+    throughput = count / seconds if seconds > 0 else count
+    typer.echo(f"total: {count} records in {seconds:.2f}s ({throughput:.1f} records/s)")
+
+
 def shutdown():
     """Gracefully shuts down the app"""
     loop = asyncio.get_event_loop()
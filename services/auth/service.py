@@ -89,14 +89,12 @@ async def register_app(service: AuthService) -> ml.Result:
     """
     try:
         key = generate_random_key(service.key_size)
-        _app = await service.auth_store.get(key)
+        _app = Application(key=key)
+        is_inserted = await service.auth_store.insert_if_absent(key, _app)
 
-        if _app is not None:
+        if not is_inserted:
             raise Exception(f"failed to create unique application key")
 
-        _app = Application(key=key)
-        await service.auth_store.set(key, _app)
-
         return ml.Result.OK(_app)
     except Exception as exp:
         return ml.Result.ERR(exp)
@@ -112,8 +110,7 @@ async def is_valid_api_key(service: AuthService, key: str) -> bool:
     Returns:
         true if key is valid else false
     """
-    res = await service.auth_store.get(key)
-    return res is not None
+    return await service.auth_store.exists(key)
 
 
 async def change_password(
@@ -265,8 +262,7 @@ async def login(
     )
 
     if user:
-        user.login_attempts = 0
-        await service.users_store.set(user.username, user)
+        await service.users_store.update_fields(user.username, {"login_attempts": 0})
 
         otp = _generate_otp(service, user=user)
         await _send_email(
@@ -320,14 +316,16 @@ async def verify_otp(
             raise AuthenticationError("maximum attempts to verify OTP")
 
         if not _is_otp_valid(service, user=user, otp=otp):
-            await _update_user(
-                service, user=user, login_attempts=user.login_attempts + 1
-            )
+            await service.users_store.increment(user.username, "login_attempts")
             raise AuthenticationError("invalid OTP")
         else:
             otp_counter = int(decrypt_str(service.fernet, user.otp_counter))
-            user.otp_counter = encrypt_str(service.fernet, f"{otp_counter + 1}")
-            await _update_user(service, user=user, login_attempts=0)
+            await _update_user(
+                service,
+                user=user,
+                otp_counter=encrypt_str(service.fernet, f"{otp_counter + 1}"),
+                login_attempts=0,
+            )
 
             verified_jwt = _generate_jwt(service, username=user.username, verified=True)
             return ml.Result.OK(OTPResponse(access_token=verified_jwt))
@@ -353,7 +351,9 @@ def _encrypt_user_props(service: AuthService, data: Dict[str, Any]) -> Dict[str,
 
 
 async def _update_user(service: AuthService, user: UserInDb, **kwargs) -> UserInDb:
-    """Updates the user, saving the new user in hte database and returning the updated user.
+    """Updates the user, saving only the changed fields in the database and returning the updated user.
+
+    Changes to the username and any unknown fields are ignored.
 
     Args:
         service: the AuthService for handling saving the user
@@ -362,10 +362,20 @@ async def _update_user(service: AuthService, user: UserInDb, **kwargs) -> UserIn
 
     Returns:
         the updated user
+
+    Raises:
+        NotFoundError: the user no longer exists in the database
     """
-    new_data = {**user.dict(), **kwargs, "username": user.username}
-    new_user = UserInDb(**new_data)
-    await service.users_store.set(user.username, new_user)
+    fields = {
+        k: v for k, v in kwargs.items() if k in UserInDb.__fields__ and k != "username"
+    }
+    # validate the new data before saving it
+    UserInDb(**{**user.dict(), **fields})
+
+    new_user = await service.users_store.update_fields(user.username, fields)
+    if new_user is None:
+        raise NotFoundError(user.username)
+
     return new_user
 
 
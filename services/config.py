@@ -1,6 +1,6 @@
 """Handles the configuration of the entire app"""
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
 import services
 from services.store import Store
@@ -20,7 +20,7 @@ async def save_service_config(uri: str | bytes | PathLike[bytes], conf: ServiceC
         uri: the path to the root folder where the database is to be initialized or is found
         conf: the ServiceConfig object to save to the database
     """
-    config_store = _get_config_store(uri)
+    config_store = get_config_store(uri)
     await config_store.set(_config_key, conf)
 
 
@@ -38,7 +38,7 @@ async def get_service_config(
     Raises:
         ValueError: no persistent service configuration as of yet
     """
-    config_store = _get_config_store(uri)
+    config_store = get_config_store(uri)
     conf = await config_store.get(_config_key)
 
     if conf is None:
@@ -82,6 +82,18 @@ def get_numbers_store(
     )
 
 
+def get_versions_store(
+    service_conf: ServiceConfig, uri: str | bytes | PathLike[bytes]
+) -> Store:
+    """Gets the Store for the versions of the songs of the languages"""
+    return Store.retrieve_store(
+        uri=uri,
+        name="language_versions",
+        model=services.hymns.models.LanguageVersion,
+        options=service_conf,
+    )
+
+
 def get_auth_store(service_conf: ServiceConfig, uri: str | bytes | PathLike[bytes]):
     """Gets the Store for the auth keys"""
     return Store.retrieve_store(
@@ -102,7 +114,7 @@ def get_users_store(service_conf: ServiceConfig, uri: str | bytes | PathLike[byt
     )
 
 
-def _get_config_store(uri: str | bytes | PathLike[bytes]) -> Store:
+def get_config_store(uri: str | bytes | PathLike[bytes]) -> Store:
     """Gets the persistent store for the configuration of the service"""
     return Store.retrieve_store(
         uri=uri, name=_config_key, model=ServiceConfig, options=Config()
@@ -114,3 +126,23 @@ class ServiceConfig(Config):
 
     # General
     languages: list[str] = []
+    # the db uris of the languages whose songs are not stored at the hymns service's db uri
+    language_db_uris: dict[str, str] = {}
+    # the map of primary db uri to the uris of its read replicas
+    db_replica_uris: dict[str, list[str]] = {}
+    # the mongodb read preference, read concern and max staleness of public reads e.g. of songs
+    read_preference: Optional[str] = None
+    read_concern: Optional[str] = None
+    max_staleness_seconds: Optional[int] = None
+    # whether postgres song reads by number or title bypass SQLAlchemy and go directly via asyncpg
+    fast_reads: bool = False
+    # whether the mongodb units of work e.g. of admin requests run in multi-document transactions
+    transactions: bool = False
+    # the deadline in seconds of each store operation, and the concurrency limit and queue size per database
+    operation_timeout: Optional[float] = None
+    max_concurrency: int = 0
+    max_queue_size: int = 0
+    # whether the lines of songs are saved in the compact columnar encoding; both encodings are always readable
+    compact_lines: bool = False
+    # whether postgres and mongodb compress the lines of songs with the latest dictionary of their language
+    compress_lines: bool = False
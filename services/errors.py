@@ -16,3 +16,39 @@ class NotFoundError(Exception):
 
     def __str__(self):
         return self.__repr__()
+
+
+class StoreTimeoutError(Exception):
+    """Exception returned when a store operation does not complete within its deadline.
+
+    Args:
+        arg: the operation that timed out
+    """
+
+    def __init__(self, arg: str = ""):
+        self.arg = arg
+
+    def __repr__(self):
+        return f"StoreTimeoutError: {self.arg}"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class StoreOverloadedError(Exception):
+    """Exception returned when a store operation is shed because its database has too many queued operations.
+
+    Args:
+        arg: the operation that was shed
+        retry_after: the number of seconds after which the operation can be retried
+    """
+
+    def __init__(self, arg: str = "", retry_after: int = 1):
+        self.arg = arg
+        self.retry_after = retry_after
+
+    def __repr__(self):
+        return f"StoreOverloadedError: {self.arg}"
+
+    def __str__(self):
+        return self.__repr__()
@@ -2,22 +2,36 @@
 """
 from .service import (
     initialize,
+    shutdown,
     add_song,
+    import_songs,
+    patch_song,
     delete_song,
     get_song_by_title,
     get_song_by_number,
     query_songs_by_title,
     query_songs_by_number,
+    query_songs_by_number_range,
+    export_songs,
+    get_song_versions,
+    get_language_version,
 )
 
 __all__ = [
     "initialize",
+    "shutdown",
     "add_song",
+    "import_songs",
+    "patch_song",
     "delete_song",
     "get_song_by_number",
     "get_song_by_title",
     "query_songs_by_title",
     "query_songs_by_number",
+    "query_songs_by_number_range",
+    "export_songs",
+    "get_song_versions",
+    "get_language_version",
     "errors",
     "types",
     "models",
@@ -16,3 +16,20 @@ class ValidationError(Exception):
 
     def __str__(self):
         return self.__repr__()
+
+
+class ReadOnlyError(Exception):
+    """Exception returned when data is to be changed on a read-only node e.g. an edge node.
+
+    Args:
+        msg: the msg
+    """
+
+    def __init__(self, msg: str = ""):
+        self.msg = msg
+
+    def __repr__(self):
+        return f"ReadOnlyError: {self.msg}"
+
+    def __str__(self):
+        return self.__repr__()
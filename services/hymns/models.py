@@ -1,16 +1,74 @@
 """Contains the models for the hymns service
 """
-from typing import List, Optional
-from pydantic import BaseModel
+from collections.abc import Mapping
+from datetime import datetime
+from enum import Enum
+from typing import List, Optional, Union, Any, Dict
+from pydantic import BaseModel, root_validator, validator
 
 from services.types import MusicalNote
 
+MAX_TOTAL = 10_000
+# the smallest and largest song numbers held by the index of the integer values of the song numbers
+MIN_SONG_NUMBER = -(2**31)
+MAX_SONG_NUMBER = 2**31 - 1
+# the codes of the notes are their positions in MusicalNote, so new notes must only ever be appended
+_notes: List[MusicalNote] = [*MusicalNote]
+_note_codes: Dict[MusicalNote, int] = {note: code for code, note in enumerate(_notes)}
+
 
 class LineSection(BaseModel):
     note: MusicalNote
     words: str
 
 
+class CompactLines(BaseModel):
+    """The columnar encoding of the lines of a song.
+
+    The notes of all sections, as integer codes, and their words are in parallel arrays,
+    and `offsets` has the index of the first section of each line.
+    """
+
+    notes: List[int]
+    words: List[str]
+    offsets: List[int]
+
+    @root_validator(skip_on_failure=True)
+    def check_arrays(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Checks that the arrays describe a valid set of lines"""
+        notes, words, offsets = values["notes"], values["words"], values["offsets"]
+        if len(notes) != len(words):
+            raise ValueError("notes and words must be of the same length")
+        if any(code < 0 or code >= len(_notes) for code in notes):
+            raise ValueError("unknown note code")
+        if any(a > b for a, b in zip([0, *offsets], [*offsets, len(notes)])):
+            raise ValueError("offsets must be ascending and within the sections")
+        return values
+
+    @classmethod
+    def from_lines(cls, lines: List[List[Any]]) -> "CompactLines":
+        """Encodes the lines, whose sections are LineSection's or their dicts"""
+        notes, words, offsets = [], [], []
+        for line in lines:
+            offsets.append(len(notes))
+            for section in line:
+                section = LineSection.validate(section)
+                notes.append(_note_codes[section.note])
+                words.append(section.words)
+        return cls(notes=notes, words=words, offsets=offsets)
+
+    def to_lines(self) -> List[List[LineSection]]:
+        """Decodes the lines"""
+        ends = [*self.offsets[1:], len(self.notes)]
+        return [
+            [
+                LineSection(note=_notes[self.notes[i]], words=self.words[i])
+                for i in range(start, end)
+            ]
+            for start, end in zip(self.offsets, ends)
+        ]
+
+
 class Song(BaseModel):
     number: int
     language: str
@@ -18,10 +76,204 @@ class Song(BaseModel):
     key: MusicalNote
     lines: List[List[LineSection]]
 
+    @validator("lines", pre=True)
+    def decode_compact_lines(cls, value: Any) -> Any:
+        """Decodes lines that are in the compact columnar encoding"""
+        if isinstance(value, Mapping):
+            return CompactLines(**value).to_lines()
+        elif isinstance(value, CompactLines):
+            return value.to_lines()
+        return value
+
+
+class CompactSong(BaseModel):
+    """A song whose lines are in the compact columnar encoding"""
+
+    number: int
+    language: str
+    title: str
+    key: MusicalNote
+    lines: CompactLines
+
+    @classmethod
+    def from_song(cls, song: Song) -> "CompactSong":
+        """Encodes the lines of the song"""
+        return cls(
+            number=song.number,
+            language=song.language,
+            title=song.title,
+            key=song.key,
+            lines=CompactLines.from_lines(song.lines),
+        )
+
+    def to_song(self) -> Song:
+        """Decodes the lines of the song"""
+        return Song(
+            number=self.number,
+            language=self.language,
+            title=self.title,
+            key=self.key,
+            lines=self.lines.to_lines(),
+        )
+
+
+class SongSummary(BaseModel):
+    """A song without its lines, for listing songs"""
+
+    number: int
+    language: str
+    title: str
+    key: MusicalNote
+
+
+class SongVersion(BaseModel):
+    """The time a song was last changed, by which the copies of the song held by clients are validated"""
+
+    number: int
+    language: str
+    # None for songs saved before the times of changes were recorded, and unchanged since
+    updated_at: Optional[datetime] = None
+
+
+class LanguageVersion(BaseModel):
+    """The version of the songs of a language, incremented whenever any of them changes.
+
+    The results of searches of the songs of the language, held by clients, are validated by it.
+    """
+
+    language: str
+    version: int = 0
+
+
+class LineOperationType(str, Enum):
+    """The kinds of changes to one line of a song"""
+
+    REPLACE = "replace"
+    INSERT = "insert"
+    DELETE = "delete"
+
+
+class LineOperation(BaseModel):
+    """A change to the line at `index`; a new `line` is required to replace or insert a line.
+
+    Inserting at the index just past the last line appends the line.
+    """
+
+    op: LineOperationType
+    index: int
+    line: Optional[List[LineSection]] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_line(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Checks that the index is not negative and that the new line is given if it is needed"""
+        if values["index"] < 0:
+            raise ValueError("index must not be negative")
+        if values["op"] != LineOperationType.DELETE and values["line"] is None:
+            raise ValueError(f"line is required to {values['op'].value} a line")
+        return values
+
+    def get_min_number_of_lines(self, change_before: int) -> int:
+        """Gets the number of lines the song must have for this operation to be possible
+
+        Args:
+            change_before: the change in the number of lines made by the operations before this one
+        """
+        if self.op == LineOperationType.INSERT:
+            return self.index - change_before
+        return self.index + 1 - change_before
+
+    def get_change_in_number_of_lines(self) -> int:
+        """Gets the number of lines added, or removed if negative, by this operation"""
+        if self.op == LineOperationType.INSERT:
+            return 1
+        elif self.op == LineOperationType.DELETE:
+            return -1
+        return 0
+
+
+def get_min_number_of_lines(operations: List[LineOperation]) -> int:
+    """Gets the number of lines a song must have for all the operations, applied in order, to be possible"""
+    min_number, change = 0, 0
+    for operation in operations:
+        min_number = max(min_number, operation.get_min_number_of_lines(change))
+        change += operation.get_change_in_number_of_lines()
+    return min_number
+
+
+def apply_line_operations(
+    lines: List[List[LineSection]], operations: List[LineOperation]
+) -> List[List[LineSection]]:
+    """Applies the operations, in order, to a copy of the lines
+
+    Raises:
+        ValueError: the index of some operation is beyond the lines
+    """
+    lines = [*lines]
+    for operation in operations:
+        max_index = (
+            len(lines) if operation.op == LineOperationType.INSERT else len(lines) - 1
+        )
+        if operation.index > max_index:
+            raise ValueError(
+                f"cannot {operation.op.value} line {operation.index} of {len(lines)} lines"
+            )
+
+        if operation.op == LineOperationType.REPLACE:
+            lines[operation.index] = operation.line
+        elif operation.op == LineOperationType.INSERT:
+            lines.insert(operation.index, operation.line)
+        else:
+            del lines[operation.index]
+    return lines
+
+
+class SongPatch(BaseModel):
+    """The changes to a song's key and to some of its lines, applied without resending the whole song"""
+
+    key: Optional[MusicalNote] = None
+    lines: List[LineOperation] = []
+
+
+class RecordError(BaseModel):
+    """The error of one record of a bulk import, identified by its position in the imported records"""
+
+    index: int
+    detail: str
+
+
+class ImportReport(BaseModel):
+    """The outcome of a bulk import of songs"""
+
+    imported: int = 0
+    failed: int = 0
+    errors: List[RecordError] = []
+    seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """The number of songs imported per second"""
+        return (
+            self.imported / self.seconds if self.seconds > 0 else float(self.imported)
+        )
+
+
+class SongView(str, Enum):
+    """The representation of the songs returned by searches"""
+
+    FULL = "full"
+    SUMMARY = "summary"
+    COMPACT = "compact"
+
 
 class PaginatedResponse(BaseModel):
-    """A response that is returned when paginated"""
+    """A response that is returned when paginated
+
+    The total, if requested, is the number of all matching items, capped at MAX_TOTAL.
+    A total equal to MAX_TOTAL thus means 'at least MAX_TOTAL'
+    """
 
     skip: Optional[int] = None
     limit: Optional[int] = None
-    data: list[Song] = []
+    total: Optional[int] = None
+    # CompactSong comes first as Song would otherwise decode its lines
+    data: list[Union[CompactSong, Song, SongSummary]] = []
@@ -1,37 +1,83 @@
 from __future__ import annotations
 
+import asyncio
+from concurrent.futures import Executor
+from typing import Optional, List, AsyncIterator, Tuple, Any
+
 import funml as ml
 
 import services
+from services.hymns.errors import ReadOnlyError, ValidationError
+from services.hymns.utils.bulk import import_song_records
 from services.hymns.utils.delete import delete_from_one_store, delete_from_all_stores
+from services.hymns.utils.edge import initialize_edge_service
 from services.hymns.utils.get import (
     get_song_by_number as get_raw_song_by_number,
     get_song_by_title as get_raw_song_by_title,
 )
 from services.hymns.utils.init import initialize_many_language_stores
-from services.hymns.utils.save import save_song
+from services.hymns.utils.save import save_song, patch_song as patch_song_in_store
 from services.hymns.utils.search import (
     query_store_by_title,
     query_store_by_number,
+    count_store_by_title,
+    count_store_by_number,
+    scan_store_by_number_range,
 )
 from services.hymns.utils.shared import get_language_store
-from services.hymns.models import Song, PaginatedResponse
+from services.hymns.utils.versions import (
+    get_song_version,
+    get_language_version as get_raw_language_version,
+)
+from services.hymns.models import (
+    Song,
+    PaginatedResponse,
+    MAX_TOTAL,
+    MAX_SONG_NUMBER,
+    SongView,
+    SongPatch,
+)
 
 from .types import HymnsService
 
 
-async def initialize(root_path: bytes | str) -> "HymnsService":
+async def initialize(
+    root_path: bytes | str,
+    edge_db_uri: Optional[str] = None,
+    sync_interval: float = 30,
+) -> "HymnsService":
     """Initializes the hymns service given the configuration.
 
+    If `edge_db_uri` is given, the service is that of a read-only edge node, serving the songs from the
+    local embedded database at `edge_db_uri`, into which the changes of the stores at `root_path` are pulled
+    every `sync_interval` seconds.
+
     Args:
         root_path: the path to the stores for the hymns service
+        edge_db_uri: the uri of the local embedded database of an edge node e.g. sqlite:///./edge.db. Default: None
+        sync_interval: the number of seconds between the pulls of the changes by an edge node. Default: 30
 
     Returns:
         the HymnsService whose configuration is at the store_uri
     """
     conf = await services.config.get_service_config(root_path)
+    if edge_db_uri is not None:
+        return await initialize_edge_service(
+            root_path, conf=conf, edge_db_uri=edge_db_uri, sync_interval=sync_interval
+        )
+
     stores = initialize_many_language_stores(root_path, conf=conf)
-    return HymnsService(root_path=root_path, stores=stores)
+    return HymnsService(root_path=root_path, stores=stores, conf=conf)
+
+
+async def shutdown(service: "HymnsService"):
+    """Shuts down the hymns service, stopping the pulling of changes on an edge node.
+
+    Args:
+        service: the HymnsService to shut down
+    """
+    if service.replicator is not None:
+        await service.replicator.stop()
 
 
 async def add_song(service: "HymnsService", song: Song) -> ml.Result:
@@ -48,12 +94,70 @@ async def add_song(service: "HymnsService", song: Song) -> ml.Result:
         that occurred
     """
     try:
+        _raise_if_read_only(service)
         await save_song(service, song)
         return ml.Result.OK(song)
     except Exception as exp:
         return ml.Result.ERR(exp)
 
 
+async def import_songs(
+    service: "HymnsService",
+    records: AsyncIterator[Tuple[int, Any]],
+    batch_size: int = 1_000,
+    executor: Optional[Executor] = None,
+) -> ml.Result:
+    """Imports the songs of the given records in bulk, upserting them in batches of one round trip per language.
+
+    The records are validated in the executor if any, a few batches at a time, while the batches validated before
+    them are upserted, or else inline batch by batch.
+    Invalid records are reported without stopping the import of the rest.
+
+    Args:
+        service: the HymnsService that the songs are to be added to
+        records: the async iterator of the index of each record and its value e.g. as parsed by `parse_records`
+        batch_size: the number of songs validated and upserted at a time. Default: 1000
+        executor: the executor e.g. a process pool, in which to validate the songs. Default: None, validated inline
+
+    Returns:
+        an ml.Result.OK(ImportReport) with the number of songs imported and the errors of the records that failed \
+        or an ml.Result.ERR(Exception) with the exception that stopped the import
+    """
+    try:
+        _raise_if_read_only(service)
+        report = await import_song_records(
+            service, records=records, batch_size=batch_size, executor=executor
+        )
+        return ml.Result.OK(report)
+    except Exception as exp:
+        return ml.Result.ERR(exp)
+
+
+async def patch_song(
+    service: "HymnsService", number: int, language: str, patch: SongPatch
+) -> ml.Result:
+    """Changes the key and some lines of the song of the given number and language, without rewriting the whole song.
+
+    The line operations are applied in order, each indexed into the lines left by the ones before it.
+
+    Args:
+        service: the HymnsService that has the song
+        number: the song number of the song to patch
+        language: the language the song is in
+        patch: the new key, if any, and the replacements, insertions and deletions of lines
+
+    Returns:
+        an ml.Result.OK(Song) with the patched Song or an ml.Result.ERR(Exception) with the exception that occurred
+    """
+    try:
+        _raise_if_read_only(service)
+        store = get_language_store(service, lang=language)
+        song = await patch_song_in_store(store, number=number, patch=patch)
+        return ml.Result.OK(song)
+    except Exception as exp:
+        return ml.Result.ERR(exp)
+
+
 async def delete_song(
     service: "HymnsService",
     title: str | None = None,
@@ -76,6 +180,7 @@ async def delete_song(
         that occurred
     """
     try:
+        _raise_if_read_only(service)
         if language is None:
             songs = await delete_from_all_stores(service, title=title, number=number)
             return ml.Result.OK(songs)
@@ -137,6 +242,8 @@ async def query_songs_by_title(
     language: str,
     skip: int = 0,
     limit: int = 0,
+    with_total: bool = False,
+    view: SongView = SongView.FULL,
 ) -> ml.Result:
     """Gets a list of songs in the given language whose title starts with the given `q`.
 
@@ -146,15 +253,26 @@ async def query_songs_by_title(
         language: the language the songs are to be expected in
         skip: the number of matching items to skip before starting to return
         limit: the maximum number of songs to return in the query
+        with_total: whether to count all matching songs, up to MAX_TOTAL. Default: False
+        view: the representation of the songs; summaries have no lines, compact songs have columnar lines.
+            Default: SongView.FULL
 
     Returns:
-        an ml.Result.OK(PaginatedResponse(data=List[Song], skip=int, limit=int)) with songs that have matched within \
-        the limits or an ml.Result.ERR(Exception) with the exception that occurred
+        an ml.Result.OK(PaginatedResponse(data=List[Song|SongSummary|CompactSong], skip=int, limit=int, total=int|None)) \
+        with songs that have matched within the limits or an ml.Result.ERR(Exception) with the exception that occurred
     """
     try:
         store = get_language_store(service, lang=language)
-        songs = await query_store_by_title(store, q=q, skip=skip, limit=limit)
-        return ml.Result.OK(PaginatedResponse(data=songs, skip=skip, limit=limit))
+        songs = await query_store_by_title(
+            store, q=q, skip=skip, limit=limit, view=view
+        )
+        total = None
+        if with_total:
+            total = await count_store_by_title(store, q=q, limit=MAX_TOTAL)
+
+        return ml.Result.OK(
+            PaginatedResponse(data=songs, skip=skip, limit=limit, total=total)
+        )
     except Exception as exp:
         return ml.Result.ERR(exp)
 
@@ -165,6 +283,8 @@ async def query_songs_by_number(
     language: str,
     skip: int = 0,
     limit: int = 0,
+    with_total: bool = False,
+    view: SongView = SongView.FULL,
 ) -> ml.Result:
     """Gets a list of songs in the given language whose number starts with the given `q`.
 
@@ -174,14 +294,168 @@ async def query_songs_by_number(
         language: the language the songs are to be expected in
         skip: the number of matching items to skip before starting to return
         limit: the maximum number of songs to return in the query
+        with_total: whether to count all matching songs, up to MAX_TOTAL. Default: False
+        view: the representation of the songs; summaries have no lines, compact songs have columnar lines.
+            Default: SongView.FULL
 
     Returns:
-        an ml.Result.OK(PaginatedResponse(data=List[Song], skip=int, limit=int)) with songs that have matched within \
-        the limits or an ml.Result.ERR(Exception) with the exception that occurred
+        an ml.Result.OK(PaginatedResponse(data=List[Song|SongSummary|CompactSong], skip=int, limit=int, total=int|None)) \
+        with songs that have matched within the limits or an ml.Result.ERR(Exception) with the exception that occurred
     """
     try:
         store = get_language_store(service, lang=language)
-        songs = await query_store_by_number(store, q=q, skip=skip, limit=limit)
-        return ml.Result.OK(PaginatedResponse(data=songs, skip=skip, limit=limit))
+        songs = await query_store_by_number(
+            store, q=q, skip=skip, limit=limit, view=view
+        )
+        total = None
+        if with_total:
+            total = await count_store_by_number(store, q=q, limit=MAX_TOTAL)
+
+        return ml.Result.OK(
+            PaginatedResponse(data=songs, skip=skip, limit=limit, total=total)
+        )
     except Exception as exp:
         return ml.Result.ERR(exp)
+
+
+async def query_songs_by_number_range(
+    service: "HymnsService",
+    start: int,
+    end: int,
+    language: str,
+    view: SongView = SongView.FULL,
+    batch_size: int = 100,
+) -> ml.Result:
+    """Gets the songs in the given language whose numbers are between `start` and `end`, both inclusive.
+
+    The songs are streamed in the numerical order of their numbers, in batches of at most `batch_size`,
+    each got by a range scan of the index of the song numbers, such that only one batch is held in memory.
+
+    Args:
+        service: the HymnsService that has the data
+        start: the smallest song number to return
+        end: the largest song number to return
+        language: the language the songs are to be expected in
+        view: the representation of the songs; summaries have no lines, compact songs have columnar lines.
+            Default: SongView.FULL
+        batch_size: the maximum number of songs fetched at a time. Default: 100
+
+    Returns:
+        an ml.Result.OK(AsyncIterator[List[Song|SongSummary|CompactSong]]) with the batches of the matching songs \
+        or an ml.Result.ERR(Exception) with the exception that occurred
+    """
+    try:
+        if start > end:
+            raise ValidationError(f"'from' ({start}) is greater than 'to' ({end})")
+
+        store = get_language_store(service, lang=language)
+        batches = scan_store_by_number_range(
+            store, start=start, end=end, view=view, batch_size=batch_size
+        )
+        return ml.Result.OK(batches)
+    except Exception as exp:
+        return ml.Result.ERR(exp)
+
+
+async def export_songs(
+    service: "HymnsService",
+    language: str,
+    since_number: Optional[int] = None,
+    view: SongView = SongView.FULL,
+    batch_size: int = 500,
+    since_title: Optional[str] = None,
+) -> ml.Result:
+    """Gets all the songs in the given language, in the order of their numbers, then titles.
+
+    The songs are streamed in batches of at most `batch_size` by range scans of the index of the song numbers,
+    such that only one batch is held in memory however many songs the language has.
+    An interrupted export is resumed by passing the number and title of the last song got as `since_number`
+    and `since_title`, as several songs may share a number. Without `since_title`, all the songs of
+    `since_number` are skipped.
+
+    Args:
+        service: the HymnsService that has the data
+        language: the language of the songs
+        since_number: the song number after which to start, or None to start from the first song. Default: None
+        view: the representation of the songs; summaries have no lines, compact songs have columnar lines.
+            Default: SongView.FULL
+        batch_size: the maximum number of songs fetched at a time. Default: 500
+        since_title: the title of the song of number `since_number` after which to start. Default: None
+
+    Returns:
+        an ml.Result.OK(AsyncIterator[List[Song|SongSummary|CompactSong]]) with the batches of the songs \
+        or an ml.Result.ERR(Exception) with the exception that occurred
+    """
+    try:
+        after = None
+        if since_title is not None:
+            if since_number is None:
+                raise ValidationError("since_title requires since_number")
+            start, after = since_number, (since_number, since_title)
+        else:
+            start = 0 if since_number is None else since_number + 1
+
+        store = get_language_store(service, lang=language)
+        batches = scan_store_by_number_range(
+            store,
+            start=start,
+            end=MAX_SONG_NUMBER,
+            view=view,
+            batch_size=batch_size,
+            after=after,
+        )
+        return ml.Result.OK(batches)
+    except Exception as exp:
+        return ml.Result.ERR(exp)
+
+
+async def get_song_versions(
+    service: "HymnsService", number: int, languages: List[str]
+) -> ml.Result:
+    """Gets the times the song of the given number was last changed in each of the given languages.
+
+    Only the versions are read, not the songs, so that clients holding the current songs can be told so cheaply.
+
+    Args:
+        service: the HymnsService that has the songs
+        number: the song number of the songs
+        languages: the languages the song is in
+
+    Returns:
+        an ml.Result.OK(List[SongVersion]) with the versions in the order of `languages` or an \
+        ml.Result.ERR(Exception) with the exception that occurred
+    """
+    try:
+        stores = [get_language_store(service, lang=lang) for lang in languages]
+        versions = await asyncio.gather(
+            *(get_song_version(store, number=number) for store in stores)
+        )
+        return ml.Result.OK(versions)
+    except Exception as exp:
+        return ml.Result.ERR(exp)
+
+
+async def get_language_version(service: "HymnsService", language: str) -> ml.Result:
+    """Gets the version of the songs of the given language, which changes whenever any of its songs changes.
+
+    Args:
+        service: the HymnsService that has the songs
+        language: the language of the songs
+
+    Returns:
+        an ml.Result.OK(int) with the version or an ml.Result.ERR(Exception) with the exception that occurred
+    """
+    try:
+        store = get_language_store(service, lang=language)
+        version = await get_raw_language_version(store)
+        return ml.Result.OK(version)
+    except Exception as exp:
+        return ml.Result.ERR(exp)
+
+
+def _raise_if_read_only(service: "HymnsService"):
+    """Raises ReadOnlyError if the service is that of an edge node, whose songs are changed only at the primary"""
+    if service.is_read_only:
+        raise ReadOnlyError(
+            "songs can only be changed on the primary node, not on edge nodes"
+        )
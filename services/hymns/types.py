@@ -11,6 +11,7 @@ from services.store.base import Store
 
 if TYPE_CHECKING:
     from services.config import ServiceConfig
+    from services.hymns.utils.edge import EdgeReplicator
 
 
 @ml.record
@@ -18,16 +19,19 @@ class LanguageStore:
     """The collective store for the given language having all stores for that language.
 
     It includes two stores; one where the song titles are the keys and the other where
-    the song numbers are the keys.
+    the song numbers are the keys. It also has the store of the versions of the languages,
+    in the same database as the songs.
 
     Attributes:
         titles_store: the Store whose keys are the song titles
         numbers_store: the Store whose keys are the song numbers
+        versions_store: the Store whose keys are the languages and whose values are their versions
     """
 
     language: str
     titles_store: Store
     numbers_store: Store
+    versions_store: Store
 
 
 class HymnsService:
@@ -36,6 +40,7 @@ class HymnsService:
     stores: dict[str, LanguageStore] = {}
     store_uri: bytes | PathLike[bytes] | str
     conf: "ServiceConfig"
+    replicator: Optional["EdgeReplicator"] = None
 
     def __init__(
         self,
@@ -46,3 +51,9 @@ class HymnsService:
         self.stores: dict[str, LanguageStore] = stores
         self.store_uri: bytes | PathLike[bytes] | str = root_path
         self.conf = services.config.ServiceConfig() if conf is None else conf
+        self.replicator: Optional["EdgeReplicator"] = None
+
+    @property
+    def is_read_only(self) -> bool:
+        """Whether this is an edge node, whose stores are replicas of the primary stores"""
+        return self.replicator is not None
@@ -0,0 +1,283 @@
+"""Utility functions for importing songs in bulk from JSON arrays or newline-delimited JSON"""
+from __future__ import annotations
+
+import asyncio
+import codecs
+import json
+import time
+from collections import deque
+from concurrent.futures import Executor
+from typing import TYPE_CHECKING, Any, AsyncIterator, Deque, List, Optional, Tuple
+
+import pydantic
+
+from services.hymns.models import Song, RecordError, ImportReport
+from .save import save_songs, validate_song_number
+from ..errors import ValidationError
+
+if TYPE_CHECKING:
+    from ..types import HymnsService
+
+_json_decoder = json.JSONDecoder()
+_whitespace = " \t\r\n"
+
+
+async def parse_records(
+    chunks: AsyncIterator[bytes], max_record_size: int = 1_048_576
+) -> AsyncIterator[Tuple[int, Any]]:
+    """Parses the records of a JSON array or of newline-delimited JSON, incrementally, as the chunks arrive.
+
+    Only the record being parsed is held in memory, not the whole document.
+    A line of newline-delimited JSON that is not valid JSON is yielded as a ValidationError in place of its record,
+    but a JSON array cannot be parsed beyond its first syntax error.
+
+    Args:
+        chunks: the async iterator of the bytes of the UTF-8 encoded document
+        max_record_size: the maximum number of characters of one record
+
+    Returns:
+        an async iterator of the index of each record and its parsed value, or the ValidationError got parsing it
+
+    Raises:
+        ValidationError: the JSON array is malformed or has a record larger than `max_record_size`
+    """
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    parser: Optional[_ArrayParser | _LinesParser] = None
+    buffer = ""
+
+    async def iter_text() -> AsyncIterator[Tuple[str, bool]]:
+        async for chunk in chunks:
+            yield text_decoder.decode(chunk), False
+        yield text_decoder.decode(b"", final=True), True
+
+    async for text, is_final in iter_text():
+        buffer += text
+        if parser is None:
+            buffer = buffer.lstrip(_whitespace)
+            if buffer == "" and not is_final:
+                continue
+            if buffer.startswith("["):
+                parser = _ArrayParser(max_record_size)
+                buffer = buffer[1:]
+            else:
+                parser = _LinesParser(max_record_size)
+
+        records, buffer = parser.parse(buffer, is_final=is_final)
+        for record in records:
+            yield record
+
+
+async def import_song_records(
+    service: "HymnsService",
+    records: AsyncIterator[Tuple[int, Any]],
+    batch_size: int = 1_000,
+    executor: Optional[Executor] = None,
+    concurrency: int = 4,
+) -> ImportReport:
+    """Validates the records as songs and upserts the valid ones, in batches of one multi-row upsert per language.
+
+    If an executor e.g. a process pool is given, up to `concurrency` batches are validated at a time in it,
+    while the batch validated before them is upserted, so that validating and writing overlap.
+    Otherwise, each batch is validated inline before it is upserted, the loop being free between batches.
+    The errors of the invalid records are reported, and the rest of the records are still imported.
+
+    Args:
+        service: the HymnsService to add the songs to
+        records: the async iterator of the index of each record and its value, or the ValidationError got parsing it
+        batch_size: the number of records validated and upserted at a time
+        executor: the executor, e.g. a process pool, in which to validate the batches. Default: None, validated inline
+        concurrency: the maximum number of batches being validated at a time
+
+    Returns:
+        the report of the number of songs imported and the errors of the records that failed
+    """
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    report = ImportReport()
+    pending: Deque[asyncio.Future] = deque()
+
+    async def save_next():
+        songs, errors = await pending.popleft()
+        await save_songs(service, songs)
+        report.imported += len(songs)
+        report.errors.extend(errors)
+
+    batch: List[Tuple[int, Any]] = []
+    async for index, value in _with_end(records):
+        if isinstance(value, ValidationError):
+            report.errors.append(RecordError(index=index, detail=value.msg))
+        elif index is not None:
+            batch.append((index, value))
+
+        if len(batch) >= batch_size or (index is None and len(batch) > 0):
+            pending.append(_validate(loop, executor, batch))
+            batch = []
+        if len(pending) >= concurrency:
+            await save_next()
+
+    while len(pending) > 0:
+        await save_next()
+
+    report.errors.sort(key=lambda v: v.index)
+    report.failed = len(report.errors)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def _validate(
+    loop: asyncio.AbstractEventLoop,
+    executor: Optional[Executor],
+    records: List[Tuple[int, Any]],
+) -> asyncio.Future:
+    """Validates the records in the executor, or inline if there is no executor.
+
+    A thread pool is not used as the validation is CPU-bound, and would only contend for the GIL with the loop.
+
+    Args:
+        loop: the running event loop
+        executor: the executor e.g. a process pool, in which to validate the records
+        records: the index of each record and its parsed value
+
+    Returns:
+        the future of the valid songs and the errors of the invalid records
+    """
+    if executor is not None:
+        return loop.run_in_executor(executor, validate_records, records)
+
+    future = loop.create_future()
+    future.set_result(validate_records(records))
+    return future
+
+
+def validate_records(
+    records: List[Tuple[int, Any]]
+) -> Tuple[List[Song], List[RecordError]]:
+    """Validates the records as songs.
+
+    It is a module-level function so that it can be run in other processes.
+
+    Args:
+        records: the index of each record and its parsed value
+
+    Returns:
+        the valid songs and the errors of the invalid records
+    """
+    songs, errors = [], []
+    for index, value in records:
+        try:
+            song = Song.parse_obj(value)
+            validate_song_number(song)
+            songs.append(song)
+        except pydantic.ValidationError as exp:
+            detail = "; ".join(
+                f"{'.'.join(f'{v}' for v in err['loc'])}: {err['msg']}"
+                for err in exp.errors()
+            )
+            errors.append(RecordError(index=index, detail=detail))
+        except ValidationError as exp:
+            errors.append(RecordError(index=index, detail=exp.msg))
+    return songs, errors
+
+
+async def _with_end(
+    records: AsyncIterator[Tuple[int, Any]]
+) -> AsyncIterator[Tuple[Optional[int], Any]]:
+    """Iterates over the records followed by (None, None), marking their end"""
+    async for record in records:
+        yield record
+    yield None, None
+
+
+class _LinesParser:
+    """Parses newline-delimited JSON, one record per non-blank line"""
+
+    def __init__(self, max_record_size: int):
+        self.__max_record_size = max_record_size
+        self.__index = 0
+
+    def parse(self, buffer: str, is_final: bool) -> Tuple[List[Tuple[int, Any]], str]:
+        """Parses the complete lines of the buffer, returning their records and the rest of the buffer"""
+        *lines, rest = buffer.split("\n")
+        if is_final:
+            lines.append(rest)
+            rest = ""
+        elif len(rest) > self.__max_record_size:
+            raise ValidationError(
+                f"record {self.__index} is longer than {self.__max_record_size} characters"
+            )
+
+        records = []
+        for line in lines:
+            if line.strip(_whitespace) == "":
+                continue
+            try:
+                records.append((self.__index, json.loads(line)))
+            except json.JSONDecodeError as exp:
+                records.append(
+                    (self.__index, ValidationError(f"invalid JSON: {exp.msg}"))
+                )
+            self.__index += 1
+        return records, rest
+
+
+class _ArrayParser:
+    """Parses a JSON array whose opening bracket has been consumed, one element at a time"""
+
+    def __init__(self, max_record_size: int):
+        self.__max_record_size = max_record_size
+        self.__index = 0
+        self.__is_expecting_separator = False
+        self.__is_closed = False
+
+    def parse(self, buffer: str, is_final: bool) -> Tuple[List[Tuple[int, Any]], str]:
+        """Parses the complete elements at the start of the buffer, returning them and the rest of the buffer"""
+        records = []
+        while True:
+            pos = _skip_whitespace(buffer, 0)
+            if pos == len(buffer):
+                break
+
+            char = buffer[pos]
+            if self.__is_closed:
+                raise ValidationError("unexpected data after the end of the JSON array")
+            elif char == "]" and (self.__is_expecting_separator or self.__index == 0):
+                self.__is_closed = True
+                buffer = buffer[pos + 1 :]
+                continue
+            elif self.__is_expecting_separator:
+                if char != ",":
+                    raise ValidationError(
+                        f"expected ',' or ']' after record {self.__index - 1}"
+                    )
+                self.__is_expecting_separator = False
+                buffer = buffer[pos + 1 :]
+                continue
+
+            try:
+                value, end = _json_decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as exp:
+                if is_final or len(buffer) > self.__max_record_size:
+                    raise ValidationError(
+                        f"invalid JSON in record {self.__index}: {exp.msg}"
+                    )
+                break
+
+            # a value ending the buffer may be cut short e.g. a number, so more data is awaited
+            if end == len(buffer) and not is_final:
+                break
+
+            records.append((self.__index, value))
+            self.__index += 1
+            self.__is_expecting_separator = True
+            buffer = buffer[end:]
+
+        if is_final and not self.__is_closed:
+            raise ValidationError("the JSON array is not closed")
+        return records, buffer
+
+
+def _skip_whitespace(text: str, pos: int) -> int:
+    """Gets the position of the first non-whitespace character of the text from `pos`"""
+    while pos < len(text) and text[pos] in _whitespace:
+        pos += 1
+    return pos
@@ -1,5 +1,7 @@
 """Utility functions for handling delete operations"""
 from __future__ import annotations
+
+import asyncio
 from typing import TYPE_CHECKING
 
 import funml as ml
@@ -8,6 +10,7 @@ from services.hymns.errors import ValidationError
 from ...errors import NotFoundError
 
 from .get import get_song_by_title_or_number
+from .versions import bump_language_version
 
 if TYPE_CHECKING:
     from ..types import LanguageStore, HymnsService
@@ -19,6 +22,9 @@ async def delete_from_all_stores(
 ) -> list[Song]:
     """Removes the song of given title or number from all language stores.
 
+    The languages whose songs are in the same collection are deleted from in one round trip,
+    and the different collections e.g. of languages in their own databases, concurrently.
+
     Raises:
         ValidationError: when no title or number is supplied for deletion
         NotFoundError: when song is not found in any language store
@@ -26,27 +32,40 @@ async def delete_from_all_stores(
     Returns:
         list of songs that have been deleted
     """
-    if title is None and number is None:
-        raise ValidationError("no title or number supplied for deletion")
-
-    songs = []
-    for store in service.stores.values():
-        try:
-            songs += await delete_from_one_store(store, title=title, number=number)
-        except NotFoundError:
-            pass
+    fields = _get_delete_fields(title=title, number=number)
+
+    results = await asyncio.gather(
+        *(
+            group[0].titles_store.delete_many(
+                fields, languages=[store.language for store in group]
+            )
+            for group in _group_colocated_stores([*service.stores.values()])
+        )
+    )
+    songs = [song for group_songs in results for song in group_songs]
+    # the songs are returned in the order of the languages in the service
+    language_order = {lang: i for i, lang in enumerate(service.stores.keys())}
+    songs.sort(key=lambda song: language_order.get(song.language, len(language_order)))
 
     if len(songs) == 0:
         msg = f"song title '{title}'" if title is not None else f"song number {number}"
         raise NotFoundError(msg)
 
+    languages = {song.language for song in songs}
+    await asyncio.gather(
+        *(
+            bump_language_version(service.stores[lang].versions_store, lang)
+            for lang in languages
+            if lang in service.stores
+        )
+    )
     return songs
 
 
 async def delete_from_one_store(
     store: "LanguageStore", title: str | None, number: int | None
 ) -> list["Song"]:
-    """Removes the song of given title or number from the language store.
+    """Removes the song of given title or number from the language store, in one round trip.
 
     Args:
         store: the LanguageStore from which to delete the song
@@ -60,47 +79,46 @@ async def delete_from_one_store(
         NotFoundError: no song of title or number was found
         ValidationError: no title or number supplied for deletion
     """
-    err_msg = ""
-    deleted_songs = {}
-    is_title_defined = title is not None
-    is_number_defined = number is not None
-
-    if not is_title_defined and not is_number_defined:
-        raise ValidationError("no title or number supplied for deletion")
-
-    if is_title_defined:
-        songs = await store.titles_store.delete(title)
-        songs_map = {
-            f"{song.number}-{song.title}-{song.language}": song for song in songs
-        }
-        deleted_songs = {**songs_map}
-        err_msg += f"title {title}, "
-
-    if is_number_defined:
-        songs = await store.numbers_store.delete(f"{number}")
-        songs_map = {
-            f"{song.number}-{song.title}-{song.language}": song for song in songs
-        }
-        deleted_songs = {**deleted_songs, **songs_map}
-        err_msg += f"number {number}, "
+    fields = _get_delete_fields(title=title, number=number)
+    deleted_songs = await store.titles_store.delete_many(fields)
 
     if len(deleted_songs) > 0:
-        return [*deleted_songs.values()]
+        await bump_language_version(store.versions_store, store.language)
+        return deleted_songs
 
+    err_msg = "".join(f"{field} {value}, " for field, value in fields.items())
     raise NotFoundError(f"{err_msg}for language: '{store.language}'")
 
 
-async def _delete_from_titles_store(
-    store: "LanguageStore", title: str | None
-) -> list[Song] | None:
-    """Removes song from titles store of language store"""
+def _get_delete_fields(title: str | None, number: int | None) -> dict[str, str]:
+    """Gets the fields, any of which a song must match to be deleted
+
+    Raises:
+        ValidationError: no title or number supplied for deletion
+    """
+    fields = {}
     if title is not None:
-        return await store.titles_store.delete(title)
+        fields["title"] = title
+    if number is not None:
+        fields["number"] = f"{number}"
+
+    if len(fields) == 0:
+        raise ValidationError("no title or number supplied for deletion")
 
+    return fields
 
-async def _delete_from_numbers_store(
-    store: "LanguageStore", number: int | None
-) -> list[Song] | None:
-    """Removes song from numbers store of language store"""
-    if number is not None:
-        return await store.numbers_store.delete(f"{number}")
+
+def _group_colocated_stores(
+    stores: list["LanguageStore"],
+) -> list[list["LanguageStore"]]:
+    """Groups the language stores whose songs are kept in the same collection"""
+    groups: list[list["LanguageStore"]] = []
+    for store in stores:
+        for group in groups:
+            if group[0].titles_store.is_colocated_with(store.titles_store):
+                group.append(store)
+                break
+        else:
+            groups.append([store])
+
+    return groups
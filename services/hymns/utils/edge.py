@@ -0,0 +1,240 @@
+"""Utility functions for edge nodes, which serve reads from a local replica of the songs of the primary stores"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from os import PathLike
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+import services
+from services.hymns.models import Song
+from services.hymns.types import HymnsService
+from .init import initialize_many_language_stores, initialize_one_language_store
+from .versions import bump_language_version
+
+if TYPE_CHECKING:
+    from ..types import LanguageStore
+    from ...config import ServiceConfig
+
+_logger = logging.getLogger(__name__)
+
+
+class EdgeReplicator:
+    """Periodically pulls the songs changed in the primary stores into the local stores of an edge node.
+
+    Each round pulls only the songs changed since the previous round. Every few rounds, a full
+    round streams all the songs in batches, picks up new languages and removes the songs deleted from the primary stores.
+    Only the songs that differ from those of the local stores are saved.
+    """
+
+    def __init__(
+        self,
+        service: HymnsService,
+        primary_uri: bytes | PathLike[bytes] | str,
+        primary_conf: ServiceConfig,
+        interval: float,
+        overlap: float = 5,
+        full_sync_every: int = 10,
+        batch_size: int = 500,
+    ):
+        """
+        Args:
+            service: the hymns service of the edge node, whose stores are the local replicas
+            primary_uri: the path to the primary stores
+            primary_conf: the service config of the primary stores
+            interval: the number of seconds between rounds
+            overlap: the number of seconds by which each round re-reads the changes of the previous one,
+                so that changes committed after the previous round, but timestamped before it, are not missed
+            full_sync_every: the number of rounds after which a full round is done
+            batch_size: the number of songs read and saved at a time
+        """
+        self.__service = service
+        self.__primary_uri = primary_uri
+        self.__interval = interval
+        self.__overlap = timedelta(seconds=overlap)
+        self.__full_sync_every = full_sync_every
+        self.__batch_size = batch_size
+        self.__sources: Dict[str, LanguageStore] = initialize_many_language_stores(
+            primary_uri, conf=primary_conf
+        )
+        self.__watermarks: Dict[str, Optional[datetime]] = {}
+        self.__task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Pulls all the songs, then starts pulling the changes in the background"""
+        await self.sync(full=True)
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        """Stops pulling the changes"""
+        if self.__task is not None:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+
+    async def sync(self, full: bool = False) -> int:
+        """Pulls the songs changed in the primary stores since the last round into the local stores.
+
+        Args:
+            full: whether to pull all the songs, pick up new languages and remove the songs deleted from the primary stores
+
+        Returns:
+            the number of songs saved or removed
+        """
+        if full:
+            await self.__add_new_languages()
+
+        counts = await asyncio.gather(
+            *(self.__sync_language(lang, full=full) for lang in self.__sources)
+        )
+        return sum(counts)
+
+    async def __run(self):
+        """Runs the rounds periodically, logging the failures e.g. when the primary stores are unreachable"""
+        rounds = 0
+        while True:
+            await asyncio.sleep(self.__interval)
+            rounds += 1
+            try:
+                await self.sync(full=rounds % self.__full_sync_every == 0)
+            except Exception as exp:
+                _logger.warning(
+                    f"failed to pull changes from the primary stores: {exp}"
+                )
+
+    async def __sync_language(self, lang: str, full: bool) -> int:
+        """Pulls the changes of the given language, or all its songs, removing its deleted songs too, if `full`"""
+        replica = self.__service.stores[lang]
+        started_at = datetime.utcnow()
+        watermark = self.__watermarks.get(lang)
+
+        if full:
+            count = await self.__sync_all_songs(lang)
+        else:
+            since = None if watermark is None else watermark - self.__overlap
+            songs, latest = await self.__sources[lang].titles_store.changed_since(since)
+            replica_songs = await _get_songs_by_title(replica, songs)
+            count = await self.__save_changed_songs(replica, songs, replica_songs)
+            # when nothing changed, the latest time is the `since` of the round, before the watermark
+            if latest is not None and (watermark is None or latest > watermark):
+                watermark = latest
+
+        # songs saved before their update times were recorded have none, so without the start time
+        # of the round, the watermark would stay None and every round would pull all the songs
+        self.__watermarks[lang] = started_at if watermark is None else watermark
+
+        if count > 0:
+            # the versions of the edge node are its own, as it is validated against its own songs
+            await bump_language_version(replica.versions_store, lang)
+        return count
+
+    async def __sync_all_songs(self, lang: str) -> int:
+        """Pulls all the songs of the given language batch by batch, then removes those deleted from the source
+
+        Only the titles and numbers of the songs of the source are kept in memory, to find the deleted songs.
+
+        Returns:
+            the number of songs saved or removed
+        """
+        source = self.__sources[lang]
+        replica = self.__service.stores[lang]
+        titles, numbers = set(), set()
+
+        count = 0
+        async for songs, _ in source.titles_store.scan(batch_size=self.__batch_size):
+            titles.update(song.title for song in songs)
+            numbers.update(song.number for song in songs)
+            replica_songs = await _get_songs_by_title(replica, songs)
+            count += await self.__save_changed_songs(replica, songs, replica_songs)
+
+        async for replica_songs, _ in replica.titles_store.scan(
+            batch_size=self.__batch_size
+        ):
+            count += await _remove_deleted_songs(
+                titles, numbers=numbers, replica_songs=replica_songs, replica=replica
+            )
+        return count
+
+    async def __add_new_languages(self):
+        """Adds the stores of the languages added to the primary stores since the last full round"""
+        conf = await services.config.get_service_config(self.__primary_uri)
+        edge_conf = self.__service.conf
+        for lang in conf.languages:
+            if lang not in self.__sources:
+                self.__sources[lang] = initialize_one_language_store(
+                    conf=conf, uri=self.__primary_uri, lang=lang
+                )
+            if lang not in self.__service.stores:
+                edge_conf.languages.append(lang)
+                self.__service.stores[lang] = initialize_one_language_store(
+                    conf=edge_conf, uri=self.__service.store_uri, lang=lang
+                )
+
+
+async def initialize_edge_service(
+    primary_uri: bytes | PathLike[bytes] | str,
+    conf: ServiceConfig,
+    edge_db_uri: str,
+    sync_interval: float,
+) -> HymnsService:
+    """Initializes a read-only hymns service whose stores are local replicas of the primary stores.
+
+    Args:
+        primary_uri: the path to the primary stores
+        conf: the service config of the primary stores
+        edge_db_uri: the uri of the local embedded database e.g. sqlite:///./edge.db
+        sync_interval: the number of seconds between the pulls of the changes of the primary stores
+
+    Returns:
+        the read-only HymnsService, after all songs have been pulled into its stores
+    """
+    # all languages are replicated into the one local database
+    edge_conf = conf.copy(
+        update={"language_db_uris": {}, "languages": [*conf.languages]}
+    )
+    stores = initialize_many_language_stores(edge_db_uri, conf=edge_conf)
+    service = HymnsService(root_path=edge_db_uri, stores=stores, conf=edge_conf)
+
+    replicator = EdgeReplicator(
+        service, primary_uri=primary_uri, primary_conf=conf, interval=sync_interval
+    )
+    await replicator.start()
+    service.replicator = replicator
+    return service
+
+
+async def _get_songs_by_title(store: LanguageStore, songs: List[Song]) -> List[Song]:
+    """Gets the songs of the store that have the titles of the given songs"""
+    values = await asyncio.gather(
+        *(store.titles_store.get(song.title) for song in songs)
+    )
+    return [v for v in values if v is not None]
+
+
+async def _remove_deleted_songs(
+    titles: Set[str],
+    numbers: Set[int],
+    replica_songs: List[Song],
+    replica: LanguageStore,
+) -> int:
+    """Removes the given songs of the replica whose titles or numbers are no longer among those of the source
+
+    Returns:
+        the number of songs removed
+    """
+    count = 0
+    for song in replica_songs:
+        if song.title not in titles:
+            count += len(await replica.titles_store.delete(song.title))
+        elif song.number not in numbers:
+            count += len(await replica.numbers_store.delete(f"{song.number}"))
+    return count
+
+
+def _get_key(song: Song) -> Tuple[int, str]:
+    """Gets the number and title that identify the song within its language"""
+    return song.number, song.title
@@ -35,20 +35,27 @@ def initialize_one_language_store(
 ) -> LanguageStore:
     """Initializes the LanguageStore for the given language.
 
+    If the language has its own db uri in the service config, that is used instead of `uri`.
+
     Args:
         conf: the ServiceConfig for the current service
-        uri: the path where the stores are to be found
+        uri: the default path where the stores are to be found
         lang: the language name whose store is to be retrieved
 
     Returns:
         the LanguageStore that corresponds to the given language
     """
+    uri = conf.language_db_uris.get(lang, uri)
     numbers_store = services.config.get_numbers_store(
         service_conf=conf, uri=uri, lang=lang
     )
     titles_store = services.config.get_titles_store(
         service_conf=conf, uri=uri, lang=lang
     )
+    versions_store = services.config.get_versions_store(service_conf=conf, uri=uri)
     return LanguageStore(
-        numbers_store=numbers_store, titles_store=titles_store, language=lang
+        numbers_store=numbers_store,
+        titles_store=titles_store,
+        versions_store=versions_store,
+        language=lang,
     )
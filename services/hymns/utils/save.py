@@ -1,9 +1,12 @@
 """Utility functions and types for handling save to database operations"""
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Dict, List, Tuple
 
 import services
-from services.hymns.models import Song
+from services.hymns.models import Song, SongPatch, MIN_SONG_NUMBER, MAX_SONG_NUMBER
 from .init import initialize_one_language_store
+from .versions import bump_language_version
+from ..errors import ValidationError
+from ...errors import NotFoundError
 
 if TYPE_CHECKING:
     from ..types import LanguageStore, HymnsService
@@ -17,13 +20,99 @@ async def save_song(service: "HymnsService", song: Song):
     Args:
         service: the HymnsService instance to add song to
         song: the Song to add to the HymnsService
+
+    Raises:
+        services.hymns.errors.ValidationError: the song number is out of range
     """
+    validate_song_number(song)
     if song.language not in service.stores:
         await _save_new_language(service, lang=song.language)
 
     store = service.stores[song.language]
     await _save_to_titles_store(store, song=song)
     await _save_to_numbers_store(store, song=song)
+    await bump_language_version(store.versions_store, song.language)
+
+
+async def save_songs(service: "HymnsService", songs: List[Song]):
+    """Saves the given songs with one multi-row upsert per language, adding the languages not in the service.
+
+    Of the songs of the same number and title in a language, the last one is saved.
+    The service is mutated.
+
+    Args:
+        service: the HymnsService instance to add the songs to
+        songs: the Songs to add to the HymnsService
+
+    Raises:
+        services.hymns.errors.ValidationError: the number of some song is out of range
+    """
+    songs_by_language: Dict[str, Dict[Tuple[int, str], Song]] = {}
+    for song in songs:
+        validate_song_number(song)
+        songs_by_language.setdefault(song.language, {})[
+            (song.number, song.title)
+        ] = song
+
+    for lang, lang_songs in songs_by_language.items():
+        if lang not in service.stores:
+            await _save_new_language(service, lang=lang)
+
+        store = service.stores[lang]
+        # the numbers and titles stores share the songs, so saving them via the titles store suffices
+        await store.titles_store.set_many(
+            [(song.title, song) for song in lang_songs.values()]
+        )
+        await bump_language_version(store.versions_store, lang)
+
+
+def validate_song_number(song: Song):
+    """Checks that the number of the song is within the range of the index of the integer values of song numbers
+
+    Args:
+        song: the Song to check
+
+    Raises:
+        services.hymns.errors.ValidationError: the song number is out of range
+    """
+    if not MIN_SONG_NUMBER <= song.number <= MAX_SONG_NUMBER:
+        raise ValidationError(
+            f"song number: '{song.number}' is not between {MIN_SONG_NUMBER} and {MAX_SONG_NUMBER}"
+        )
+
+
+async def patch_song(store: "LanguageStore", number: int, patch: SongPatch) -> Song:
+    """Applies the patch to the song of the given number, changing only the given lines and fields in the store.
+
+    The song is saved once for both the numbers and titles stores, so patching it via the numbers store suffices.
+
+    Args:
+        store: the LanguageStore in which the song is found
+        number: the song number of the song to patch
+        patch: the changes to the key and lines of the song
+
+    Returns:
+        the patched Song
+
+    Raises:
+        services.errors.NotFoundError: song of given number not found for the language
+        services.hymns.errors.ValidationError: the index of some line operation is beyond the lines of the song
+    """
+    fields = patch.dict(exclude={"lines"}, exclude_none=True)
+    try:
+        song = await store.numbers_store.patch_lines(
+            f"{number}", operations=patch.lines, fields=fields
+        )
+    except ValueError as exp:
+        raise ValidationError(f"{exp}")
+
+    if song is None:
+        raise NotFoundError(
+            f"song of number: '{number}' not found for language: '{store.language}'"
+        )
+
+    await bump_language_version(store.versions_store, store.language)
+    return song
 
 
 async def _save_new_language(service: "HymnsService", lang: str):
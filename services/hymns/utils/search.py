@@ -1,17 +1,21 @@
 """Utility functions for handling search operations"""
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, AsyncIterator, Optional, Tuple
 
 import funml as ml
-from ..models import Song
+from ..models import Song, SongSummary, SongView, CompactSong
 
 if TYPE_CHECKING:
     from ..types import LanguageStore
 
 
 async def query_store_by_title(
-    store: "LanguageStore", q: str, skip: int = 0, limit: int = 0
-) -> list[Song]:
+    store: "LanguageStore",
+    q: str,
+    skip: int = 0,
+    limit: int = 0,
+    view: SongView = SongView.FULL,
+) -> list[Song] | list[SongSummary] | list[CompactSong]:
     """Gets a list of songs whose titles begin with the search term.
 
     Args:
@@ -19,16 +23,25 @@ async def query_store_by_title(
         q: the search term
         skip: the number of matching items to skip before starting to return
         limit: the maximum number of items to return at a go
+        view: the representation of the songs; summaries are fetched without their lines,
+            and compact songs have their lines in the columnar encoding
 
     Returns:
         a list of matching songs for the given search term in the given store
     """
-    return await store.titles_store.search(term=q, skip=skip, limit=limit)
+    songs = await store.titles_store.search(
+        term=q, skip=skip, limit=limit, projection=_get_projection(view)
+    )
+    return _to_view(songs, view=view)
 
 
 async def query_store_by_number(
-    store: "LanguageStore", q: int, skip: int = 0, limit: int = 0
-) -> list[Song]:
+    store: "LanguageStore",
+    q: int,
+    skip: int = 0,
+    limit: int = 0,
+    view: SongView = SongView.FULL,
+) -> list[Song] | list[SongSummary] | list[CompactSong]:
     """Gets a list of songs whose song numbers begin with the search term.
 
     Args:
@@ -36,8 +49,90 @@ async def query_store_by_number(
         q: the search term
         skip: the number of matching items to skip before starting to return
         limit: the maximum number of items to return at a go
+        view: the representation of the songs; summaries are fetched without their lines,
+            and compact songs have their lines in the columnar encoding
 
     Returns:
         a list of matching songs for the given search term in the given store
     """
-    return await store.numbers_store.search(term=f"{q}", skip=skip, limit=limit)
+    songs = await store.numbers_store.search(
+        term=f"{q}", skip=skip, limit=limit, projection=_get_projection(view)
+    )
+    return _to_view(songs, view=view)
+
+
+async def scan_store_by_number_range(
+    store: "LanguageStore",
+    start: int,
+    end: int,
+    view: SongView = SongView.FULL,
+    batch_size: int = 100,
+    after: Optional[Tuple[int, str]] = None,
+) -> AsyncIterator[list[Song] | list[SongSummary] | list[CompactSong]]:
+    """Iterates over the songs whose song numbers are between `start` and `end`, in batches, in numerical order.
+
+    Args:
+        store: the LanguageStore where the songs are found
+        start: the smallest song number to return
+        end: the largest song number to return
+        view: the representation of the songs; summaries are fetched without their lines,
+            and compact songs have their lines in the columnar encoding
+        batch_size: the maximum number of songs fetched, and held in memory, at a time
+        after: the number and title of the song after which to start, or None to start from `start`
+
+    Returns:
+        an async iterator of the batches of songs
+    """
+    batches = store.numbers_store.scan_range(
+        start,
+        end,
+        batch_size=batch_size,
+        projection=_get_projection(view),
+        after=after,
+    )
+    async for songs in batches:
+        yield _to_view(songs, view=view)
+
+
+async def count_store_by_title(store: "LanguageStore", q: str, limit: int = 0) -> int:
+    """Counts the songs whose titles begin with the search term.
+
+    Args:
+        store: the LanguageStore where the songs are found
+        q: the search term
+        limit: the maximum count to return; if 0, all matching songs are counted
+
+    Returns:
+        the number of matching songs for the given search term in the given store, capped at `limit`
+    """
+    return await store.titles_store.count(term=q, limit=limit)
+
+
+async def count_store_by_number(store: "LanguageStore", q: int, limit: int = 0) -> int:
+    """Counts the songs whose song numbers begin with the search term.
+
+    Args:
+        store: the LanguageStore where the songs are found
+        q: the search term
+        limit: the maximum count to return; if 0, all matching songs are counted
+
+    Returns:
+        the number of matching songs for the given search term in the given store, capped at `limit`
+    """
+    return await store.numbers_store.count(term=f"{q}", limit=limit)
+
+
+def _to_view(
+    songs: list[Song] | list[SongSummary], view: SongView
+) -> list[Song] | list[SongSummary] | list[CompactSong]:
+    """Converts the songs got from the store into the given view"""
+    if view == SongView.COMPACT:
+        return [CompactSong.from_song(song) for song in songs]
+    return songs
+
+
+def _get_projection(view: SongView) -> type[SongSummary] | None:
+    """Gets the model whose fields are to be fetched from the store for the given view, or None for all fields"""
+    if view == SongView.SUMMARY:
+        return SongSummary
+    return None
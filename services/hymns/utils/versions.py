@@ -0,0 +1,66 @@
+"""Utility functions for the versions of songs and languages, by which clients validate the songs they hold"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from services.hymns.models import LanguageVersion, SongVersion
+from services.store import Store
+from ...errors import NotFoundError
+
+if TYPE_CHECKING:
+    from ..types import LanguageStore
+
+
+async def get_song_version(store: "LanguageStore", number: int) -> SongVersion:
+    """Gets the time the song of the given number was last changed, without fetching the song.
+
+    Args:
+        store: the LanguageStore in which the song is found
+        number: the song number of the song
+
+    Returns:
+        the SongVersion of the song
+
+    Raises:
+        services.errors.NotFoundError: song of given number not found for given language
+    """
+    version = await store.numbers_store.get(f"{number}", projection=SongVersion)
+
+    if version is None:
+        raise NotFoundError(
+            f"song of number: '{number}' not found for language: '{store.language}'"
+        )
+
+    return version
+
+
+async def get_language_version(store: "LanguageStore") -> int:
+    """Gets the version of the songs of the language of the store; 0 if they have never changed"""
+    value = await store.versions_store.get(store.language)
+    return 0 if value is None else value.version
+
+
+async def bump_language_version(versions_store: Store, language: str) -> int:
+    """Increments the version of the songs of the given language.
+
+    It is to be called after the songs are changed, never before, so that a client reading the version
+    before the songs never holds songs older than its version.
+
+    Args:
+        versions_store: the Store of the versions of the languages
+        language: the language whose songs have changed
+
+    Returns:
+        the new version
+    """
+    value = await versions_store.increment(language, "version")
+    if value is not None:
+        return value.version
+
+    initial = LanguageVersion(language=language, version=1)
+    if await versions_store.insert_if_absent(language, initial):
+        return initial.version
+
+    # another writer inserted it first
+    value = await versions_store.increment(language, "version")
+    return value.version
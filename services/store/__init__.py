@@ -1,13 +1,21 @@
 """Handles storage of data"""
-from .base import Store
+from .base import Store, StoreConfig
 from .postgres import PgConfig, PgStore
 from .mongo import MongoConfig, MongoStore
+from .sqlite import SqliteConfig, SqliteStore
+from .utils.unit_of_work import unit_of_work
+from .utils.consistent_reads import consistent_reads
 
 __all__ = [
     "Store",
+    "StoreConfig",
     "utils",
     "PgStore",
     "PgConfig",
     "MongoStore",
     "MongoConfig",
+    "SqliteStore",
+    "SqliteConfig",
+    "unit_of_work",
+    "consistent_reads",
 ]
@@ -1,14 +1,71 @@
 """module containing the abstract classes for stores and their configuration"""
 from abc import abstractmethod
-from typing import Optional, List, Dict, Type, TypeVar, Generic
+from datetime import datetime
+from typing import (
+    Optional,
+    List,
+    Dict,
+    Type,
+    TypeVar,
+    Generic,
+    Any,
+    Union,
+    Tuple,
+    AsyncIterator,
+    TYPE_CHECKING,
+)
 
 from pydantic import BaseModel
 
 from errors import ConfigurationError
+from services.store.utils.limits import StoreLimits
 from services.store.utils.uri import get_store_type, escape_db_uri
 from services.utils import Config
 
+if TYPE_CHECKING:
+    from services.hymns.models import LineOperation
+
 T = TypeVar("T", bound=BaseModel)
+P = TypeVar("P", bound=BaseModel)
+
+# the fields of the store configs that set the deadlines and concurrency limits of the store operations
+_limits_fields = {
+    "operation_timeout",
+    "max_concurrency",
+    "max_queue_size",
+    "overload_retry_after",
+}
+
+
+class StoreConfig(Config):
+    """The configuration common to all stores"""
+
+    # the number of seconds within which each store operation must complete; None means no deadline
+    operation_timeout: Optional[float] = None
+    # the maximum number of concurrent operations per database, per worker; 0 means no limit
+    max_concurrency: int = 0
+    # the maximum number of operations waiting for a free slot, beyond which operations are shed
+    max_queue_size: int = 0
+    # the number of seconds after which shed operations can be retried
+    overload_retry_after: int = 1
+    # whether the lines of songs are saved in the compact columnar encoding
+    compact_lines: bool = False
+    # whether the lines of songs are compressed with the latest dictionary trained on their language's songs
+    compress_lines: bool = False
+
+    @property
+    def has_explicit_limits(self) -> bool:
+        """Whether any of the limits was given, rather than defaulted e.g. as for the config store"""
+        return len(self.__fields_set__ & _limits_fields) > 0
+
+    def get_limits_config(self) -> Dict[str, Any]:
+        """Gets the configuration of the deadlines and concurrency limits of the store operations"""
+        return {
+            "timeout": self.operation_timeout,
+            "max_concurrency": self.max_concurrency,
+            "max_queue_size": self.max_queue_size,
+            "retry_after": self.overload_retry_after,
+        }
 
 
 class Store(Generic[T]):
@@ -19,6 +76,8 @@ class Store(Generic[T]):
     """
 
     _registry: Dict[str, Type["Store"]] = {}
+    # the deadlines and concurrency limits of each database, shared by all its stores
+    _limits_registry: Dict[str, StoreLimits] = {}
     __store_type__: str = "None"
     __store_config_cls__: Type[Config] = Config
 
@@ -28,6 +87,10 @@ class Store(Generic[T]):
 
     def __init__(self, uri: str, name: str, model: Type[T], options: Config):
         self._model = model
+        self._name = name
+        self._limits = Store.__get_limits(uri, options)
+        self._compact_lines = getattr(options, "compact_lines", False)
+        self._compress_lines = getattr(options, "compress_lines", False)
 
     @classmethod
     def retrieve_store(
@@ -44,34 +107,126 @@ class Store(Generic[T]):
         except KeyError:
             raise ConfigurationError(f"store of type: {store_type} does not exist")
 
+    @staticmethod
+    def __get_limits(uri: str, options: Config) -> StoreLimits:
+        """Gets the deadlines and concurrency limits of the database at the given uri, registering them if absent
+
+        The stores of a database given no limits e.g. its config store share the limits of its other stores,
+        whichever store is created first; those given limits reconfigure the shared limits.
+        """
+        is_explicit = isinstance(options, StoreConfig) and options.has_explicit_limits
+        conf = (options if is_explicit else StoreConfig()).get_limits_config()
+
+        limits = Store._limits_registry.get(uri)
+        if limits is None:
+            limits = StoreLimits(**conf)
+            Store._limits_registry[uri] = limits
+        elif is_explicit:
+            limits.configure(**conf)
+        return limits
+
     @staticmethod
     async def destroy_stores():
         """Destroys all stores that have been added to the registry of this Store"""
         cls_names = [*Store._registry.keys()]
         for cls_name in cls_names:
             await Store._registry[cls_name]._clean_up()
+        Store._limits_registry.clear()
 
     @abstractmethod
-    async def set(self, k: str, v: T, **kwargs) -> None:
+    async def set(self, k: str, v: T, ttl: Optional[float] = None, **kwargs) -> None:
         """
         Inserts or updates the key-value pair
         :param k: the key as a UTF-8 string
         :param v: the value as an ml.Record
+        :param ttl: the time-to-live in seconds after which the key-value pair expires. If None, it never expires.
         :param kwargs: other key-word arguments
         """
         raise NotImplementedError("set not implemented")
 
     @abstractmethod
-    async def get(self, k: str) -> Optional[T]:
+    async def set_many(self, items: List[Tuple[str, T]]) -> None:
+        """
+        Inserts or updates the given key-value pairs in one round trip, without time-to-live
+        :param items: the list of (key, value) pairs, the keys as UTF-8 strings and the values as model instances
+        """
+        raise NotImplementedError("set_many not implemented")
+
+    @abstractmethod
+    async def insert_if_absent(self, k: str, v: T, ttl: Optional[float] = None) -> bool:
+        """
+        Inserts the key-value pair only if no value is associated with the key yet.
+        This is done atomically in one round trip so concurrent writers cannot overwrite each other.
+        An expired value is treated as absent.
+        :param k: the key as a UTF-8 string
+        :param v: the value as a model instance
+        :param ttl: the time-to-live in seconds after which the key-value pair expires. If None, it never expires.
+        :return: True if the value was inserted, False if the key already existed
+        """
+        raise NotImplementedError("insert_if_absent not implemented")
+
+    @abstractmethod
+    async def update_fields(self, k: str, fields: Dict[str, Any]) -> Optional[T]:
+        """
+        Updates only the given fields of the value associated with the key, in one round trip
+        :param k: the key as a UTF-8 string
+        :param fields: a map of field name to the new value of that field
+        :return: the updated value or None if no value exists for that key
+        """
+        raise NotImplementedError("update_fields not implemented")
+
+    @abstractmethod
+    async def increment(self, k: str, field: str, by: int = 1) -> Optional[T]:
+        """
+        Atomically increments the integer field of the value associated with the key
+        :param k: the key as a UTF-8 string
+        :param field: the name of the integer field to increment
+        :param by: the amount to increment by; it can be negative (default: 1)
+        :return: the updated value or None if no value exists for that key
+        """
+        raise NotImplementedError("increment not implemented")
+
+    @abstractmethod
+    async def patch_lines(
+        self,
+        k: str,
+        operations: List["LineOperation"],
+        fields: Optional[Dict[str, Any]] = None,
+    ) -> Optional[T]:
+        """
+        Applies the operations, in order, to the lines of the song associated with the key, and updates the given fields.
+        Where possible, the lines are changed within the database in one round trip, without rewriting the whole song;
+        otherwise e.g. for compressed lines, the song is read and its new lines written back.
+        :param k: the key as a UTF-8 string
+        :param operations: the replacements, insertions and deletions of lines, each indexed into the lines left by the ones before it
+        :param fields: a map of field name to the new value of that field e.g. the key of the song
+        :return: the updated value or None if no value exists for that key
+        :raises ValueError: the index of some operation is beyond the lines of the song
+        """
+        raise NotImplementedError("patch_lines not implemented")
+
+    @abstractmethod
+    async def get(
+        self, k: str, projection: Optional[Type[P]] = None
+    ) -> Union[T, P, None]:
         """
-        Gets the value associated with the given key
+        Gets the value associated with the given key.
+        If a `projection` model is given, only its fields are fetched and an instance of it is returned.
         :param k: the key as a UTF-8 string
-        :return: the value if it exists or None if it doesn't
+        :param projection: the model, with a subset of the fields of this store's model and of the `updated_at`
+            field of all values, to return instead
+        :return: the value if it exists and has not expired or None if it doesn't
         """
         raise NotImplementedError("get not implemented")
 
     @abstractmethod
-    async def search(self, term: str, skip: int = 0, limit: int = 0) -> List[T]:
+    async def search(
+        self,
+        term: str,
+        skip: int = 0,
+        limit: int = 0,
+        projection: Optional[Type[P]] = None,
+    ) -> Union[List[T], List[P]]:
         """
         Finds all key-values whose keys start with the substring `term`.
         It skips the first `skip` (default: 0) number of results and returns not more than
@@ -79,13 +234,35 @@ class Store(Generic[T]):
         host machine.
         If `limit` is 0, all items are returned since it would make no sense for someone to search
         for zero items.
+        If a `projection` model is given, only its fields are fetched and instances of it are returned.
         :param term: the starting substring to check all keys against
         :param skip: the number of the first matched key-value pairs to skip
         :param limit: the maximum number of records to return at any one given time
+        :param projection: the model, with a subset of the fields of this store's model, to return instead
         :return: the list of value whose key starts with the `term`
         """
         raise NotImplementedError("search not implemented")
 
+    @abstractmethod
+    async def exists(self, k: str) -> bool:
+        """
+        Checks whether a value is associated with the given key without retrieving the value
+        :param k: the key as a UTF-8 string
+        :return: True if an unexpired value exists for the key, else False
+        """
+        raise NotImplementedError("exists not implemented")
+
+    @abstractmethod
+    async def count(self, term: str = "", limit: int = 0) -> int:
+        """
+        Counts the key-values whose keys start with the substring `term`, without retrieving the values.
+        If `limit` is greater than 0, counting stops at `limit` so that the cost of counting is bounded.
+        :param term: the starting substring to check all keys against
+        :param limit: the maximum count to return; if 0, all matching key-values are counted
+        :return: the number of key-values whose key starts with the `term`, capped at `limit`
+        """
+        raise NotImplementedError("count not implemented")
+
     @abstractmethod
     async def delete(self, k: str) -> List[T]:
         """
@@ -95,6 +272,91 @@ class Store(Generic[T]):
         """
         raise NotImplementedError("delete not implemented")
 
+    @abstractmethod
+    async def delete_many(
+        self, fields: Dict[str, Any], languages: Optional[List[str]] = None
+    ) -> List[T]:
+        """
+        Removes, in one atomic round trip, the values any of whose given fields equals the given value.
+        For stores of a given language e.g. songs, the values of the given languages, kept in the
+        same collection as this store's, are removed; the languages' stores are colocated with this one.
+        :param fields: the map of field name to value; values matching any of these are removed
+        :param languages: the languages whose values are to be removed. If None, only this store's language.
+        :return: the list of model instances that have been deleted
+        """
+        raise NotImplementedError("delete_many not implemented")
+
+    @abstractmethod
+    async def changed_since(
+        self, since: Optional[datetime] = None
+    ) -> Tuple[List[T], Optional[datetime]]:
+        """
+        Gets the unexpired values, of this store's language if any, that were changed after the given time.
+        This is how edge nodes pull the changes of the primary store incrementally.
+        :param since: the time, as returned by a previous call, after which the values changed. If None, all values.
+        :return: the changed values in the order they were changed, and the time of the latest change among them
+        """
+        raise NotImplementedError("changed_since not implemented")
+
+    @abstractmethod
+    def scan(
+        self, batch_size: int = 500, after: Optional[List[str]] = None
+    ) -> AsyncIterator[Tuple[List[T], List[str]]]:
+        """
+        Iterates over the unexpired values, of this store's language if any, in batches ordered by primary key.
+        Only one batch is held in memory at a time, so whole stores can be streamed e.g. for backups.
+        :param batch_size: the maximum number of values in each batch
+        :param after: the cursor, as yielded with a previous batch, after which to resume. If None, from the start.
+        :return: an async iterator of the batches, each with the cursor of its last value
+        """
+        raise NotImplementedError("scan not implemented")
+
+    @abstractmethod
+    def scan_range(
+        self,
+        start: int,
+        end: int,
+        batch_size: int = 500,
+        projection: Optional[Type[P]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> AsyncIterator[Union[List[T], List[P]]]:
+        """
+        Iterates over the unexpired songs of this store's language whose numbers are between `start` and `end`,
+        both inclusive, in batches in the numerical order of the numbers, using the index of the numbers' integer values.
+        Only one batch is held in memory at a time, each got with its own bounded query.
+        If a `projection` model is given, only its fields are fetched and instances of it are returned.
+        :param start: the smallest song number to return
+        :param end: the largest song number to return
+        :param batch_size: the maximum number of values in each batch
+        :param projection: the model, with a subset of the fields of this store's model, to return instead
+        :param after: the number and title of the song after which to resume e.g. the last one got by an
+            interrupted scan. If None, from `start`.
+        :return: an async iterator of the batches
+        """
+        raise NotImplementedError("scan_range not implemented")
+
+    async def train_compression_dictionary(
+        self, sample_size: int = 1_000
+    ) -> Optional[str]:
+        """
+        Trains a dictionary on the lines of the songs of this store's language, with which the lines of
+        the songs saved from then on are compressed, if this store compresses lines.
+        Songs saved earlier keep the dictionary they were compressed with until they are saved again.
+        :param sample_size: the maximum number of songs to train on
+        :return: the id of the new dictionary, or None if this store does not compress lines
+        """
+        return None
+
+    @abstractmethod
+    def is_colocated_with(self, other: "Store") -> bool:
+        """
+        Checks whether the other store keeps its values in the same collection as this store,
+        such that a single `delete_many` can span the languages of both
+        :param other: the other store
+        :return: True if the stores share a collection, False otherwise
+        """
+        raise NotImplementedError("is_colocated_with not implemented")
+
     @abstractmethod
     async def clear(self) -> None:
         """
@@ -1,34 +1,142 @@
 """Storage in mongodb"""
+import asyncio
 import dataclasses
-from typing import TypeVar, Type, List, Optional, Dict, Any
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import (
+    TypeVar,
+    Type,
+    List,
+    Optional,
+    Dict,
+    Any,
+    Tuple,
+    Mapping,
+    Union,
+    AsyncIterator,
+)
 
 import pymongo
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from pydantic import BaseModel
+from pymongo import ReturnDocument, ReadPreference, UpdateOne
+from pymongo.collation import Collation
+from pymongo.errors import DuplicateKeyError
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
 from motor.motor_asyncio import (
     AsyncIOMotorClient,
     AsyncIOMotorDatabase,
     AsyncIOMotorCollection,
+    AsyncIOMotorClientSession,
 )
 
-from services.store import Store
+from services.hymns.models import (
+    CompactLines,
+    LineOperation,
+    LineOperationType,
+    apply_line_operations,
+    get_min_number_of_lines,
+)
+from services.errors import StoreOverloadedError
+from services.store.base import Store, StoreConfig
+from services.store.utils.compression import (
+    CompressionDictionaries,
+    CompressionDictionary,
+    compress_lines,
+    decompress_lines,
+    get_dictionary_ids,
+    sample_lines,
+    COMPRESSED_LINES_FIELD,
+    DICTIONARY_ID_FIELD,
+)
 from services.store.utils.collections import (
     get_store_language_and_search_field,
     get_table_name,
     get_pk_fields,
+    is_public_table,
 )
+from services.store.utils.limits import limited
+from services.store.utils.loops import LoopLocal
+from services.store.utils.consistent_reads import get_current_consistent_reads
+from services.store.utils.unit_of_work import get_current_unit_of_work, UnitOfWork
 from services.utils import Config
 
 T = TypeVar("T", bound=BaseModel)
-
-
-class MongoConfig(Config):
+P = TypeVar("P", bound=BaseModel)
+
+_EXPIRES_AT_FIELD = "expires_at"
+_UPDATED_AT_FIELD = "updated_at"
+# read documents are decoded lazily, a field at a time, when converted to models
+_raw_bson_codec_options = CodecOptions(document_class=RawBSONDocument)
+# song numbers are saved as strings, so they are compared as integers by this collation
+_numeric_collation = Collation(locale="en", numericOrdering=True)
+# the length of the slices of the lines of songs that run to the end of the lines
+_max_lines = 2**31 - 1
+# the number of times the lines of a song are re-read and rewritten when it changes concurrently
+_max_rewrite_attempts = 10
+# the index of the songs of each language, in the order of the integer values of their numbers
+_number_index_keys = [
+    ("language", pymongo.ASCENDING),
+    ("number", pymongo.ASCENDING),
+    ("title", pymongo.ASCENDING),
+]
+
+
+class MongoConfig(StoreConfig):
     db_name: str = "data"
+    # the read preference of public reads e.g. of songs, such as 'secondaryPreferred'
+    read_preference: Optional[str] = None
+    # the read concern level of public reads e.g. 'local', 'majority'
+    read_concern: Optional[str] = None
+    # the maximum replication lag in seconds of the secondaries that serve public reads
+    max_staleness_seconds: Optional[int] = None
+    # whether units of work run in multi-document transactions; these need a replica set
+    transactions: bool = False
 
     def get_conn_config(self) -> Dict[str, Any]:
         """Gets the configuration for creating connections"""
-        conf = self.dict(exclude_none=True)
-        del conf["db_name"]
-        return conf
+        return self.dict(
+            exclude_none=True,
+            exclude={
+                "db_name",
+                "read_preference",
+                "read_concern",
+                "max_staleness_seconds",
+                "transactions",
+                *StoreConfig.__fields__.keys(),
+            },
+        )
+
+    def get_read_options(self, is_public: bool) -> Dict[str, Any]:
+        """Gets the collection options for reads.
+
+        Public reads e.g. of songs use the configured read preference and read concern.
+        All other reads e.g. of api keys and users go to the primary.
+
+        Args:
+            is_public: whether the reads are of publicly read data
+
+        Returns:
+            the options to pass to `AsyncIOMotorCollection.with_options`
+        """
+        if not is_public:
+            return {"read_preference": ReadPreference.PRIMARY}
+
+        options = {}
+        if self.read_preference is not None:
+            mode = read_pref_mode_from_name(self.read_preference)
+            max_staleness = self.max_staleness_seconds or -1
+            options["read_preference"] = make_read_preference(
+                mode, tag_sets=None, max_staleness=max_staleness
+            )
+
+        if self.read_concern is not None:
+            options["read_concern"] = ReadConcern(self.read_concern)
+
+        return options
 
 
 @dataclasses.dataclass
@@ -39,12 +147,39 @@ class MongoConnection:
     databases: Dict[str, AsyncIOMotorDatabase] = dataclasses.field(default_factory=dict)
 
 
+class _MongoSession:
+    """A session, with its transaction if any, shared by the operations of a unit of work or of consistent reads"""
+
+    def __init__(self, session: AsyncIOMotorClientSession):
+        self.session = session
+        # a session cannot be used by concurrent operations, e.g. of asyncio.gather
+        self.lock = asyncio.Lock()
+
+    async def commit(self):
+        try:
+            if self.session.in_transaction:
+                await self.session.commit_transaction()
+        finally:
+            await self.session.end_session()
+
+    async def rollback(self):
+        try:
+            if self.session.in_transaction:
+                await self.session.abort_transaction()
+        finally:
+            await self.session.end_session()
+
+    async def close(self):
+        await self.session.end_session()
+
+
 class MongoStore(Store[T]):
     """Storage class implemented using mongodb"""
 
     __store_type__: str = "mongodb"
     __store_config_cls__: Type[Config] = MongoConfig
-    __clients__: Dict[str, AsyncIOMotorClient] = {}
+    __clients__: Dict[str, LoopLocal[AsyncIOMotorClient]] = {}
+    __dictionaries__: Dict[str, CompressionDictionaries] = {}
 
     def __init__(self, uri: str, name: str, model: Type[T], options: MongoConfig):
         super().__init__(uri, name, model, options)
@@ -52,10 +187,20 @@ class MongoStore(Store[T]):
         conn_conf = options.get_conn_config()
         self.__name = name
         self.__uri = uri
+        self.__options = options
         self.__database_name = options.db_name
+        self.__use_transactions = options.transactions
         self.__collection_name = get_table_name(name)
         self._lang, self._search_field = get_store_language_and_search_field(name)
         self.__pk_fields = get_pk_fields(self.__collection_name)
+        self.__read_options = {
+            **options.get_read_options(
+                is_public=is_public_table(self.__collection_name)
+            ),
+            "codec_options": _raw_bson_codec_options,
+        }
+        self.__model_fields = [*model.__fields__.keys()]
+        self.__projection = self.__get_projection(self.__model_fields)
 
         self.__register_client_if_not_exists(conn_conf)
         self.__create_search_index_if_not_exists(conn_conf)
@@ -63,47 +208,415 @@ class MongoStore(Store[T]):
     @property
     def _collection(self) -> AsyncIOMotorCollection:
         """The collection associated with this store"""
-        return MongoStore.__clients__[self.__uri][self.__database_name][
-            self.__collection_name
-        ]
+        client = MongoStore.__clients__[self.__uri].get()
+        return client[self.__database_name][self.__collection_name]
 
-    async def set(self, k: str, v: T, **kwargs) -> None:
-        query = {}
-        data = v.dict()
-        data[self._search_field] = k
+    @property
+    def __dictionaries(self) -> CompressionDictionaries:
+        """The compression dictionaries of the database of this store"""
+        key = f"{self.__uri}/{self.__database_name}"
+        if key not in MongoStore.__dictionaries__:
+            store = MongoStore(
+                self.__uri,
+                name="compression_dictionaries",
+                model=CompressionDictionary,
+                options=self.__options,
+            )
+            MongoStore.__dictionaries__[key] = CompressionDictionaries(store)
+        return MongoStore.__dictionaries__[key]
 
-        for pk_field in self.__pk_fields:
-            pk_value = f"{data.get(pk_field, None)}"
-            query[pk_field] = pk_value
-            data[pk_field] = pk_value
+    @property
+    def _read_collection(self) -> AsyncIOMotorCollection:
+        """The collection associated with this store, with the read preference and concern of this store.
+
+        Within a unit of work, reads go to the primary so that they see the unit of work's writes.
+        """
+        if get_current_unit_of_work() is not None:
+            return self._collection.with_options(codec_options=_raw_bson_codec_options)
+        return self._collection.with_options(**self.__read_options)
+
+    @limited
+    async def set(self, k: str, v: T, ttl: Optional[float] = None, **kwargs) -> None:
+        dictionary = await self.__get_compression_dictionary()
+        query, data = self.__get_upsert_query_and_data(k, v, dictionary=dictionary)
+        async with self.__session() as session:
+            await self._collection.update_one(
+                filter=query,
+                update=_get_upsert_update(data, ttl),
+                upsert=True,
+                session=session,
+            )
+
+    @limited
+    async def set_many(self, items: List[Tuple[str, T]]) -> None:
+        if len(items) == 0:
+            return
+
+        requests = []
+        dictionary = await self.__get_compression_dictionary()
+        for k, v in items:
+            query, data = self.__get_upsert_query_and_data(k, v, dictionary=dictionary)
+            requests.append(
+                UpdateOne(query, _get_upsert_update(data, ttl=None), upsert=True)
+            )
+
+        async with self.__session() as session:
+            await self._collection.bulk_write(requests, ordered=False, session=session)
+
+    @limited
+    async def insert_if_absent(self, k: str, v: T, ttl: Optional[float] = None) -> bool:
+        dictionary = await self.__get_compression_dictionary()
+        query, data = self.__get_upsert_query_and_data(k, v, dictionary=dictionary)
+        # only an expired document can be matched; otherwise, the upsert attempts an insert
+        # which fails on the unique index if an unexpired document exists
+        query[_EXPIRES_AT_FIELD] = {"$lte": datetime.utcnow()}
 
-        await self._collection.update_one(
-            filter=query, update={"$set": data}, upsert=True
-        )
+        try:
+            async with self.__session() as session:
+                await self._collection.update_one(
+                    filter=query,
+                    update=_get_upsert_update(data, ttl),
+                    upsert=True,
+                    session=session,
+                )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def update_fields(self, k: str, fields: Dict[str, Any]) -> Optional[T]:
+        if len(fields) == 0:
+            return await self.get(k)
+        return await self.__update_matching(self.__get_query(k), fields)
+
+    @limited
+    async def __update_matching(
+        self, query: Dict[str, Any], fields: Dict[str, Any]
+    ) -> Optional[T]:
+        """Updates the given fields of the first value matching the query, returning the updated value"""
+        data = {field: self.__to_field_value(field, v) for field, v in fields.items()}
+        if "lines" in data and self._lang:
+            data = self.__compress(data, await self.__get_compression_dictionary())
+
+        async with self.__session() as session:
+            value = await self._collection.find_one_and_update(
+                query,
+                {"$set": data, "$currentDate": {_UPDATED_AT_FIELD: True}},
+                projection=self.__projection,
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+        if value is not None:
+            values = await self.__to_models([value])
+            return values[0]
+
+    async def patch_lines(
+        self,
+        k: str,
+        operations: List[LineOperation],
+        fields: Optional[Dict[str, Any]] = None,
+    ) -> Optional[T]:
+        """Changes the lines of the song of key `k` in one update, if they are uncompressed arrays
+
+        Replacements are positional $set's of the lines; insertions and deletions rebuild the lines
+        in an update pipeline. Lines saved in the compact encoding or compressed are rewritten instead,
+        as are those of songs with too few lines for the operations, so that the errors are those of the rewrite.
+        """
+        if len(operations) == 0:
+            return await self.update_fields(k, fields or {})
+        if self._compact_lines or self._compress_lines:
+            return await self.__rewrite_lines(k, operations, fields or {})
+
+        value = await self.__patch_lines_in_place(k, operations, fields or {})
+        if value is None:
+            return await self.__rewrite_lines(k, operations, fields or {})
+        return value
+
+    async def __rewrite_lines(
+        self, k: str, operations: List[LineOperation], fields: Dict[str, Any]
+    ) -> Optional[T]:
+        """Reads the song of key `k`, applies the operations to its lines and writes them back with the given fields
+
+        The write only applies if the song has not been updated since it was read, lest it overwrite
+        a concurrent change; otherwise, the song is read and rewritten again.
+
+        Raises:
+            ValueError: the index of some operation is beyond the lines of the song
+            StoreOverloadedError: the song kept changing concurrently
+        """
+        for _ in range(_max_rewrite_attempts):
+            document = await self.__get_latest_document(k)
+            if document is None:
+                return None
+
+            values = await self.__to_models([document])
+            lines = apply_line_operations(getattr(values[0], "lines"), operations)
+            query = {
+                **self.__get_query(k),
+                _UPDATED_AT_FIELD: document.get(_UPDATED_AT_FIELD),
+            }
+            value = await self.__update_matching(query, {**fields, "lines": lines})
+            if value is not None:
+                return value
+
+        raise StoreOverloadedError(f"patch_lines: {k} kept changing concurrently")
+
+    @limited
+    async def __get_latest_document(self, k: str) -> Optional[Mapping[str, Any]]:
+        """Gets the document of key `k`, with its update time, from the primary"""
+        projection = {**self.__projection, _UPDATED_AT_FIELD: 1}
+        async with self.__session() as session:
+            return await self._collection.find_one(
+                self.__get_query(k), projection=projection, session=session
+            )
+
+    @limited
+    async def __patch_lines_in_place(
+        self, k: str, operations: List[LineOperation], fields: Dict[str, Any]
+    ) -> Optional[T]:
+        """Applies the operations to the lines of the song of key `k` within the database
+
+        Returns:
+            the updated song, or None if there is no song whose lines are an array long enough for the operations
+        """
+        query = {**self.__get_query(k), "lines": {"$type": "array"}}
+        min_number_of_lines = get_min_number_of_lines(operations)
+        if min_number_of_lines > 0:
+            query[f"lines.{min_number_of_lines - 1}"] = {"$exists": True}
+
+        data = {field: self.__to_field_value(field, v) for field, v in fields.items()}
+        if all(op.op == LineOperationType.REPLACE for op in operations):
+            for operation in operations:
+                data[f"lines.{operation.index}"] = _to_document_value(operation.line)
+            update = {"$set": data, "$currentDate": {_UPDATED_AT_FIELD: True}}
+        else:
+            update = [
+                *(_get_line_operation_stage(op) for op in operations),
+                {
+                    "$set": {
+                        **{field: {"$literal": v} for field, v in data.items()},
+                        _UPDATED_AT_FIELD: "$$NOW",
+                    }
+                },
+            ]
+
+        async with self.__session() as session:
+            value = await self._collection.find_one_and_update(
+                query,
+                update,
+                projection=self.__projection,
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+        if value is not None:
+            values = await self.__to_models([value])
+            return values[0]
 
-    async def get(self, k: str) -> Optional[T]:
+    @limited
+    async def increment(self, k: str, field: str, by: int = 1) -> Optional[T]:
         query = self.__get_query(k)
-        value = await self._collection.find_one(query)
+        async with self.__session() as session:
+            value = await self._collection.find_one_and_update(
+                query,
+                {"$inc": {field: by}, "$currentDate": {_UPDATED_AT_FIELD: True}},
+                projection=self.__projection,
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
         if value is not None:
-            return self._model(**value)
+            values = await self.__to_models([value])
+            return values[0]
 
-    async def search(self, term: str, skip: int = 0, limit: int = 0) -> List[T]:
+    @limited
+    async def get(
+        self, k: str, projection: Optional[Type[P]] = None
+    ) -> Union[T, P, None]:
+        query = self.__get_query(k)
+        find_projection = self.__projection
+        if projection is not None:
+            find_projection = self.__get_projection([*projection.__fields__.keys()])
+
+        async with self.__session() as session:
+            value = await self._read_collection.find_one(
+                query, projection=find_projection, session=session
+            )
+        if value is not None:
+            values = await self.__to_models([value], model=projection)
+            return values[0]
+
+    @limited
+    async def search(
+        self,
+        term: str,
+        skip: int = 0,
+        limit: int = 0,
+        projection: Optional[Type[P]] = None,
+    ) -> Union[List[T], List[P]]:
         length = None
+        model = self._model if projection is None else projection
+        fields = [*model.__fields__.keys()]
         query = self.__get_query(term, is_regex=True)
-        cursor = self._collection.find(query)
-        cursor.skip(skip)
-        if limit > 0:
-            cursor.limit(limit)
-            length = limit
-
-        results = await cursor.to_list(length)
-        return [self._model(**item) for item in results]
-
+        async with self.__session() as session:
+            cursor = self._read_collection.find(
+                query, projection=self.__get_projection(fields), session=session
+            )
+            cursor.skip(skip)
+            if limit > 0:
+                cursor.limit(limit)
+                length = limit
+
+            results = await cursor.to_list(length)
+        return await self.__to_models(results, model=model)
+
+    @limited
+    async def exists(self, k: str) -> bool:
+        query = self.__get_query(k)
+        async with self.__session() as session:
+            value = await self._read_collection.find_one(
+                query, projection={"_id": 1}, session=session
+            )
+        return value is not None
+
+    @limited
+    async def count(self, term: str = "", limit: int = 0) -> int:
+        query = self.__get_query(term, is_regex=True)
+        kwargs = {"limit": limit} if limit > 0 else {}
+        async with self.__session() as session:
+            return await self._read_collection.count_documents(
+                query, session=session, **kwargs
+            )
+
+    @limited
+    async def changed_since(
+        self, since: Optional[datetime] = None
+    ) -> Tuple[List[T], Optional[datetime]]:
+        query = _get_unexpired_query()
+        if self._lang:
+            query["language"] = self._lang
+        if since is not None:
+            query[_UPDATED_AT_FIELD] = {"$gt": since}
+
+        projection = {**self.__projection, _UPDATED_AT_FIELD: 1}
+        async with self.__session() as session:
+            cursor = self._read_collection.find(query, projection, session=session)
+            cursor.sort(_UPDATED_AT_FIELD, pymongo.ASCENDING)
+            documents = await cursor.to_list(None)
+
+        latest = max(
+            (doc[_UPDATED_AT_FIELD] for doc in documents if _UPDATED_AT_FIELD in doc),
+            default=since,
+        )
+        return await self.__to_models(documents), latest
+
+    async def scan(
+        self, batch_size: int = 500, after: Optional[List[str]] = None
+    ) -> AsyncIterator[Tuple[List[T], List[str]]]:
+        sort = [(field, pymongo.ASCENDING) for field in self.__pk_fields]
+        projection = {**self.__projection, **{field: 1 for field in self.__pk_fields}}
+
+        while True:
+            query = {"$and": [_get_unexpired_query()]}
+            if self._lang:
+                query["language"] = self._lang
+            if after is not None:
+                query["$and"].append(_get_after_query(self.__pk_fields, after))
+
+            documents = await self.__get_batch(query, projection, sort, batch_size)
+            if len(documents) == 0:
+                return
+
+            after = [documents[-1][field] for field in self.__pk_fields]
+            yield await self.__to_models(documents), after
+
+            if len(documents) < batch_size:
+                return
+
+    @limited
+    async def __get_batch(
+        self,
+        query: Dict[str, Any],
+        projection: Dict[str, int],
+        sort: List[Tuple[str, int]],
+        batch_size: int,
+        collation: Optional[Collation] = None,
+    ) -> List[Mapping[str, Any]]:
+        """Gets the next batch of documents of the scan, comparing strings by the given collation if any"""
+        async with self.__session() as session:
+            cursor = self._read_collection.find(
+                query, projection, session=session, collation=collation
+            )
+            cursor.sort(sort).limit(batch_size)
+            return await cursor.to_list(batch_size)
+
+    async def scan_range(
+        self,
+        start: int,
+        end: int,
+        batch_size: int = 500,
+        projection: Optional[Type[P]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> AsyncIterator[Union[List[T], List[P]]]:
+        model = self._model if projection is None else projection
+        fields = [*model.__fields__.keys()]
+        find_projection = {**self.__get_projection(fields), "number": 1, "title": 1}
+        sort = [(field, pymongo.ASCENDING) for field in ("number", "title")]
+        # the numbers are saved as strings, compared numerically by the collation
+        after = None if after is None else [f"{after[0]}", after[1]]
+
+        while True:
+            query = {
+                "language": self._lang,
+                "number": {"$gte": f"{start}", "$lte": f"{end}"},
+                "$and": [_get_unexpired_query()],
+            }
+            if after is not None:
+                query["$and"].append(_get_after_query(["number", "title"], after))
+
+            documents = await self.__get_batch(
+                query,
+                find_projection,
+                sort,
+                batch_size,
+                collation=_numeric_collation,
+            )
+            if len(documents) == 0:
+                return
+
+            after = [documents[-1]["number"], documents[-1]["title"]]
+            yield await self.__to_models(documents, model=model)
+
+            if len(documents) < batch_size:
+                return
+
+    @limited
     async def delete(self, k: str) -> List[T]:
         query = self.__get_query(k)
-        matched_items = await self._collection.find(query).to_list(length=None)
-        await self._collection.delete_many(query)
-        return [self._model(**item) for item in matched_items]
+        return await self.__delete_matching(query)
+
+    @limited
+    async def delete_many(
+        self, fields: Dict[str, Any], languages: Optional[List[str]] = None
+    ) -> List[T]:
+        if len(fields) == 0:
+            return []
+
+        field_queries = [
+            {field: self.__to_field_value(field, value)}
+            for field, value in fields.items()
+        ]
+        query = {"$and": [{"$or": field_queries}, _get_unexpired_query()]}
+        if self._lang:
+            langs = [self._lang] if languages is None else languages
+            query["language"] = {"$in": langs}
+
+        return await self.__delete_matching(query)
+
+    def is_colocated_with(self, other: Store) -> bool:
+        return (
+            isinstance(other, MongoStore)
+            and other.__uri == self.__uri
+            and other.__database_name == self.__database_name
+            and other.__collection_name == self.__collection_name
+        )
 
     async def clear(self) -> None:
         return await self._collection.delete_many({})
@@ -112,9 +625,147 @@ class MongoStore(Store[T]):
     async def _clean_up():
         uris = [*MongoStore.__clients__.keys()]
         for uri in uris:
-            MongoStore.__clients__[uri].close()
+            for _, client in MongoStore.__clients__[uri].pop_all():
+                client.close()
             del MongoStore.__clients__[uri]
 
+        MongoStore.__dictionaries__.clear()
+
+    async def __delete_matching(self, query: Dict[str, Any]) -> List[T]:
+        """Deletes the documents that match the query, returning them.
+
+        Only the documents found are deleted, by _id, so documents inserted concurrently are never
+        deleted without being returned. It takes two round trips, whatever the number of languages.
+        """
+        projection = {**self.__projection, "_id": 1}
+        async with self.__session() as session:
+            cursor = self._collection.find(query, projection, session=session)
+            matched_items = await cursor.to_list(None)
+            if len(matched_items) > 0:
+                ids = [item["_id"] for item in matched_items]
+                await self._collection.delete_many(
+                    {"_id": {"$in": ids}}, session=session
+                )
+
+        return await self.__to_models(matched_items)
+
+    @asynccontextmanager
+    async def __session(self) -> AsyncIterator[Optional[AsyncIOMotorClientSession]]:
+        """Yields the session of the current unit of work or consistent reads, one operation at a time, or None
+
+        The session of consistent reads is causally consistent, so each read sees at least the data of the reads
+        before it, even when they are served by different secondaries.
+        """
+        key = f"{self.__store_type__}/{self.__uri}"
+        uow = get_current_unit_of_work()
+        reads = get_current_consistent_reads()
+        if uow is not None:
+            transaction = await uow.get_transaction(key, self.__start_session)
+            async with transaction.lock:
+                yield transaction.session
+        elif reads is not None:
+            read_session = await reads.get_session(key, self.__start_read_session)
+            async with read_session.lock:
+                yield read_session.session
+        else:
+            yield None
+
+    async def __start_session(self) -> _MongoSession:
+        """Starts the session, and its transaction if enabled, for a unit of work"""
+        client = MongoStore.__clients__[self.__uri].get()
+        session = await client.start_session()
+        if self.__use_transactions:
+            session.start_transaction()
+        return _MongoSession(session)
+
+    async def __start_read_session(self) -> _MongoSession:
+        """Starts the causally consistent session, without a transaction, of consistent reads"""
+        client = MongoStore.__clients__[self.__uri].get()
+        session = await client.start_session(causal_consistency=True)
+        return _MongoSession(session)
+
+    def __to_field_value(self, field: str, value: Any) -> Any:
+        """Converts the value of the field into the value saved in the document; primary key fields are strings"""
+        if field in self.__pk_fields:
+            return f"{value}"
+        if field == "lines" and self._compact_lines:
+            return CompactLines.from_lines(value).dict()
+        return _to_document_value(value)
+
+    async def __to_models(
+        self, documents: List[Mapping[str, Any]], model: Optional[Type[P]] = None
+    ) -> List[Union[T, P]]:
+        """Converts the documents, decoded or raw BSON, into the model, or this store's model if None.
+
+        The lines that were compressed are decompressed, loading their dictionaries.
+        """
+        model = self._model if model is None else model
+        fields = [*model.__fields__.keys()]
+
+        dictionary_ids = get_dictionary_ids(documents)
+        if len(dictionary_ids) > 0:
+            await self.__dictionaries.load(dictionary_ids)
+            documents = [
+                decompress_lines(doc, self.__dictionaries) for doc in documents
+            ]
+
+        return [_to_model(doc, model=model, fields=fields) for doc in documents]
+
+    def __get_projection(self, fields: List[str]) -> Dict[str, int]:
+        """Gets the projection that returns only the given fields, and the compressed lines if lines are among them"""
+        projection = _get_projection(fields)
+        if self._lang and "lines" in fields:
+            projection[COMPRESSED_LINES_FIELD] = 1
+            projection[DICTIONARY_ID_FIELD] = 1
+        return projection
+
+    async def __get_compression_dictionary(self) -> Optional[CompressionDictionary]:
+        """Gets the dictionary to compress the lines of songs with, or None if they are not to be compressed"""
+        if not self._compress_lines or not self._lang:
+            return None
+        return await self.__dictionaries.get_latest(self._lang)
+
+    async def train_compression_dictionary(
+        self, sample_size: int = 1_000
+    ) -> Optional[str]:
+        if not self._compress_lines or not self._lang:
+            return None
+
+        samples = await sample_lines(self, sample_size, compact=self._compact_lines)
+        dictionary = await self.__dictionaries.train(self._lang, samples)
+        return dictionary.id
+
+    @staticmethod
+    def __compress(
+        data: Dict[str, Any], dictionary: Optional[CompressionDictionary]
+    ) -> Dict[str, Any]:
+        """Compresses the lines of the song document if a dictionary is given"""
+        if dictionary is None:
+            return compress_lines(data, dictionary=None)
+        return compress_lines({**data, "lines": json.dumps(data["lines"])}, dictionary)
+
+    def __get_upsert_query_and_data(
+        self, k: str, v: T, dictionary: Optional[CompressionDictionary] = None
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Constructs the filter query and the document for upserting the value `v` of key `k`
+
+        The lines of songs are compressed if a compression `dictionary` is given.
+        """
+        query = {}
+        data = v.dict()
+        data[self._search_field] = k
+        if "lines" in data:
+            data["lines"] = self.__to_field_value("lines", getattr(v, "lines"))
+            if self._lang:
+                data = self.__compress(data, dictionary)
+
+        for pk_field in self.__pk_fields:
+            pk_value = f"{data.get(pk_field, None)}"
+            query[pk_field] = pk_value
+            data[pk_field] = pk_value
+
+        return query, data
+
     def __get_query(self, search_value: Any, is_regex: bool = False) -> Dict[str, Any]:
         """Constructs the filter query object for searching, getting or deleting"""
         if is_regex:
@@ -127,12 +778,20 @@ class MongoStore(Store[T]):
         if self._lang:
             query.update({"language": self._lang})
 
+        query.update(_get_unexpired_query())
         return query
 
     def __register_client_if_not_exists(self, conf: Dict[str, Any]):
-        """Registers the mongo client for the associated uri if it has not yet been registered"""
-        if self.__uri not in MongoStore.__clients__:
-            MongoStore.__clients__[self.__uri] = AsyncIOMotorClient(self.__uri, **conf)
+        """Registers the mongo clients for the associated uri if they have not yet been registered.
+
+        The clients themselves are created lazily on the event loops they are used on.
+        """
+        uri = self.__uri
+        if uri not in MongoStore.__clients__:
+            MongoStore.__clients__[uri] = LoopLocal(
+                factory=lambda: AsyncIOMotorClient(uri, **conf),
+                discard=lambda client: client.close(),
+            )
 
     def __create_search_index_if_not_exists(self, conf: Dict[str, Any]):
         """Creates a unique index on the associated uri, database and collection"""
@@ -145,5 +804,93 @@ class MongoStore(Store[T]):
             collection = sync_db[self.__database_name][self.__collection_name]
 
             collection.create_index(keys=keys, name=index_name, unique=True)
+            collection.create_index(
+                keys=[(_EXPIRES_AT_FIELD, pymongo.ASCENDING)],
+                name=f"{self.__collection_name}_{_EXPIRES_AT_FIELD}",
+                expireAfterSeconds=0,
+            )
+            collection.create_index(
+                keys=[(_UPDATED_AT_FIELD, pymongo.ASCENDING)],
+                name=f"{self.__collection_name}_{_UPDATED_AT_FIELD}",
+            )
+            if self._lang:
+                collection.create_index(
+                    keys=_number_index_keys,
+                    name=f"{self.__collection_name}_language_number_value",
+                    collation=_numeric_collation,
+                )
         finally:
             sync_db.close()
+
+
+def _get_unexpired_query() -> Dict[str, Any]:
+    """Gets the query that excludes expired documents
+
+    The TTL monitor runs only periodically so expired documents may still exist.
+    """
+    return {
+        "$or": [
+            {_EXPIRES_AT_FIELD: None},
+            {_EXPIRES_AT_FIELD: {"$gt": datetime.utcnow()}},
+        ]
+    }
+
+
+def _get_after_query(fields: List[str], values: List[Any]) -> Dict[str, Any]:
+    """Gets the query for the documents whose given fields, compared in order, come after the given values"""
+    alternatives = []
+    for i, field in enumerate(fields):
+        equal_prefix = {fields[j]: values[j] for j in range(i)}
+        alternatives.append({**equal_prefix, field: {"$gt": values[i]}})
+    return {"$or": alternatives}
+
+
+def _get_projection(fields: List[str]) -> Dict[str, int]:
+    """Gets the projection that returns only the given fields of the documents"""
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+
+def _to_model(document: Mapping[str, Any], model: Type[P], fields: List[str]) -> P:
+    """Converts the document, decoded or raw BSON, into the model, reading only the given fields of the model"""
+    return model(**{field: document[field] for field in fields if field in document})
+
+
+def _get_upsert_update(data: Dict[str, Any], ttl: Optional[float]) -> Dict[str, Any]:
+    """Constructs the update for upserting the given document with the given time-to-live in seconds"""
+    # the time of the server, not this worker, orders the changes pulled by edge nodes
+    current_date = {_UPDATED_AT_FIELD: True}
+    if ttl is None:
+        return {
+            "$set": data,
+            "$unset": {_EXPIRES_AT_FIELD: ""},
+            "$currentDate": current_date,
+        }
+
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+    return {
+        "$set": {**data, _EXPIRES_AT_FIELD: expires_at},
+        "$currentDate": current_date,
+    }
+
+
+def _get_line_operation_stage(operation: LineOperation) -> Dict[str, Any]:
+    """Gets the update pipeline stage that applies the operation to the lines of a song"""
+    index = operation.index
+    before = {"$slice": ["$lines", index]} if index > 0 else []
+    new_lines = []
+    if operation.op != LineOperationType.DELETE:
+        # the words are not to be read as expressions e.g. field paths
+        new_lines = {"$literal": [_to_document_value(operation.line)]}
+
+    after_index = index if operation.op == LineOperationType.INSERT else index + 1
+    after = {"$slice": ["$lines", after_index, _max_lines]}
+    return {"$set": {"lines": {"$concatArrays": [before, new_lines, after]}}}
+
+
+def _to_document_value(value: Any) -> Any:
+    """Converts the given value into a value that can be saved in a mongo document"""
+    if isinstance(value, BaseModel):
+        return value.dict()
+    elif isinstance(value, (list, tuple)):
+        return [_to_document_value(item) for item in value]
+    return value
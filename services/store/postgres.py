@@ -1,41 +1,333 @@
 """Storage in postgres"""
+import asyncio
 import dataclasses
-from typing import TypeVar, Type, Optional, List, Dict, Any
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import timedelta, datetime
+from typing import (
+    Iterable,
+    Mapping,
+    TypeVar,
+    Type,
+    Optional,
+    List,
+    Dict,
+    Any,
+    Callable,
+    Awaitable,
+    Union,
+    AsyncIterator,
+    Tuple,
+)
 
+import asyncpg
 from pydantic import BaseModel
-from sqlalchemy import MetaData, Table, select, RowMapping, delete
-from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
-from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy import (
+    Column,
+    MetaData,
+    Table,
+    select,
+    RowMapping,
+    delete,
+    update,
+    or_,
+    func,
+    literal_column,
+    literal,
+    text,
+    tuple_,
+    case,
+    cast,
+    Integer,
+    Text,
+)
+from sqlalchemy.exc import OperationalError, InterfaceError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection, create_async_engine
+from sqlalchemy.dialects.postgresql import insert as pg_insert, array, JSONB
+from sqlalchemy.sql.elements import ColumnElement
 
-from services.store.base import Store
+from services.hymns.models import (
+    LineOperation,
+    LineOperationType,
+    apply_line_operations,
+    get_min_number_of_lines,
+)
+from services.store.base import Store, StoreConfig
+from services.store.utils.compression import (
+    CompressionDictionaries,
+    CompressionDictionary,
+    compress_lines,
+    decompress_lines,
+    get_dictionary_ids,
+    sample_lines,
+    COMPRESSED_LINES_FIELD,
+)
 from services.store.utils.collections import (
     get_store_language_and_search_field,
     get_table_name,
     get_pk_fields,
+    is_public_table,
 )
 from services.store.utils.sqlachemy import (
     get_table_columns,
     extract_data_for_table,
     conv_model_to_dict,
     conv_dict_to_model,
+    conv_fields_to_dict,
+    get_table_kwargs,
+    get_partition_key,
+    get_table_migrations,
+    get_table_index_statements,
+    get_number_value,
+    EXPIRES_AT_FIELD,
+    UPDATED_AT_FIELD,
+)
+from services.store.utils.partitions import (
+    lock_partitions,
+    rename_unpartitioned_table_if_exists,
+    move_rows_from_unpartitioned_table,
+    create_default_partition_if_not_exists,
+    create_partition_if_not_exists,
 )
-from services.store.utils.uri import get_pg_async_uri
+from services.store.utils.fast_reads import FastReadPool, fetch_song, search_songs
+from services.store.utils.limits import limited
+from services.store.utils.loops import LoopLocal
+from services.store.utils.consistent_reads import get_current_consistent_reads
+from services.store.utils.unit_of_work import (
+    get_current_unit_of_work,
+    unit_of_work,
+    UnitOfWork,
+)
+from services.store.utils.uri import get_pg_async_uri, escape_db_uri
 from services.utils import Config
 
 T = TypeVar("T", bound=BaseModel)
+P = TypeVar("P", bound=BaseModel)
+R = TypeVar("R")
+
+_logger = logging.getLogger(__name__)
+# the errors raised when a replica cannot be connected to or the connection is lost
+_replica_failure_errors = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresError,
+    OperationalError,
+    InterfaceError,
+)
+
 
+# the fields of the config of the read replicas of a database
+_replica_fields = {
+    "db_replica_uris",
+    "replica_ejection_period",
+    "read_your_writes_window",
+}
+# the fields of the config of the fast reads of a database, via asyncpg
+_fast_reads_fields = {
+    "fast_reads",
+    "fast_reads_pool_size",
+    "fast_reads_statement_cache_size",
+}
 
-class PgConfig(Config):
-    pass
+
+class PgConfig(StoreConfig):
+    # the interval in seconds between sweeps that delete expired records
+    ttl_sweep_interval: float = 60
+    # the maximum number of expired records deleted in one statement
+    ttl_sweep_batch_size: int = 1_000
+    # the map of primary db uri to the uris of its read replicas
+    db_replica_uris: Dict[str, List[str]] = {}
+    # the seconds for which a failing replica receives no reads
+    replica_ejection_period: float = 30
+    # the seconds after a write during which reads of this worker go to the primary
+    read_your_writes_window: float = 5
+    # whether songs are read by number or title directly via asyncpg, bypassing SQLAlchemy
+    fast_reads: bool = False
+    # the maximum number of connections in the dedicated pool of the fast reads
+    fast_reads_pool_size: int = 10
+    # the number of prepared statements cached per connection of the fast reads pool
+    fast_reads_statement_cache_size: int = 1_024
+
+    def get_conn_config(self) -> Dict[str, Any]:
+        """Gets the configuration for creating the engine"""
+        conf = self.dict(exclude_none=True)
+        del conf["ttl_sweep_interval"]
+        del conf["ttl_sweep_batch_size"]
+        del conf["db_replica_uris"]
+        del conf["replica_ejection_period"]
+        del conf["read_your_writes_window"]
+        del conf["fast_reads"]
+        del conf["fast_reads_pool_size"]
+        del conf["fast_reads_statement_cache_size"]
+        for key in StoreConfig.__fields__:
+            conf.pop(key, None)
+        return conf
+
+    def get_replica_uris(self, uri: str) -> List[str]:
+        """Gets the uris of the read replicas of the primary db at the given uri"""
+        for primary_uri, replica_uris in self.db_replica_uris.items():
+            if escape_db_uri(primary_uri) == uri:
+                return [escape_db_uri(replica_uri) for replica_uri in replica_uris]
+        return []
+
+
+class _PgDatabase:
+    """A database, primary or replica, whose connection pools are created per event loop"""
+
+    engines: LoopLocal[AsyncEngine]
+    fast_pools: Optional[LoopLocal[FastReadPool]]
+
+    @property
+    def engine(self) -> AsyncEngine:
+        """The engine of the running event loop"""
+        return self.engines.get()
+
+    @property
+    def has_fast_reads(self) -> bool:
+        """Whether songs are to be read directly via asyncpg"""
+        return self.fast_pools is not None
+
+    async def get_fast_pool(self) -> asyncpg.Pool:
+        """Gets the dedicated asyncpg pool of the fast reads for the running event loop"""
+        return await self.fast_pools.get().get()
+
+    async def dispose(self):
+        """Disposes the connection pools of all event loops"""
+        await _dispose_engines(self.engines)
+        if self.fast_pools is not None:
+            await _close_fast_pools(self.fast_pools)
 
 
 @dataclasses.dataclass
-class PgConnection:
-    """An SQLAlchemy engine with its meta data"""
+class PgReplica(_PgDatabase):
+    """The SQLAlchemy engines of a read replica with its health"""
 
-    engine: AsyncEngine
+    engines: LoopLocal[AsyncEngine]
+    fast_pools: Optional[LoopLocal[FastReadPool]] = None
+    ejected_until: float = 0
+    uri: str = ""
+
+    @property
+    def is_healthy(self) -> bool:
+        """Whether the replica can receive reads"""
+        return time.monotonic() >= self.ejected_until
+
+    def eject(self, period: float):
+        """Stops the replica from receiving reads for the given period in seconds"""
+        self.ejected_until = time.monotonic() + period
+
+
+@dataclasses.dataclass
+class PgConnection(_PgDatabase):
+    """The SQLAlchemy engines, one per event loop, of a database with its meta data"""
+
+    engines: LoopLocal[AsyncEngine]
     metadata: MetaData
+    config: PgConfig
+    fast_pools: Optional[LoopLocal[FastReadPool]] = None
     tables: Dict[str, Table] = dataclasses.field(default_factory=dict)
+    sweeper: Optional[asyncio.Task] = None
+    replicas: List[PgReplica] = dataclasses.field(default_factory=list)
+    # the replicas no longer configured, disposed with the database as reads may still be running on them
+    retired_replicas: List[PgReplica] = dataclasses.field(default_factory=list)
+    # the fast reads pools replaced by those of new fast reads settings, disposed with the database likewise
+    retired_fast_pools: List[LoopLocal[FastReadPool]] = dataclasses.field(
+        default_factory=list
+    )
+    last_write_at: float = float("-inf")
+    replica_cursor: int = 0
+
+    async def dispose(self):
+        """Disposes the connection pools of the database and its replicas on all event loops"""
+        sweeper = self.sweeper
+        if sweeper is not None and not sweeper.done():
+            # a task of a closed event loop can neither run nor be cancelled
+            if not sweeper.get_loop().is_closed():
+                sweeper.cancel()
+
+        await super().dispose()
+        for replica in [*self.replicas, *self.retired_replicas]:
+            await replica.dispose()
+        for fast_pools in self.retired_fast_pools:
+            await _close_fast_pools(fast_pools)
+
+    def configure(self, uri: str, options: PgConfig):
+        """Applies the replica and fast reads settings of the options of another store of this database, if they set any
+
+        The database is registered by its first store e.g. the config store, whose options may set none.
+        """
+        fields = options.__fields_set__ & (_replica_fields | _fast_reads_fields)
+        if len(fields) == 0:
+            return
+
+        old_config = self.config
+        self.config = old_config.copy(
+            update={field: getattr(options, field) for field in fields}
+        )
+        if any(
+            getattr(self.config, field) != getattr(old_config, field)
+            for field in _fast_reads_fields
+        ):
+            for db, db_uri in [(self, uri), *((r, r.uri) for r in self.replicas)]:
+                if db.fast_pools is not None:
+                    self.retired_fast_pools.append(db.fast_pools)
+                db.fast_pools = _get_loop_local_fast_pools(db_uri, self.config)
+
+        replica_uris = self.config.get_replica_uris(uri)
+        if replica_uris == [replica.uri for replica in self.replicas]:
+            return
+
+        current = {replica.uri: replica for replica in self.replicas}
+        self.replicas = [
+            current.pop(r_uri, None) or _create_replica(r_uri, self.config)
+            for r_uri in replica_uris
+        ]
+        self.retired_replicas.extend(current.values())
+        self.replica_cursor = 0
+
+    def pick_replica(self) -> Optional[PgReplica]:
+        """Picks the next healthy replica to read from, round-robin.
+
+        It returns None if there is no healthy replica, or if this worker wrote
+        within the read-your-writes window, in which case reads go to the primary.
+        """
+        since_last_write = time.monotonic() - self.last_write_at
+        if since_last_write < self.config.read_your_writes_window:
+            return None
+
+        healthy_replicas = [replica for replica in self.replicas if replica.is_healthy]
+        if len(healthy_replicas) == 0:
+            return None
+
+        self.replica_cursor = (self.replica_cursor + 1) % len(healthy_replicas)
+        return healthy_replicas[self.replica_cursor]
+
+    def record_write(self):
+        """Records that this worker has just written to the primary"""
+        self.last_write_at = time.monotonic()
+
+
+class _PgTransaction:
+    """A connection, with its transaction, shared by the operations of a unit of work"""
+
+    def __init__(self, conn: AsyncConnection):
+        self.conn = conn
+        # a connection cannot run concurrent operations, e.g. of asyncio.gather
+        self.lock = asyncio.Lock()
+
+    async def commit(self):
+        try:
+            await self.conn.commit()
+        finally:
+            await self.conn.close()
+
+    async def rollback(self):
+        try:
+            await self.conn.rollback()
+        finally:
+            await self.conn.close()
 
 
 class PgStore(Store[T]):
@@ -45,16 +337,23 @@ class PgStore(Store[T]):
     __store_config_cls__: Type[Config] = PgConfig
     __engines__: Dict[str, PgConnection] = {}
     __initialized_tables__: Dict[str, bool] = {}
+    __dictionaries__: Dict[str, CompressionDictionaries] = {}
 
     def __init__(self, uri: str, name: str, model: Type[T], options: PgConfig):
         super().__init__(uri, name, model, options)
 
         table_name = get_table_name(name)
         self._uri = uri
+        self.__options = options
         self.__table_name = table_name
         self.__full_tablename = f"{uri}/{table_name}"
         self.__pk_fields = get_pk_fields(table_name)
+        self.__partition_key = get_partition_key(table_name)
         self._lang, self._search_field = get_store_language_and_search_field(name)
+        self.__initialization_key = self.__full_tablename
+        if self.__partition_key is not None and self._lang:
+            # each language's partition is to be created, not just the table
+            self.__initialization_key = f"{self.__full_tablename}/{self._lang}"
 
         PgStore.__register_engine_if_not_exists(uri, options)
         PgStore._add_table_if_not_exists(table_name, uri)
@@ -69,93 +368,451 @@ class PgStore(Store[T]):
         """The engine associated with this store"""
         return PgStore.__engines__[self._uri].engine
 
+    @property
+    def __dictionaries(self) -> CompressionDictionaries:
+        """The compression dictionaries of the database of this store"""
+        if self._uri not in PgStore.__dictionaries__:
+            store = PgStore(
+                self._uri,
+                name="compression_dictionaries",
+                model=CompressionDictionary,
+                options=self.__options,
+            )
+            PgStore.__dictionaries__[self._uri] = CompressionDictionaries(store)
+        return PgStore.__dictionaries__[self._uri]
+
     @property
     def __is_table_created(self):
-        """Whether the table has been created already"""
-        return self.__full_tablename in PgStore.__initialized_tables__
+        """Whether the table, and this store's partition if any, has been created already"""
+        return self.__initialization_key in PgStore.__initialized_tables__
 
-    async def set(self, k: str, v: T, **kwargs) -> None:
-        try:
-            return await self.__set(k, v, **kwargs)
-        except RuntimeError:
-            await self.__engine.dispose()
-            return await self.__set(k, v, **kwargs)
+    @limited
+    async def get(
+        self, k: str, projection: Optional[Type[P]] = None
+    ) -> Union[T, P, None]:
+        return await self.__read(self.__get, k, projection)
 
-    async def get(self, k: str) -> Optional[T]:
-        try:
-            return await self.__get(k)
-        except RuntimeError:
-            await self.__engine.dispose()
-            return await self.__get(k)
+    @limited
+    async def search(
+        self,
+        term: str,
+        skip: int = 0,
+        limit: int = 0,
+        projection: Optional[Type[P]] = None,
+    ) -> Union[List[T], List[P]]:
+        return await self.__read(self.__search, term, skip, limit, projection)
 
-    async def search(self, term: str, skip: int = 0, limit: int = 0) -> List[T]:
-        try:
-            return await self.__search(term, skip, limit)
-        except RuntimeError:
-            await self.__engine.dispose()
-            return await self.__search(term, skip, limit)
+    @limited
+    async def exists(self, k: str) -> bool:
+        return await self.__read(self.__exists, k)
 
-    async def delete(self, k: str) -> List[T]:
-        try:
-            return await self.__delete(k)
-        except RuntimeError:
-            await self.__engine.dispose()
-            return await self.__delete(k)
+    @limited
+    async def count(self, term: str = "", limit: int = 0) -> int:
+        return await self.__read(self.__count, term, limit)
 
-    async def clear(self) -> None:
-        try:
-            return await self.__clear()
-        except RuntimeError:
-            await self.__engine.dispose()
-            return await self.__clear()
-
-    async def __set(self, k: str, v: T, **kwargs) -> None:
+    @limited
+    async def set(self, k: str, v: T, ttl: Optional[float] = None, **kwargs) -> None:
         """Set the value `v` to be associated with key `k` in the database"""
         await self._create_table_if_not_created()
 
-        table_name = self.__table.name
-        v_as_dict = conv_model_to_dict(table_name, v)
-        data = {**{field: k for field in self.__pk_fields}, **v_as_dict}
-        cleaned_data = extract_data_for_table(self.__table.name, data)
-        return await self.__upsert(cleaned_data)
+        dictionary = await self.__get_compression_dictionary()
+        data = self.__get_row_data(k, v, ttl, dictionary=dictionary)
+        await self.__upsert(data)
+        self.__record_write()
 
-    async def __get(self, k: str) -> Optional[T]:
-        """Get the value associated with the key `k`"""
+    @limited
+    async def set_many(self, items: List[Tuple[str, T]]) -> None:
+        """Sets the given key-value pairs with one multi-row upsert"""
+        if len(items) == 0:
+            return
+        await self._create_table_if_not_created()
+
+        dictionary = await self.__get_compression_dictionary()
+        rows = [self.__get_row_data(k, v, dictionary=dictionary) for k, v in items]
+        insert_stmt = pg_insert(self.__table).values(rows)
+        insert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=self.__pk_fields,
+            set_={
+                col.name: insert_stmt.excluded[col.name]
+                for col in self.__table.c
+                if col.name not in self.__pk_fields
+            },
+        )
+
+        async with self.__begin() as conn:
+            await conn.execute(insert_stmt)
+        self.__record_write()
+
+    @limited
+    async def insert_if_absent(self, k: str, v: T, ttl: Optional[float] = None) -> bool:
+        """Inserts the value `v` for the key `k` only if `k` does not exist yet or has expired"""
+        await self._create_table_if_not_created()
+
+        dictionary = await self.__get_compression_dictionary()
+        data = self.__get_row_data(k, v, ttl, dictionary=dictionary)
+        expires_at_col = getattr(self.__table.c, EXPIRES_AT_FIELD)
+        insert_stmt = (
+            pg_insert(self.__table)
+            .values(**data)
+            .on_conflict_do_update(
+                index_elements=self.__pk_fields,
+                set_=data,
+                where=expires_at_col <= func.now(),
+            )
+        )
+
+        async with self.__begin() as conn:
+            res = await conn.execute(insert_stmt)
+
+        self.__record_write()
+        return res.rowcount > 0
+
+    @limited
+    async def update_fields(self, k: str, fields: Dict[str, Any]) -> Optional[T]:
+        """Updates the given fields of the value associated with the key `k`"""
+        await self._create_table_if_not_created()
+
+        data = conv_fields_to_dict(
+            self.__table.name, fields, compact_lines=self._compact_lines
+        )
+        if len(data) == 0:
+            return await self.__get(k, None, db=PgStore.__engines__[self._uri])
+        if "lines" in data:
+            data = compress_lines(data, await self.__get_compression_dictionary())
+
+        return await self.__update(k, data)
+
+    async def patch_lines(
+        self,
+        k: str,
+        operations: List[LineOperation],
+        fields: Optional[Dict[str, Any]] = None,
+    ) -> Optional[T]:
+        """Changes the lines of the song of key `k` with jsonb functions in one UPDATE, if they are uncompressed JSON arrays
+
+        Lines saved in the compact encoding or compressed are rewritten instead, as are those of songs
+        with too few lines for the operations, so that the errors are those of the rewrite.
+        """
+        if len(operations) == 0:
+            return await self.update_fields(k, fields or {})
+        if self._compact_lines or self._compress_lines:
+            return await self.__rewrite_lines(k, operations, fields or {})
+
+        value = await self.__patch_lines_in_place(k, operations, fields or {})
+        if value is None:
+            return await self.__rewrite_lines(k, operations, fields or {})
+        return value
+
+    async def __rewrite_lines(
+        self, k: str, operations: List[LineOperation], fields: Dict[str, Any]
+    ) -> Optional[T]:
+        """Reads the song of key `k`, applies the operations to its lines and writes them back with the given fields
+
+        The read locks the row until the write is committed, in one transaction, so that concurrent changes
+        of the song wait for the rewrite instead of being overwritten by it.
+
+        Raises:
+            ValueError: the index of some operation is beyond the lines of the song
+        """
+        async with unit_of_work():
+            value = await self.__get_for_update(k)
+            if value is None:
+                return None
+
+            lines = apply_line_operations(getattr(value, "lines"), operations)
+            return await self.update_fields(k, {**fields, "lines": lines})
+
+    @limited
+    async def __get_for_update(self, k: str) -> Optional[T]:
+        """Gets the value associated with the key `k` from the primary, locking its row until the transaction ends"""
         await self._create_table_if_not_created()
 
         clauses = self.__get_filter_clauses(k)
-        select_stmt = select(self.__table).filter(*clauses)
+        select_stmt = select(self.__table).filter(*clauses).with_for_update()
 
-        async with self.__engine.connect() as conn:
+        async with self.__begin() as conn:
+            res = await conn.execute(select_stmt)
+            row = res.mappings().fetchone()
+
+        if isinstance(row, RowMapping):
+            values = await self.__to_models([row])
+            return values[0]
+
+    @limited
+    async def __patch_lines_in_place(
+        self, k: str, operations: List[LineOperation], fields: Dict[str, Any]
+    ) -> Optional[T]:
+        """Applies the operations to the lines of the song of key `k` within the database
+
+        Returns:
+            the updated song, or None if there is no song whose lines are a JSON array long enough for the operations
+        """
+        await self._create_table_if_not_created()
+
+        lines = _get_lines_as_jsonb(self.__table.c.lines)
+        number_of_lines = case(
+            (func.jsonb_typeof(lines) == "array", func.jsonb_array_length(lines)),
+            else_=-1,
+        )
+        data = conv_fields_to_dict(
+            self.__table.name, fields, compact_lines=self._compact_lines
+        )
+        data["lines"] = func.to_json(cast(_get_patched_lines(lines, operations), Text))
+        clauses = [number_of_lines >= get_min_number_of_lines(operations)]
+
+        return await self.__update(k, data, clauses=clauses)
+
+    @limited
+    async def increment(self, k: str, field: str, by: int = 1) -> Optional[T]:
+        """Increments the integer `field` of the value associated with the key `k`"""
+        await self._create_table_if_not_created()
+
+        col = getattr(self.__table.c, field)
+        return await self.__update(k, {field: col + by})
+
+    async def __get(
+        self, k: str, projection: Optional[Type[P]], db: _PgDatabase
+    ) -> Union[T, P, None]:
+        """Get the value associated with the key `k`, reading from the given database
+
+        If a `projection` model is given, only the columns of its fields are selected.
+        """
+        await self._create_table_if_not_created()
+        model = self._model if projection is None else projection
+        columns = self.__get_columns(projection)
+
+        if self.__can_read_fast(db):
+            pool = await db.get_fast_pool()
+            data = await fetch_song(
+                pool,
+                self.__table.name,
+                self._search_field,
+                value=k,
+                language=self._lang,
+                columns=None if projection is None else [c.name for c in columns],
+            )
+            if data is not None:
+                values = await self.__decompress([data])
+                return model(**values[0])
+            return None
+
+        clauses = self.__get_filter_clauses(k)
+        select_stmt = select(*columns).filter(*clauses)
+
+        async with self.__connect(db) as conn:
             res = await conn.execute(select_stmt)
             data = res.mappings().fetchone()
-            if isinstance(data, RowMapping):
-                return conv_dict_to_model(
-                    self.__table.name, model=self._model, data=data
-                )
 
-    async def __search(self, term: str, skip: int = 0, limit: int = 0) -> List[T]:
-        """Searches for the values of keys which satisfy the given search `term`, given the skip and the limit"""
+        if isinstance(data, RowMapping):
+            values = await self.__to_models([data], model=model)
+            return values[0]
+
+    async def __search(
+        self,
+        term: str,
+        skip: int,
+        limit: int,
+        projection: Optional[Type[P]],
+        db: _PgDatabase,
+    ) -> Union[List[T], List[P]]:
+        """Searches for the values of keys which satisfy the given search `term`, given the skip and the limit
+
+        If a `projection` model is given, only the columns of its fields are selected.
+        """
         await self._create_table_if_not_created()
+        model = self._model if projection is None else projection
+        columns = self.__get_columns(projection)
+
+        if self.__can_read_fast(db):
+            pool = await db.get_fast_pool()
+            data = await search_songs(
+                pool,
+                self.__table.name,
+                self._search_field,
+                prefix=term,
+                language=self._lang,
+                skip=skip,
+                limit=limit,
+                columns=None if projection is None else [c.name for c in columns],
+            )
+            return [model(**item) for item in await self.__decompress(data)]
 
         clauses = self.__get_filter_clauses(term, is_ilike=True)
-        select_stmt = select(self.__table).filter(*clauses)
+        select_stmt = select(*columns).filter(*clauses)
         if limit > 0:
             select_stmt = select_stmt.limit(limit)
         if skip > 0:
             select_stmt = select_stmt.offset(skip)
 
-        async with self.__engine.connect() as conn:
+        async with self.__connect(db) as conn:
             res = await conn.execute(select_stmt)
             data = res.mappings().fetchall()
 
-        table_name = self.__table.name
-        return [
-            conv_dict_to_model(table_name, model=self._model, data=item)
-            for item in data
+        return await self.__to_models(data, model=model)
+
+    async def __exists(self, k: str, db: _PgDatabase) -> bool:
+        """Checks whether the key `k` exists, without fetching its value"""
+        await self._create_table_if_not_created()
+
+        clauses = self.__get_filter_clauses(k)
+        select_stmt = select(literal(1)).select_from(self.__table).filter(*clauses)
+
+        async with self.__connect(db) as conn:
+            res = await conn.execute(select_stmt.limit(1))
+            return res.scalar() is not None
+
+    async def __count(self, term: str, limit: int, db: _PgDatabase) -> int:
+        """Counts the keys which satisfy the given search `term`, not counting beyond `limit` if `limit` > 0"""
+        await self._create_table_if_not_created()
+
+        clauses = self.__get_filter_clauses(term, is_ilike=True)
+        matches = select(literal(1)).select_from(self.__table).filter(*clauses)
+        if limit > 0:
+            matches = matches.limit(limit)
+
+        count_stmt = select(func.count()).select_from(matches.subquery())
+
+        async with self.__connect(db) as conn:
+            res = await conn.execute(count_stmt)
+            return res.scalar()
+
+    @limited
+    async def changed_since(
+        self, since: Optional[datetime] = None
+    ) -> Tuple[List[T], Optional[datetime]]:
+        return await self.__read(self.__changed_since, since)
+
+    async def __changed_since(
+        self, since: Optional[datetime], db: _PgDatabase
+    ) -> Tuple[List[T], Optional[datetime]]:
+        """Gets the unexpired values changed after `since`, in the order they were changed, reading from the given database"""
+        await self._create_table_if_not_created()
+
+        updated_at_col = getattr(self.__table.c, UPDATED_AT_FIELD)
+        clauses = [self.__get_unexpired_clause()]
+        if self._lang:
+            clauses.append(self.__table.c.language == self._lang)
+        if since is not None:
+            clauses.append(updated_at_col > since)
+
+        select_stmt = (
+            select(self.__table)
+            .filter(*clauses)
+            .order_by(updated_at_col.asc().nulls_first())
+        )
+
+        async with self.__connect(db) as conn:
+            res = await conn.execute(select_stmt)
+            rows = res.mappings().all()
+
+        values = await self.__to_models(rows)
+        latest = max(
+            (row[UPDATED_AT_FIELD] for row in rows if row[UPDATED_AT_FIELD]),
+            default=since,
+        )
+        return values, latest
+
+    async def scan(
+        self, batch_size: int = 500, after: Optional[List[str]] = None
+    ) -> AsyncIterator[Tuple[List[T], List[str]]]:
+        while True:
+            rows = await self.__read(self.__get_batch, batch_size, after)
+            if len(rows) == 0:
+                return
+
+            after = [rows[-1][field] for field in self.__pk_fields]
+            yield await self.__to_models(rows), after
+
+            if len(rows) < batch_size:
+                return
+
+    @limited
+    async def __get_batch(
+        self, batch_size: int, after: Optional[List[str]], db: _PgDatabase
+    ) -> List[RowMapping]:
+        """Gets the next batch of rows of the scan, ordered by primary key, reading from the given database"""
+        await self._create_table_if_not_created()
+
+        pk_cols = [getattr(self.__table.c, field) for field in self.__pk_fields]
+        clauses = [self.__get_unexpired_clause()]
+        if self._lang:
+            clauses.append(self.__table.c.language == self._lang)
+        if after is not None:
+            clauses.append(tuple_(*pk_cols) > tuple_(*after))
+
+        select_stmt = (
+            select(self.__table).filter(*clauses).order_by(*pk_cols).limit(batch_size)
+        )
+
+        async with self.__connect(db) as conn:
+            res = await conn.execute(select_stmt)
+            return res.mappings().all()
+
+    async def scan_range(
+        self,
+        start: int,
+        end: int,
+        batch_size: int = 500,
+        projection: Optional[Type[P]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> AsyncIterator[Union[List[T], List[P]]]:
+        model = self._model if projection is None else projection
+
+        while True:
+            rows = await self.__read(
+                self.__get_range_batch, start, end, batch_size, projection, after
+            )
+            if len(rows) == 0:
+                return
+
+            after = (int(rows[-1]["number"]), rows[-1]["title"])
+            yield await self.__to_models(rows, model=model)
+
+            if len(rows) < batch_size:
+                return
+
+    @limited
+    async def __get_range_batch(
+        self,
+        start: int,
+        end: int,
+        batch_size: int,
+        projection: Optional[Type[P]],
+        after: Optional[Tuple[int, str]],
+        db: _PgDatabase,
+    ) -> List[RowMapping]:
+        """Gets the next batch of rows of the range scan, in the order of the numbers, reading from the given database
+
+        The rows come after the (number, title) of the last row of the previous batch, if any,
+        so each batch is got by a range scan of the index of the numbers' integer values.
+        """
+        await self._create_table_if_not_created()
+
+        number_value = get_number_value(self.__table)
+        title_col = self.__table.c.title
+        columns = self.__get_columns(projection)
+        columns += [c for c in (self.__table.c.number, title_col) if c not in columns]
+        clauses = [
+            self.__table.c.language == self._lang,
+            number_value.between(start, end),
+            self.__get_unexpired_clause(),
         ]
+        if after is not None:
+            clauses.append(tuple_(number_value, title_col) > tuple_(*after))
+
+        select_stmt = (
+            select(*columns)
+            .filter(*clauses)
+            .order_by(number_value, title_col)
+            .limit(batch_size)
+        )
 
-    async def __delete(self, k: str) -> List[T]:
+        async with self.__connect(db) as conn:
+            res = await conn.execute(select_stmt)
+            return res.mappings().all()
+
+    @limited
+    async def delete(self, k: str) -> List[T]:
         """Deletes the key-value whose key is `k`"""
         await self._create_table_if_not_created()
 
@@ -164,17 +821,51 @@ class PgStore(Store[T]):
             delete(self.__table).filter(*clauses).returning(*self.__table.c.values())
         )
 
-        async with self.__engine.begin() as conn:
+        async with self.__begin() as conn:
             res = await conn.execute(delete_stmt)
-            data = res.mappings()
+            data = res.mappings().fetchall()
 
-        table_name = self.__table.name
-        return [
-            conv_dict_to_model(table_name, model=self._model, data=item)
-            for item in data
-        ]
+        self.__record_write()
+        return await self.__to_models(data)
+
+    @limited
+    async def delete_many(
+        self, fields: Dict[str, Any], languages: Optional[List[str]] = None
+    ) -> List[T]:
+        """Deletes, with one DELETE ... RETURNING, the values any of whose fields equals the given value"""
+        await self._create_table_if_not_created()
+
+        data = conv_fields_to_dict(
+            self.__table.name, fields, compact_lines=self._compact_lines
+        )
+        if len(data) == 0:
+            return []
+
+        clauses = [or_(*[getattr(self.__table.c, f) == v for f, v in data.items()])]
+        if self._lang:
+            langs = [self._lang] if languages is None else languages
+            clauses.append(self.__table.c.language.in_(langs))
+        clauses.append(self.__get_unexpired_clause())
+
+        delete_stmt = (
+            delete(self.__table).filter(*clauses).returning(*self.__table.c.values())
+        )
 
-    async def __clear(self) -> None:
+        async with self.__begin() as conn:
+            res = await conn.execute(delete_stmt)
+            rows = res.mappings().fetchall()
+
+        self.__record_write()
+        return await self.__to_models(rows)
+
+    def is_colocated_with(self, other: Store) -> bool:
+        return (
+            isinstance(other, PgStore)
+            and other._uri == self._uri
+            and other.__table_name == self.__table_name
+        )
+
+    async def clear(self) -> None:
         """Clears all the data in this collection"""
         await self._create_table_if_not_created()
 
@@ -182,6 +873,15 @@ class PgStore(Store[T]):
             await conn.run_sync(self.__table.metadata.drop_all, conn, [self.__table])
             await conn.run_sync(self.__table.metadata.create_all, conn, [self.__table])
 
+            if self.__partition_key is not None:
+                await create_default_partition_if_not_exists(conn, self.__table.name)
+                if self._lang:
+                    await create_partition_if_not_exists(
+                        conn, self.__table, key=self.__partition_key, value=self._lang
+                    )
+
+        self.__record_write()
+
     async def __upsert(self, data: Dict[str, Any]):
         """Inserts the data into the table if not exist"""
         insert_stmt = (
@@ -190,9 +890,192 @@ class PgStore(Store[T]):
             .on_conflict_do_update(index_elements=self.__pk_fields, set_=data)
         )
 
-        async with self.__engine.begin() as conn:
+        async with self.__begin() as conn:
             await conn.execute(insert_stmt)
 
+    async def __update(
+        self, k: str, data: Dict[str, Any], clauses: Optional[List[Any]] = None
+    ) -> Optional[T]:
+        """Updates the row(s) of key `k`, that also match the given clauses if any, with the given data,
+        returning the first updated value"""
+        clauses = [*self.__get_filter_clauses(k), *(clauses or [])]
+        update_stmt = (
+            update(self.__table)
+            .filter(*clauses)
+            .values(**data, **{UPDATED_AT_FIELD: func.now()})
+            .returning(*self.__table.c.values())
+        )
+
+        async with self.__begin() as conn:
+            res = await conn.execute(update_stmt)
+            row = res.mappings().fetchone()
+
+        self.__record_write()
+
+        if isinstance(row, RowMapping):
+            values = await self.__to_models([row])
+            return values[0]
+
+    async def __read(self, query: Callable[..., Awaitable[R]], *args) -> R:
+        """Runs the read `query` on a replica if any is available, otherwise on the primary.
+
+        Only the public tables e.g. songs are read from replicas; apps and users are always read from the primary.
+        Within consistent reads, all reads of the database go to the replica, or primary, chosen by the first one.
+        If the replica fails, it is ejected for a while and the query is run on the primary.
+        """
+        conn = PgStore.__engines__[self._uri]
+        reads = get_current_consistent_reads()
+        reads_key = f"{self.__store_type__}/{self._uri}"
+        # a unit of work reads its own writes on its connection to the primary,
+        # and apps and users are never read stale e.g. just after a password change
+        if get_current_unit_of_work() is not None or not is_public_table(
+            self.__table_name
+        ):
+            replica = None
+        elif reads is not None:
+            replica = reads.choose(reads_key, conn.pick_replica)
+        else:
+            replica = conn.pick_replica()
+
+        if replica is None:
+            return await query(*args, db=conn)
+
+        try:
+            return await query(*args, db=replica)
+        except _replica_failure_errors as exp:
+            replica.eject(conn.config.replica_ejection_period)
+            _logger.warning(f"ejected replica of {self._uri}: {exp}")
+            if reads is not None:
+                # the primary is at least as new as the failed replica
+                reads.replace(reads_key, None)
+            return await query(*args, db=conn)
+
+    def __can_read_fast(self, db: _PgDatabase) -> bool:
+        """Whether this store's reads can go directly via asyncpg i.e. it is a language's songs store"""
+        return (
+            db.has_fast_reads
+            and self.__table_name == "songs"
+            and bool(self._lang)
+            and get_current_unit_of_work() is None
+        )
+
+    @asynccontextmanager
+    async def __begin(self) -> AsyncIterator[AsyncConnection]:
+        """Yields a connection to the primary, within a transaction.
+
+        Within a unit of work, the connection and transaction of the unit of work are shared,
+        and committed when the unit of work ends. Otherwise, the transaction is committed on exit.
+        """
+        uow = get_current_unit_of_work()
+        if uow is None:
+            async with self.__engine.begin() as conn:
+                yield conn
+        else:
+            async with self.__get_unit_of_work_connection(uow) as conn:
+                yield conn
+
+    @asynccontextmanager
+    async def __connect(self, db: _PgDatabase) -> AsyncIterator[AsyncConnection]:
+        """Yields a connection for reading from the given database, or the unit of work's connection if any"""
+        uow = get_current_unit_of_work()
+        if uow is None:
+            async with db.engine.connect() as conn:
+                yield conn
+        else:
+            async with self.__get_unit_of_work_connection(uow) as conn:
+                yield conn
+
+    @asynccontextmanager
+    async def __get_unit_of_work_connection(
+        self, uow: UnitOfWork
+    ) -> AsyncIterator[AsyncConnection]:
+        """Yields the connection to the primary of the given unit of work, one operation at a time"""
+        transaction = await uow.get_transaction(
+            f"{self.__store_type__}/{self._uri}", self.__begin_unit_of_work_transaction
+        )
+        async with transaction.lock:
+            yield transaction.conn
+
+    async def __begin_unit_of_work_transaction(self) -> "_PgTransaction":
+        """Begins the transaction on a new connection to the primary, for a unit of work"""
+        conn = await self.__engine.connect()
+        await conn.begin()
+        return _PgTransaction(conn)
+
+    def __record_write(self):
+        """Records a write so that this worker's reads go to the primary for a while"""
+        PgStore.__engines__[self._uri].record_write()
+
+    def __get_row_data(
+        self,
+        k: str,
+        v: T,
+        ttl: Optional[float] = None,
+        dictionary: Optional[CompressionDictionary] = None,
+    ) -> Dict[str, Any]:
+        """Converts the key `k`, value `v` and time-to-live `ttl` into a row of this store's table
+
+        The lines of songs are compressed if a compression `dictionary` is given.
+        """
+        table_name = self.__table.name
+        v_as_dict = conv_model_to_dict(table_name, v, compact_lines=self._compact_lines)
+        data = {**{field: k for field in self.__pk_fields}, **v_as_dict}
+        data = extract_data_for_table(table_name, data)
+        data[UPDATED_AT_FIELD] = func.now()
+        if COMPRESSED_LINES_FIELD in data:
+            data = compress_lines(data, dictionary)
+
+        if ttl is not None:
+            data[EXPIRES_AT_FIELD] = func.now() + timedelta(seconds=ttl)
+            self.__start_sweeper_if_not_running()
+
+        return data
+
+    async def __get_compression_dictionary(self) -> Optional[CompressionDictionary]:
+        """Gets the dictionary to compress the lines of songs with, or None if they are not to be compressed"""
+        if not self._compress_lines or not self._lang:
+            return None
+        return await self.__dictionaries.get_latest(self._lang)
+
+    async def __decompress(
+        self, rows: Iterable[Mapping[str, Any]]
+    ) -> List[Mapping[str, Any]]:
+        """Decompresses the lines of the rows that were compressed, loading their dictionaries"""
+        rows = [*rows]
+        dictionary_ids = get_dictionary_ids(rows)
+        if len(dictionary_ids) == 0:
+            return rows
+
+        await self.__dictionaries.load(dictionary_ids)
+        return [decompress_lines(row, self.__dictionaries) for row in rows]
+
+    async def __to_models(
+        self, rows: Iterable[Mapping[str, Any]], model: Optional[Type[P]] = None
+    ) -> List[Union[T, P]]:
+        """Converts the rows into the model, or this store's model if None, decompressing their lines"""
+        model = self._model if model is None else model
+        table_name = self.__table.name
+        return [
+            conv_dict_to_model(table_name, model=model, data=row)
+            for row in await self.__decompress(rows)
+        ]
+
+    async def train_compression_dictionary(
+        self, sample_size: int = 1_000
+    ) -> Optional[str]:
+        if not self._compress_lines or not self._lang:
+            return None
+
+        samples = await sample_lines(self, sample_size, compact=self._compact_lines)
+        dictionary = await self.__dictionaries.train(self._lang, samples)
+        return dictionary.id
+
+    def __get_columns(self, projection: Optional[Type[BaseModel]]) -> List[Column]:
+        """Gets the columns to select for the given projection model, or all columns if there is no projection"""
+        if projection is None:
+            return [*self.__table.c]
+        return [col for col in self.__table.c if col.name in projection.__fields__]
+
     def __get_filter_clauses(
         self, search_value: Any, is_ilike: bool = False
     ) -> List[bool]:
@@ -207,16 +1090,55 @@ class PgStore(Store[T]):
         if self._lang:
             clauses.append(self.__table.c.language == self._lang)
 
+        clauses.append(self.__get_unexpired_clause())
         return clauses
 
+    def __get_unexpired_clause(self):
+        """Constructs the filter clause that excludes expired records"""
+        expires_at_col = getattr(self.__table.c, EXPIRES_AT_FIELD)
+        return or_(expires_at_col.is_(None), expires_at_col > func.now())
+
+    def __start_sweeper_if_not_running(self):
+        """Starts the background task that deletes expired records if it is not running already"""
+        conn = PgStore.__engines__[self._uri]
+        sweeper = conn.sweeper
+        if (
+            sweeper is None
+            or sweeper.done()
+            or sweeper.get_loop() is not asyncio.get_running_loop()
+        ):
+            conn.sweeper = asyncio.create_task(
+                PgStore._sweep_expired_records(self._uri)
+            )
+
+    @staticmethod
+    async def _sweep_expired_records(uri: str):
+        """Periodically deletes the expired records in all initialized tables of the given uri, in batches"""
+        conn = PgStore.__engines__[uri]
+        interval = conn.config.ttl_sweep_interval
+        batch_size = conn.config.ttl_sweep_batch_size
+
+        while True:
+            await asyncio.sleep(interval)
+
+            for table in [*conn.tables.values()]:
+                if f"{uri}/{table.name}" not in PgStore.__initialized_tables__:
+                    continue
+
+                try:
+                    await _delete_expired_in_batches(conn.engine, table, batch_size)
+                except Exception as exp:
+                    _logger.warning(f"failed to sweep expired {table.name}: {exp}")
+
     @staticmethod
     async def _clean_up():
         uris = [*PgStore.__engines__.keys()]
         for uri in uris:
-            await PgStore.__engines__[uri].engine.dispose()
+            await PgStore.__engines__[uri].dispose()
             del PgStore.__engines__[uri]
 
         PgStore.__initialized_tables__.clear()
+        PgStore.__dictionaries__.clear()
 
     @staticmethod
     def _add_table_if_not_exists(table_name, uri):
@@ -225,7 +1147,8 @@ class PgStore(Store[T]):
             return
 
         columns = get_table_columns(table_name)
-        table = Table(table_name, PgStore.__engines__[uri].metadata, *columns)
+        kwargs = get_table_kwargs(table_name)
+        table = Table(table_name, PgStore.__engines__[uri].metadata, *columns, **kwargs)
         PgStore.__engines__[uri].tables[table_name] = table
 
     async def _create_table_if_not_created(self, force=False):
@@ -235,17 +1158,176 @@ class PgStore(Store[T]):
             force: if the creation should be done regardless
         """
         if not self.__is_table_created or force:
+            table_name = self.__table.name
+            is_partitioned = self.__partition_key is not None
+            unpartitioned_table_name = None
+
             async with self.__engine.begin() as conn:
+                if is_partitioned:
+                    await lock_partitions(conn, table_name)
+                    unpartitioned_table_name = (
+                        await rename_unpartitioned_table_if_exists(conn, table_name)
+                    )
+
                 await conn.run_sync(
                     self.__table.metadata.create_all, tables=[self.__table]
                 )
+                for migration in get_table_migrations(table_name):
+                    await conn.execute(text(f"ALTER TABLE {table_name} {migration}"))
+                for statement in get_table_index_statements(table_name):
+                    await conn.execute(text(statement))
+                # tables created before records could expire or be replicated lack these columns
+                for field in (EXPIRES_AT_FIELD, UPDATED_AT_FIELD):
+                    await conn.execute(
+                        text(
+                            f"ALTER TABLE {table_name} "
+                            f"ADD COLUMN IF NOT EXISTS {field} TIMESTAMP WITH TIME ZONE"
+                        )
+                    )
+                    await conn.execute(
+                        text(
+                            f"CREATE INDEX IF NOT EXISTS ix_{table_name}_{field} "
+                            f"ON {table_name} ({field})"
+                        )
+                    )
+
+                if is_partitioned:
+                    await create_default_partition_if_not_exists(conn, table_name)
+                    if unpartitioned_table_name is not None:
+                        await move_rows_from_unpartitioned_table(
+                            conn, self.__table, unpartitioned_table_name
+                        )
+                    if self._lang:
+                        await create_partition_if_not_exists(
+                            conn,
+                            self.__table,
+                            key=self.__partition_key,
+                            value=self._lang,
+                        )
 
             PgStore.__initialized_tables__[self.__full_tablename] = True
+            PgStore.__initialized_tables__[self.__initialization_key] = True
 
     @staticmethod
     def __register_engine_if_not_exists(uri: str, options: PgConfig):
-        """Registers the engine for the given uri if it has not yet been registered"""
-        if uri not in PgStore.__engines__:
-            conf = options.dict(exclude_none=True)
-            engine = create_async_engine(get_pg_async_uri(uri), **conf)
-            PgStore.__engines__[uri] = PgConnection(engine=engine, metadata=MetaData())
+        """Registers the engines for the given uri if they have not yet been registered.
+
+        If they have, the replica and fast reads settings of the given options, if any, are applied to them.
+        The engines themselves are created lazily on the event loops they are used on.
+        """
+        if uri in PgStore.__engines__:
+            PgStore.__engines__[uri].configure(uri, options)
+            return
+
+        conf = options.get_conn_config()
+        PgStore.__engines__[uri] = PgConnection(
+            engines=_get_loop_local_engines(uri, conf),
+            metadata=MetaData(),
+            config=options,
+            fast_pools=_get_loop_local_fast_pools(uri, options),
+            replicas=[
+                _create_replica(r_uri, options)
+                for r_uri in options.get_replica_uris(uri)
+            ],
+        )
+
+
+def _get_lines_as_jsonb(lines_col: Column) -> ColumnElement:
+    """Gets the lines of songs as jsonb; they are saved as JSON strings holding the JSON of the lines"""
+    return cast(lines_col.op("#>>")(literal_column("'{}'")), JSONB)
+
+
+def _get_patched_lines(
+    lines: ColumnElement, operations: List[LineOperation]
+) -> ColumnElement:
+    """Gets the jsonb expression of the lines after the operations, applied in order"""
+    for operation in operations:
+        path = array([f"{operation.index}"])
+        if operation.op == LineOperationType.DELETE:
+            lines = lines.op("-")(literal(operation.index, Integer))
+            continue
+
+        line = [section.dict() for section in operation.line]
+        new_line = cast(literal(json.dumps(line)), JSONB)
+        if operation.op == LineOperationType.REPLACE:
+            lines = func.jsonb_set(lines, path, new_line)
+        else:
+            lines = func.jsonb_insert(lines, path, new_line)
+    return lines
+
+
+def _create_replica(uri: str, options: PgConfig) -> PgReplica:
+    """Creates the read replica at the given uri, its engines being created lazily per event loop"""
+    return PgReplica(
+        uri=uri,
+        engines=_get_loop_local_engines(uri, options.get_conn_config()),
+        fast_pools=_get_loop_local_fast_pools(uri, options),
+    )
+
+
+def _get_loop_local_engines(uri: str, conf: Dict[str, Any]) -> LoopLocal[AsyncEngine]:
+    """Gets the lazily created engines, one for each event loop, of the database at the given uri"""
+    return LoopLocal(
+        factory=lambda: create_async_engine(get_pg_async_uri(uri), **conf),
+        # connections of a closed event loop cannot be closed, only dereferenced
+        discard=lambda engine: engine.sync_engine.dispose(close=False),
+    )
+
+
+def _get_loop_local_fast_pools(
+    uri: str, options: PgConfig
+) -> Optional[LoopLocal[FastReadPool]]:
+    """Gets the lazily created fast read pools, one for each event loop, or None if fast reads are disabled"""
+    if not options.fast_reads:
+        return None
+
+    return LoopLocal(
+        factory=lambda: FastReadPool(
+            uri,
+            size=options.fast_reads_pool_size,
+            statement_cache_size=options.fast_reads_statement_cache_size,
+        ),
+        # connections of a closed event loop cannot be closed, only dereferenced
+        discard=lambda pool: None,
+    )
+
+
+async def _close_fast_pools(pools: LoopLocal[FastReadPool]):
+    """Closes the fast read pools of the running event loop, dereferencing those of other loops"""
+    running_loop = asyncio.get_running_loop()
+    for loop, pool in pools.pop_all():
+        if loop is running_loop:
+            await pool.close()
+
+
+async def _dispose_engines(engines: LoopLocal[AsyncEngine]):
+    """Disposes the engines of all event loops, closing the connections of the running loop"""
+    running_loop = asyncio.get_running_loop()
+    for loop, engine in engines.pop_all():
+        if loop is running_loop:
+            await engine.dispose()
+        else:
+            engine.sync_engine.dispose(close=False)
+
+
+async def _delete_expired_in_batches(
+    engine: AsyncEngine, table: Table, batch_size: int
+):
+    """Deletes the expired records in the given table, not more than `batch_size` records per statement"""
+    expires_at_col = getattr(table.c, EXPIRES_AT_FIELD)
+    # ctid is unique only within a partition, so it is paired with the partition's tableoid
+    row_id = tuple_(literal_column("tableoid"), literal_column("ctid"))
+    expired_rows = (
+        select(literal_column("tableoid"), literal_column("ctid"))
+        .select_from(table)
+        .filter(expires_at_col <= func.now())
+        .limit(batch_size)
+    )
+    delete_stmt = delete(table).filter(row_id.in_(expired_rows))
+
+    while True:
+        async with engine.begin() as conn:
+            res = await conn.execute(delete_stmt)
+
+        if res.rowcount < batch_size:
+            return
@@ -0,0 +1,556 @@
+"""Storage in an embedded sqlite database e.g. the local replica of the songs on edge nodes"""
+import asyncio
+import dataclasses
+from datetime import datetime, timedelta
+from typing import (
+    TypeVar,
+    Type,
+    Optional,
+    List,
+    Dict,
+    Any,
+    Union,
+    Tuple,
+    AsyncIterator,
+    Callable,
+)
+
+from pydantic import BaseModel
+from sqlalchemy import (
+    Column,
+    MetaData,
+    Table,
+    create_engine,
+    delete,
+    event,
+    func,
+    inspect,
+    literal,
+    or_,
+    select,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection, Engine, RowMapping
+
+from services.hymns.models import LineOperation
+from services.store.base import Store, StoreConfig
+from services.store.utils.collections import (
+    get_store_language_and_search_field,
+    get_table_name,
+    get_pk_fields,
+)
+from services.store.utils.limits import limited
+from services.store.utils.lines import rewrite_lines
+from services.store.utils.sqlachemy import (
+    get_table_columns,
+    conv_model_to_dict,
+    conv_fields_to_dict,
+    conv_dict_to_model,
+    extract_data_for_table,
+    get_table_index_statements,
+    get_number_value,
+    EXPIRES_AT_FIELD,
+    UPDATED_AT_FIELD,
+)
+from services.utils import Config
+
+T = TypeVar("T", bound=BaseModel)
+P = TypeVar("P", bound=BaseModel)
+R = TypeVar("R")
+
+
+class SqliteConfig(StoreConfig):
+    # the number of seconds to wait for the lock of the database file held by another process e.g. worker
+    busy_timeout: float = 5
+
+
+@dataclasses.dataclass
+class SqliteConnection:
+    """A sqlalchemy engine of an embedded sqlite database with its meta data"""
+
+    engine: Engine
+    metadata: MetaData
+    tables: Dict[str, Table] = dataclasses.field(default_factory=dict)
+
+    def get_table(self, table_name: str) -> Table:
+        """Gets the table of the given name, creating it if it does not exist yet"""
+        if table_name not in self.tables:
+            table = Table(table_name, self.metadata, *get_table_columns(table_name))
+            self.metadata.create_all(self.engine, tables=[table])
+            _add_missing_columns(self.engine, table)
+            with self.engine.begin() as conn:
+                for statement in get_table_index_statements(table_name):
+                    conn.execute(text(statement))
+            self.tables[table_name] = table
+
+        return self.tables[table_name]
+
+
+class SqliteStore(Store[T]):
+    """Storage class implemented using an embedded sqlite database
+
+    The sqlite driver is blocking, so the operations run in threads, lest they block the event loop
+    e.g. while waiting for the lock of the database file held by another worker. Expired records are
+    filtered out of reads and deleted lazily when they are got, as there is no background sweeper.
+    """
+
+    __store_type__: str = "sqlite"
+    __store_config_cls__: Type[Config] = SqliteConfig
+    __engines__: Dict[str, SqliteConnection] = {}
+
+    def __init__(self, uri: str, name: str, model: Type[T], options: SqliteConfig):
+        super().__init__(uri, name, model, options)
+
+        self._uri = uri
+        self.__table_name = get_table_name(name)
+        self.__pk_fields = get_pk_fields(self.__table_name)
+        self._lang, self._search_field = get_store_language_and_search_field(name)
+
+        conn = SqliteStore.__register_engine_if_not_exists(uri, options)
+        self.__table = conn.get_table(self.__table_name)
+
+    @property
+    def __engine(self) -> Engine:
+        """The engine associated with this store"""
+        return SqliteStore.__engines__[self._uri].engine
+
+    @limited
+    async def set(self, k: str, v: T, ttl: Optional[float] = None, **kwargs) -> None:
+        """Set the value `v` to be associated with key `k` in the database"""
+        data = self.__get_row_data(k, v, ttl)
+        insert_stmt = (
+            sqlite_insert(self.__table)
+            .values(**data)
+            .on_conflict_do_update(index_elements=self.__pk_fields, set_=data)
+        )
+
+        await self.__run(lambda conn: conn.execute(insert_stmt), is_write=True)
+
+    @limited
+    async def set_many(self, items: List[Tuple[str, T]]) -> None:
+        """Sets the given key-value pairs with one multi-row upsert"""
+        if len(items) == 0:
+            return
+
+        rows = [self.__get_row_data(k, v) for k, v in items]
+        insert_stmt = sqlite_insert(self.__table).values(rows)
+        insert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=self.__pk_fields,
+            set_={
+                col.name: insert_stmt.excluded[col.name]
+                for col in self.__table.c
+                if col.name not in self.__pk_fields
+            },
+        )
+
+        await self.__run(lambda conn: conn.execute(insert_stmt), is_write=True)
+
+    @limited
+    async def insert_if_absent(self, k: str, v: T, ttl: Optional[float] = None) -> bool:
+        """Inserts the value `v` for the key `k` only if `k` does not exist yet or has expired"""
+        data = self.__get_row_data(k, v, ttl)
+        expires_at_col = getattr(self.__table.c, EXPIRES_AT_FIELD)
+        insert_stmt = (
+            sqlite_insert(self.__table)
+            .values(**data)
+            .on_conflict_do_update(
+                index_elements=self.__pk_fields,
+                set_=data,
+                where=expires_at_col <= datetime.utcnow(),
+            )
+        )
+
+        res = await self.__run(lambda conn: conn.execute(insert_stmt), is_write=True)
+        return res.rowcount > 0
+
+    @limited
+    async def update_fields(self, k: str, fields: Dict[str, Any]) -> Optional[T]:
+        """Updates the given fields of the value associated with the key `k`"""
+        data = conv_fields_to_dict(
+            self.__table.name, fields, compact_lines=self._compact_lines
+        )
+        if len(data) == 0:
+            return await self.get(k)
+
+        return await self.__update(k, data)
+
+    async def patch_lines(
+        self,
+        k: str,
+        operations: List[LineOperation],
+        fields: Optional[Dict[str, Any]] = None,
+    ) -> Optional[T]:
+        """Rewrites the lines of the song of key `k`, as reads and writes of the local file are cheap"""
+        return await rewrite_lines(self, k, operations, fields)
+
+    @limited
+    async def increment(self, k: str, field: str, by: int = 1) -> Optional[T]:
+        """Increments the integer `field` of the value associated with the key `k`"""
+        col = getattr(self.__table.c, field)
+        return await self.__update(k, {field: col + by})
+
+    @limited
+    async def get(
+        self, k: str, projection: Optional[Type[P]] = None
+    ) -> Union[T, P, None]:
+        """Get the value associated with the key `k`, deleting it instead if it has expired"""
+        model = self._model if projection is None else projection
+        columns = self.__get_columns(projection)
+        expires_at_col = getattr(self.__table.c, EXPIRES_AT_FIELD)
+        if expires_at_col not in columns:
+            columns.append(expires_at_col)
+        clauses = self.__get_filter_clauses(k, is_unexpired=False)
+        select_stmt = select(*columns).filter(*clauses)
+
+        data = await self.__run(
+            lambda conn: conn.execute(select_stmt).mappings().fetchone()
+        )
+
+        if not isinstance(data, RowMapping):
+            return None
+
+        expires_at = data[EXPIRES_AT_FIELD]
+        if expires_at is not None and expires_at <= datetime.utcnow():
+            delete_stmt = delete(self.__table).filter(*self.__get_expired_clauses(k))
+            await self.__run(lambda conn: conn.execute(delete_stmt), is_write=True)
+            return None
+
+        return conv_dict_to_model(self.__table.name, model=model, data=data)
+
+    @limited
+    async def search(
+        self,
+        term: str,
+        skip: int = 0,
+        limit: int = 0,
+        projection: Optional[Type[P]] = None,
+    ) -> Union[List[T], List[P]]:
+        """Searches for the values of keys which satisfy the given search `term`, given the skip and the limit"""
+        model = self._model if projection is None else projection
+        columns = self.__get_columns(projection)
+        clauses = self.__get_filter_clauses(term, is_ilike=True)
+        select_stmt = select(*columns).filter(*clauses).offset(skip)
+        if limit > 0:
+            select_stmt = select_stmt.limit(limit)
+
+        rows = await self.__run(lambda conn: conn.execute(select_stmt).mappings().all())
+
+        return [
+            conv_dict_to_model(self.__table.name, model=model, data=row) for row in rows
+        ]
+
+    @limited
+    async def exists(self, k: str) -> bool:
+        """Checks whether the key `k` exists, without fetching its value"""
+        clauses = self.__get_filter_clauses(k)
+        select_stmt = select(literal(1)).select_from(self.__table).filter(*clauses)
+
+        value = await self.__run(
+            lambda conn: conn.execute(select_stmt.limit(1)).scalar()
+        )
+        return value is not None
+
+    @limited
+    async def count(self, term: str = "", limit: int = 0) -> int:
+        """Counts the keys which satisfy the given search `term`, not counting beyond `limit` if `limit` > 0"""
+        clauses = self.__get_filter_clauses(term, is_ilike=True)
+        matches = select(literal(1)).select_from(self.__table).filter(*clauses)
+        if limit > 0:
+            matches = matches.limit(limit)
+
+        count_stmt = select(func.count()).select_from(matches.subquery())
+
+        return await self.__run(lambda conn: conn.execute(count_stmt).scalar())
+
+    @limited
+    async def delete(self, k: str) -> List[T]:
+        """Deletes the key-value whose key is `k`"""
+        clauses = self.__get_filter_clauses(k)
+        return await self.__delete_matching(clauses)
+
+    @limited
+    async def delete_many(
+        self, fields: Dict[str, Any], languages: Optional[List[str]] = None
+    ) -> List[T]:
+        """Deletes, with one DELETE ... RETURNING, the values any of whose fields equals the given value"""
+        data = conv_fields_to_dict(
+            self.__table.name, fields, compact_lines=self._compact_lines
+        )
+        if len(data) == 0:
+            return []
+
+        clauses = [or_(*[getattr(self.__table.c, f) == v for f, v in data.items()])]
+        if self._lang:
+            langs = [self._lang] if languages is None else languages
+            clauses.append(self.__table.c.language.in_(langs))
+        clauses.append(self.__get_unexpired_clause())
+
+        return await self.__delete_matching(clauses)
+
+    @limited
+    async def changed_since(
+        self, since: Optional[datetime] = None
+    ) -> Tuple[List[T], Optional[datetime]]:
+        updated_at_col = getattr(self.__table.c, UPDATED_AT_FIELD)
+        clauses = [self.__get_unexpired_clause()]
+        if self._lang:
+            clauses.append(self.__table.c.language == self._lang)
+        if since is not None:
+            clauses.append(updated_at_col > since)
+
+        select_stmt = (
+            select(self.__table)
+            .filter(*clauses)
+            .order_by(updated_at_col.asc().nulls_first())
+        )
+
+        rows = await self.__run(lambda conn: conn.execute(select_stmt).mappings().all())
+
+        values = [
+            conv_dict_to_model(self.__table.name, model=self._model, data=row)
+            for row in rows
+        ]
+        latest = max(
+            (row[UPDATED_AT_FIELD] for row in rows if row[UPDATED_AT_FIELD]),
+            default=since,
+        )
+        return values, latest
+
+    async def scan(
+        self, batch_size: int = 500, after: Optional[List[str]] = None
+    ) -> AsyncIterator[Tuple[List[T], List[str]]]:
+        pk_cols = [getattr(self.__table.c, field) for field in self.__pk_fields]
+
+        while True:
+            clauses = [self.__get_unexpired_clause()]
+            if self._lang:
+                clauses.append(self.__table.c.language == self._lang)
+            if after is not None:
+                clauses.append(tuple_(*pk_cols) > tuple_(*after))
+
+            select_stmt = (
+                select(self.__table)
+                .filter(*clauses)
+                .order_by(*pk_cols)
+                .limit(batch_size)
+            )
+            rows = await self.__run(
+                lambda conn: conn.execute(select_stmt).mappings().all()
+            )
+
+            if len(rows) == 0:
+                return
+
+            after = [rows[-1][field] for field in self.__pk_fields]
+            yield [
+                conv_dict_to_model(self.__table.name, model=self._model, data=row)
+                for row in rows
+            ], after
+
+            if len(rows) < batch_size:
+                return
+
+    async def scan_range(
+        self,
+        start: int,
+        end: int,
+        batch_size: int = 500,
+        projection: Optional[Type[P]] = None,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> AsyncIterator[Union[List[T], List[P]]]:
+        model = self._model if projection is None else projection
+        number_value = get_number_value(self.__table)
+        title_col = self.__table.c.title
+        columns = self.__get_columns(projection)
+        columns += [c for c in (self.__table.c.number, title_col) if c not in columns]
+
+        while True:
+            clauses = [
+                self.__table.c.language == self._lang,
+                number_value.between(start, end),
+                self.__get_unexpired_clause(),
+            ]
+            if after is not None:
+                clauses.append(tuple_(number_value, title_col) > tuple_(*after))
+
+            select_stmt = (
+                select(*columns)
+                .filter(*clauses)
+                .order_by(number_value, title_col)
+                .limit(batch_size)
+            )
+            rows = await self.__run(
+                lambda conn: conn.execute(select_stmt).mappings().all()
+            )
+
+            if len(rows) == 0:
+                return
+
+            after = (int(rows[-1]["number"]), rows[-1]["title"])
+            yield [
+                conv_dict_to_model(self.__table.name, model=model, data=row)
+                for row in rows
+            ]
+
+            if len(rows) < batch_size:
+                return
+
+    def is_colocated_with(self, other: Store) -> bool:
+        return (
+            isinstance(other, SqliteStore)
+            and other._uri == self._uri
+            and other.__table_name == self.__table_name
+        )
+
+    async def clear(self) -> None:
+        """Clears all the data in this collection"""
+
+        def recreate_table(conn: Connection):
+            self.__table.metadata.drop_all(conn, [self.__table])
+            self.__table.metadata.create_all(conn, [self.__table])
+
+        await self.__run(recreate_table, is_write=True)
+
+    @staticmethod
+    async def _clean_up():
+        uris = [*SqliteStore.__engines__.keys()]
+        for uri in uris:
+            SqliteStore.__engines__[uri].engine.dispose()
+            del SqliteStore.__engines__[uri]
+
+    async def __run(
+        self, operation: Callable[[Connection], R], is_write: bool = False
+    ) -> R:
+        """Runs the operation on a connection of this store's database in a thread, within a transaction if `is_write`"""
+
+        def run() -> R:
+            connect = self.__engine.begin if is_write else self.__engine.connect
+            with connect() as conn:
+                return operation(conn)
+
+        return await asyncio.to_thread(run)
+
+    async def __update(self, k: str, data: Dict[str, Any]) -> Optional[T]:
+        """Updates the row(s) of key `k` with the given data, returning the first updated value"""
+        clauses = self.__get_filter_clauses(k)
+        update_stmt = (
+            update(self.__table)
+            .filter(*clauses)
+            .values(**data, **{UPDATED_AT_FIELD: datetime.utcnow()})
+            .returning(*self.__table.c.values())
+        )
+
+        row = await self.__run(
+            lambda conn: conn.execute(update_stmt).mappings().fetchone(),
+            is_write=True,
+        )
+
+        if isinstance(row, RowMapping):
+            return conv_dict_to_model(self.__table.name, model=self._model, data=row)
+
+    async def __delete_matching(self, clauses: List[Any]) -> List[T]:
+        """Deletes the rows matching the clauses, returning their values"""
+        delete_stmt = (
+            delete(self.__table).filter(*clauses).returning(*self.__table.c.values())
+        )
+
+        rows = await self.__run(
+            lambda conn: conn.execute(delete_stmt).mappings().fetchall(),
+            is_write=True,
+        )
+
+        return [
+            conv_dict_to_model(self.__table.name, model=self._model, data=row)
+            for row in rows
+        ]
+
+    def __get_row_data(
+        self, k: str, v: T, ttl: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Converts the key `k`, value `v` and time-to-live `ttl` into a row of this store's table"""
+        table_name = self.__table.name
+        v_as_dict = conv_model_to_dict(table_name, v, compact_lines=self._compact_lines)
+        data = {**{field: k for field in self.__pk_fields}, **v_as_dict}
+        data = extract_data_for_table(table_name, data)
+        data[UPDATED_AT_FIELD] = datetime.utcnow()
+
+        if ttl is not None:
+            data[EXPIRES_AT_FIELD] = datetime.utcnow() + timedelta(seconds=ttl)
+
+        return data
+
+    def __get_columns(self, projection: Optional[Type[BaseModel]]) -> List[Column]:
+        """Gets the columns to select for the given projection model, or all columns if there is no projection"""
+        if projection is None:
+            return [*self.__table.c]
+        return [col for col in self.__table.c if col.name in projection.__fields__]
+
+    def __get_filter_clauses(
+        self, search_value: Any, is_ilike: bool = False, is_unexpired: bool = True
+    ) -> List[Any]:
+        """Constructs the filter clauses for searching, getting or deleting"""
+        search_col = getattr(self.__table.c, self._search_field)
+
+        if is_ilike:
+            clauses = [search_col.istartswith(search_value)]
+        else:
+            clauses = [search_col == search_value]
+
+        if self._lang:
+            clauses.append(self.__table.c.language == self._lang)
+
+        if is_unexpired:
+            clauses.append(self.__get_unexpired_clause())
+        return clauses
+
+    def __get_expired_clauses(self, k: str) -> List[Any]:
+        """Constructs the filter clauses for the expired rows of the key `k`"""
+        expires_at_col = getattr(self.__table.c, EXPIRES_AT_FIELD)
+        return [
+            *self.__get_filter_clauses(k, is_unexpired=False),
+            expires_at_col <= datetime.utcnow(),
+        ]
+
+    def __get_unexpired_clause(self):
+        """Constructs the filter clause that excludes expired records"""
+        expires_at_col = getattr(self.__table.c, EXPIRES_AT_FIELD)
+        return or_(expires_at_col.is_(None), expires_at_col > datetime.utcnow())
+
+    @staticmethod
+    def __register_engine_if_not_exists(
+        uri: str, options: SqliteConfig
+    ) -> SqliteConnection:
+        """Registers the engine for the given uri if it has not yet been registered"""
+        if uri not in SqliteStore.__engines__:
+            engine = create_engine(uri, connect_args={"timeout": options.busy_timeout})
+            event.listen(engine, "connect", _set_sqlite_pragmas)
+            SqliteStore.__engines__[uri] = SqliteConnection(
+                engine=engine, metadata=MetaData()
+            )
+
+        return SqliteStore.__engines__[uri]
+
+
+def _add_missing_columns(engine: Engine, table: Table):
+    """Adds the columns of the table that are missing from the database file e.g. if created by an older version"""
+    existing = {col["name"] for col in inspect(engine).get_columns(table.name)}
+    missing = [col for col in table.c if col.name not in existing]
+    if len(missing) == 0:
+        return
+
+    with engine.begin() as conn:
+        for col in missing:
+            col_type = col.type.compile(dialect=engine.dialect)
+            conn.execute(
+                text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}")
+            )
+
+
+def _set_sqlite_pragmas(dbapi_connection, _connection_record):
+    """Lets readers e.g. of other workers read the database file while it is being written to"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
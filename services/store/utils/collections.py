@@ -7,11 +7,15 @@ collection_search_field_map = {
     "config": "key",
     "hymns_auth": "key",
     "hymns_users": "username",
+    "compression_dictionaries": "id",
+    "language_versions": "language",
 }
 _collection_table_name_map = {
     "config": "configs",
     "hymns_auth": "apps",
     "hymns_users": "users",
+    "compression_dictionaries": "dictionaries",
+    "language_versions": "language_versions",
 }
 _table_dependency_map: Dict[str, List[str]] = {}
 _table_pk_field_map: Dict[str, List[str]] = {
@@ -19,7 +23,11 @@ _table_pk_field_map: Dict[str, List[str]] = {
     "apps": ["key"],
     "users": ["username"],
     "songs": ["number", "title", "language"],
+    "dictionaries": ["id"],
+    "language_versions": ["language"],
 }
+# the tables that are read publicly and can thus tolerate slightly stale reads
+_public_tables = {"songs", "language_versions"}
 
 
 def get_store_language_and_search_field(store_name: str) -> Tuple[Optional[str], str]:
@@ -51,3 +59,11 @@ def get_table_name(collection_name: str) -> str:
 def get_pk_fields(table_name: str) -> List[str]:
     """Gets the primary key fields for a given table_name"""
     return _table_pk_field_map.get(table_name, [])
+
+
+def is_public_table(table_name: str) -> bool:
+    """Checks whether the given table is read publicly e.g. songs, as opposed to auth and admin data
+
+    Reads of public tables may be served by replicas that lag behind the primary.
+    """
+    return table_name in _public_tables
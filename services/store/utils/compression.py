@@ -0,0 +1,249 @@
+"""Utilities for compressing the lines of songs with dictionaries trained on the songs of each language
+
+The payloads are deflated with a preset dictionary made of the fragments that recur most across
+the songs of the language, e.g. choruses, common phrases and the JSON of the notes, so that even
+short songs compress well.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import time
+import zlib
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Any, Tuple, Mapping
+
+from pydantic import BaseModel
+
+from services.hymns.models import CompactLines
+
+COMPRESSED_LINES_FIELD = "compressed_lines"
+DICTIONARY_ID_FIELD = "dictionary_id"
+# deflate can only refer back to the last 32KB, so a longer dictionary is of no use
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+# the JSON strings, and the runs of text between them
+_token_regex = re.compile(rb'"(?:[^"\\]|\\.)*"|[^"]+')
+_max_fragment_tokens = 4
+
+
+class CompressionDictionary(BaseModel):
+    """A preset dictionary for compressing the lines of the songs of one language"""
+
+    id: str
+    language: str
+    data: bytes
+    created_at: datetime
+
+
+def conv_lines_to_json(lines: List[List[Any]], compact: bool) -> str:
+    """Converts the lines of a song, whose sections are LineSection's or their dicts, into JSON
+
+    If `compact`, the lines are in the compact columnar encoding, which Song decodes transparently.
+    """
+    if compact:
+        return CompactLines.from_lines(lines).json()
+
+    lines_of_dicts = [
+        [
+            section.dict() if isinstance(section, BaseModel) else section
+            for section in line
+        ]
+        for line in lines
+    ]
+    return json.dumps(lines_of_dicts)
+
+
+def train_dictionary(
+    samples: Iterable[bytes], size: int = MAX_DICTIONARY_SIZE
+) -> bytes:
+    """Builds a preset dictionary out of the fragments found in most samples
+
+    The fragments are runs of up to a few consecutive JSON tokens, scored by the number of bytes
+    they would save across the samples. The best ones are put at the end of the dictionary,
+    where deflate refers to them with the shortest distances.
+
+    Args:
+        samples: the payloads e.g. the JSON of the lines of the songs of a language
+        size: the maximum size of the dictionary in bytes
+
+    Returns:
+        the dictionary
+    """
+    counts: Counter = Counter()
+    for sample in samples:
+        tokens = _token_regex.findall(sample)
+        fragments = {
+            b"".join(tokens[i : i + n])
+            for n in range(1, _max_fragment_tokens + 1)
+            for i in range(len(tokens) - n + 1)
+        }
+        # fragments are counted once per sample as repeats within one sample compress anyway
+        counts.update(fragments)
+
+    scored = sorted(
+        (
+            ((count - 1) * len(fragment), fragment)
+            for fragment, count in counts.items()
+            if count > 1 and len(fragment) > 3
+        ),
+        reverse=True,
+    )
+
+    chosen: List[bytes] = []
+    total = 0
+    for _, fragment in scored:
+        if total + len(fragment) > size:
+            continue
+        if any(fragment in other for other in chosen):
+            continue
+        chosen.append(fragment)
+        total += len(fragment)
+
+    return b"".join(reversed(chosen))
+
+
+def get_dictionary_id(language: str, dictionary: bytes) -> str:
+    """Gets the id of the dictionary, prefixed by its language so that its dictionaries can be searched"""
+    return f"{language}:{hashlib.sha256(dictionary).hexdigest()[:16]}"
+
+
+def compress(text: str, dictionary: bytes) -> bytes:
+    """Deflates the text with the given preset dictionary"""
+    compressor = zlib.compressobj(level=9, wbits=-zlib.MAX_WBITS, zdict=dictionary)
+    return compressor.compress(text.encode()) + compressor.flush()
+
+
+def decompress(data: bytes, dictionary: bytes) -> str:
+    """Inflates the data deflated with the given preset dictionary"""
+    decompressor = zlib.decompressobj(wbits=-zlib.MAX_WBITS, zdict=dictionary)
+    return (decompressor.decompress(data) + decompressor.flush()).decode()
+
+
+class CompressionDictionaries:
+    """The compression dictionaries of one database, cached as they are never changed once saved
+
+    The latest dictionary of each language, used for compressing, is re-read every `refresh_interval`
+    seconds so that dictionaries trained by other processes are picked up.
+    """
+
+    def __init__(self, store: Any, refresh_interval: float = 60):
+        """
+        Args:
+            store: the Store of the CompressionDictionary's of the database
+            refresh_interval: the seconds after which the latest dictionary of a language is re-read
+        """
+        self.__store = store
+        self.__refresh_interval = refresh_interval
+        self.__dictionaries: Dict[str, bytes] = {}
+        self.__latest: Dict[str, Tuple[float, Optional[CompressionDictionary]]] = {}
+
+    async def get_latest(self, language: str) -> Optional[CompressionDictionary]:
+        """Gets the latest dictionary of the language, or None if none has been trained yet"""
+        read_at, latest = self.__latest.get(language, (None, None))
+        now = time.monotonic()
+        if read_at is None or now - read_at > self.__refresh_interval:
+            dictionaries = await self.__store.search(f"{language}:")
+            latest = max(dictionaries, key=lambda v: v.created_at, default=None)
+            self.__latest[language] = (now, latest)
+
+        if latest is not None:
+            self.__dictionaries[latest.id] = latest.data
+        return latest
+
+    async def load(self, ids: Iterable[str]):
+        """Loads the dictionaries of the given ids that are not cached yet
+
+        Raises:
+            KeyError: some dictionary does not exist
+        """
+        missing = [v for v in {*ids} if v not in self.__dictionaries]
+        values = await asyncio.gather(*(self.__store.get(v) for v in missing))
+        for dictionary_id, value in zip(missing, values):
+            if value is None:
+                raise KeyError(f"compression dictionary {dictionary_id} not found")
+            self.__dictionaries[dictionary_id] = value.data
+
+    def get(self, dictionary_id: str) -> bytes:
+        """Gets the loaded dictionary of the given id"""
+        return self.__dictionaries[dictionary_id]
+
+    async def train(self, language: str, samples: List[bytes]) -> CompressionDictionary:
+        """Trains a new dictionary on the samples, saving it as the latest dictionary of the language"""
+        data = train_dictionary(samples)
+        dictionary = CompressionDictionary(
+            id=get_dictionary_id(language, data),
+            language=language,
+            data=data,
+            created_at=datetime.utcnow(),
+        )
+        await self.__store.set(dictionary.id, dictionary)
+        self.__dictionaries[dictionary.id] = data
+        self.__latest[language] = (time.monotonic(), dictionary)
+        return dictionary
+
+
+async def sample_lines(store: Any, sample_size: int, compact: bool) -> List[bytes]:
+    """Gets the JSON lines of up to `sample_size` songs of the given store, for training a dictionary"""
+    samples = []
+    async for batch, _ in store.scan(batch_size=min(sample_size, 500)):
+        for song in batch[: sample_size - len(samples)]:
+            samples.append(conv_lines_to_json(song.lines, compact=compact).encode())
+        if len(samples) >= sample_size:
+            break
+    return samples
+
+
+def compress_lines(
+    data: Dict[str, Any], dictionary: Optional[CompressionDictionary]
+) -> Dict[str, Any]:
+    """Moves the JSON lines of the song data into its compressed lines if there is a dictionary
+
+    Args:
+        data: the song data, whose lines are JSON text
+        dictionary: the dictionary to compress with, or None to leave the lines uncompressed
+
+    Returns:
+        the song data with its lines, or its compressed lines and dictionary id
+    """
+    if dictionary is None or data.get("lines", None) is None:
+        return {**data, COMPRESSED_LINES_FIELD: None, DICTIONARY_ID_FIELD: None}
+
+    return {
+        **data,
+        "lines": None,
+        COMPRESSED_LINES_FIELD: compress(data["lines"], dictionary.data),
+        DICTIONARY_ID_FIELD: dictionary.id,
+    }
+
+
+def get_dictionary_ids(rows: Iterable[Mapping[str, Any]]) -> List[str]:
+    """Gets the ids of the dictionaries the lines of the given songs were compressed with"""
+    ids = {row.get(DICTIONARY_ID_FIELD, None) for row in rows}
+    ids.discard(None)
+    return [*ids]
+
+
+def decompress_lines(
+    row: Mapping[str, Any], dictionaries: CompressionDictionaries
+) -> Mapping[str, Any]:
+    """Restores the lines of the song data if they were compressed
+
+    Args:
+        row: the song data, with compressed lines or not
+        dictionaries: the dictionaries, with the dictionary of the row loaded if any
+
+    Returns:
+        the song data with its lines decoded from JSON if they were compressed
+    """
+    dictionary_id = row.get(DICTIONARY_ID_FIELD, None)
+    if dictionary_id is None:
+        return row
+
+    data = {**row}
+    compressed_lines = data.pop(COMPRESSED_LINES_FIELD)
+    del data[DICTIONARY_ID_FIELD]
+    text = decompress(compressed_lines, dictionaries.get(dictionary_id))
+    data["lines"] = json.loads(text)
+    return data
@@ -0,0 +1,106 @@
+"""Utilities for consistent reads i.e. reads, within e.g. one request, that never see older data than earlier ones"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, Callable, Awaitable, Optional, AsyncIterator, Protocol, Any
+
+_logger = logging.getLogger(__name__)
+
+
+class ReadSession(Protocol):
+    """A session e.g. a causally consistent mongodb session, shared by the reads of a context"""
+
+    async def close(self):
+        """Ends the session"""
+
+
+class ConsistentReads:
+    """The database, e.g. replica, or the session chosen by the first read of each database within e.g. one request
+
+    The later reads of the same database reuse it, so that they see the database as it was at the first read or later.
+    Without it, e.g. the version of the songs could be read from an up-to-date replica and the songs
+    from a lagging one.
+    """
+
+    def __init__(self):
+        self.__choices: Dict[str, Any] = {}
+        self.__sessions: Dict[str, ReadSession] = {}
+        self.__lock = asyncio.Lock()
+
+    def choose(self, key: str, choose: Callable[[], Any]) -> Any:
+        """Gets the database chosen for the given key, choosing it if none has been chosen yet
+
+        Args:
+            key: the key identifying the database e.g. its store type and uri
+            choose: the function that chooses e.g. the replica to read from
+
+        Returns:
+            the choice shared by all reads of that database in this context
+        """
+        if key not in self.__choices:
+            self.__choices[key] = choose()
+        return self.__choices[key]
+
+    def replace(self, key: str, choice: Any):
+        """Replaces the choice of the given key e.g. by the primary when the chosen replica fails"""
+        self.__choices[key] = choice
+
+    async def get_session(
+        self, key: str, start: Callable[[], Awaitable[ReadSession]]
+    ) -> ReadSession:
+        """Gets the session of the given key, starting it if it has not been started yet
+
+        Args:
+            key: the key identifying the database e.g. its store type and uri
+            start: the function that starts the session
+
+        Returns:
+            the session shared by all reads of that database in this context
+        """
+        async with self.__lock:
+            if key not in self.__sessions:
+                self.__sessions[key] = await start()
+            return self.__sessions[key]
+
+    async def close(self):
+        """Ends all the sessions"""
+        sessions = [*self.__sessions.values()]
+        self.__sessions.clear()
+        self.__choices.clear()
+
+        for session in sessions:
+            try:
+                await session.close()
+            except Exception as exp:
+                _logger.warning(f"failed to end consistent reads session: {exp}")
+
+
+_current_consistent_reads: ContextVar[Optional[ConsistentReads]] = ContextVar(
+    "current_consistent_reads", default=None
+)
+
+
+def get_current_consistent_reads() -> Optional[ConsistentReads]:
+    """Gets the consistent reads of the current context, or None if there are none"""
+    return _current_consistent_reads.get()
+
+
+@asynccontextmanager
+async def consistent_reads() -> AsyncIterator[ConsistentReads]:
+    """Runs the reads within the context on one replica, or in one causally consistent session, per database
+
+    Consistent reads within other consistent reads join the outer ones.
+    """
+    current = _current_consistent_reads.get()
+    if current is not None:
+        yield current
+        return
+
+    reads = ConsistentReads()
+    token = _current_consistent_reads.set(reads)
+    try:
+        yield reads
+    finally:
+        _current_consistent_reads.reset(token)
+        await reads.close()
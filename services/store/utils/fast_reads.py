@@ -0,0 +1,176 @@
+"""Utilities for the hot song reads done directly with asyncpg, bypassing SQLAlchemy
+
+SQLAlchemy is still used for the DDL and the writes; only reads of a song by its
+number or title and prefix searches by title or number go through here.
+"""
+import asyncio
+import json
+from typing import Optional, List, Dict, Any, Sequence
+
+import asyncpg
+
+from services.store.utils.compression import (
+    COMPRESSED_LINES_FIELD,
+    DICTIONARY_ID_FIELD,
+)
+from services.store.utils.sqlachemy import EXPIRES_AT_FIELD
+from services.types import MusicalNote
+
+_song_columns = [
+    "number",
+    "language",
+    "title",
+    "key",
+    "lines",
+    COMPRESSED_LINES_FIELD,
+    DICTIONARY_ID_FIELD,
+]
+_unexpired_clause = f"({EXPIRES_AT_FIELD} IS NULL OR {EXPIRES_AT_FIELD} > now())"
+
+
+class FastReadPool:
+    """A dedicated asyncpg pool for fast reads, created lazily on the event loop it is used on"""
+
+    def __init__(self, uri: str, size: int, statement_cache_size: int):
+        """
+        Args:
+            uri: the uri of the postgres database
+            size: the maximum number of connections in the pool
+            statement_cache_size: the number of prepared statements cached per connection
+        """
+        self.__uri = uri
+        self.__size = size
+        self.__statement_cache_size = statement_cache_size
+        self.__pool: Optional[asyncpg.Pool] = None
+        self.__lock = asyncio.Lock()
+
+    async def get(self) -> asyncpg.Pool:
+        """Gets the pool, creating it if it does not exist yet or if its creation failed before"""
+        if self.__pool is None:
+            async with self.__lock:
+                if self.__pool is None:
+                    self.__pool = await asyncpg.create_pool(
+                        self.__uri,
+                        min_size=1,
+                        max_size=self.__size,
+                        statement_cache_size=self.__statement_cache_size,
+                        # statements of the hot reads are re-used throughout the pool's lifetime
+                        max_cached_statement_lifetime=0,
+                        init=_init_connection,
+                    )
+
+        return self.__pool
+
+    async def close(self):
+        """Closes the connections of the pool if it was ever created"""
+        if self.__pool is not None:
+            await self.__pool.close()
+            self.__pool = None
+
+
+async def fetch_song(
+    pool: asyncpg.Pool,
+    table_name: str,
+    field: str,
+    value: str,
+    language: str,
+    columns: Optional[Sequence[str]] = None,
+) -> Optional[Dict[str, Any]]:
+    """Fetches the unexpired song whose `field` is `value` in the given language
+
+    Args:
+        pool: the fast read pool
+        table_name: the name of the songs table
+        field: the column to match on e.g. number, title
+        value: the value of the field
+        language: the language of the song
+        columns: the columns to select; if None, all the song columns are selected
+
+    Returns:
+        the song data that can be passed to the Song model once its lines are decompressed if need be,
+        or None if it does not exist
+    """
+    if columns is None:
+        columns = _song_columns
+
+    record = await pool.fetchrow(
+        f"SELECT {', '.join(columns)} FROM {table_name} "
+        f"WHERE {field} = $1 AND language = $2 AND {_unexpired_clause} LIMIT 1",
+        value,
+        language,
+    )
+    if record is not None:
+        return _conv_record_to_song_dict(record)
+
+
+async def search_songs(
+    pool: asyncpg.Pool,
+    table_name: str,
+    field: str,
+    prefix: str,
+    language: str,
+    skip: int = 0,
+    limit: int = 0,
+    columns: Optional[Sequence[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Fetches the unexpired songs in the given language whose `field` begins with `prefix`, case-insensitively
+
+    Args:
+        pool: the fast read pool
+        table_name: the name of the songs table
+        field: the column to search e.g. title, number
+        prefix: the search term
+        language: the language of the songs
+        skip: the number of matching songs to skip
+        limit: the maximum number of songs to return; if 0, all matching songs are returned
+        columns: the columns to select; if None, all the song columns are selected
+
+    Returns:
+        the data of the matching songs that can be passed to the Song model once their lines are decompressed
+        if need be
+    """
+    if columns is None:
+        columns = _song_columns
+
+    # a NULL limit means no limit, so one prepared statement serves both cases
+    records = await pool.fetch(
+        f"SELECT {', '.join(columns)} FROM {table_name} "
+        f"WHERE lower({field}) LIKE lower($1) || '%' AND language = $2 AND {_unexpired_clause} "
+        f"OFFSET $3 LIMIT $4",
+        prefix,
+        language,
+        skip,
+        limit if limit > 0 else None,
+    )
+    return [_conv_record_to_song_dict(record) for record in records]
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    """Registers the binary codecs for json, skipping the decoding of the text from bytes"""
+    await conn.set_type_codec(
+        "json",
+        schema="pg_catalog",
+        encoder=lambda value: json.dumps(value).encode(),
+        decoder=json.loads,
+        format="binary",
+    )
+    # the binary jsonb format is the text prefixed with a version byte
+    await conn.set_type_codec(
+        "jsonb",
+        schema="pg_catalog",
+        encoder=lambda value: b"\x01" + json.dumps(value).encode(),
+        decoder=lambda data: json.loads(data[1:]),
+        format="binary",
+    )
+
+
+def _conv_record_to_song_dict(record: asyncpg.Record) -> Dict[str, Any]:
+    """Converts a songs table record, of all or some columns, into the data expected by the Song model"""
+    data = dict(record)
+    if "key" in data:
+        # the enum column holds the names of the notes, not their values
+        data["key"] = MusicalNote[data["key"]]
+    if isinstance(data.get("lines", None), str):
+        # lines are saved as json-encoded strings in the json column
+        data["lines"] = json.loads(data["lines"])
+    return data
@@ -0,0 +1,185 @@
+"""Utilities for the deadlines and the bounded concurrency of store operations"""
+import asyncio
+import functools
+from contextvars import ContextVar
+from typing import Optional, Callable, Awaitable, TypeVar, Dict, Any
+
+from services.errors import StoreTimeoutError, StoreOverloadedError
+from services.store.utils.loops import LoopLocal
+
+R = TypeVar("R")
+
+# whether the current task is already within a limited operation e.g. `update_fields` calling `get`
+_within_limited_operation: ContextVar[bool] = ContextVar(
+    "within_limited_operation", default=False
+)
+
+
+class ConcurrencyLimiter:
+    """Limits the number of concurrent operations on a database, queueing the rest up to a bound.
+
+    Operations arriving when the queue is full are shed immediately instead of waiting.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue_size: int):
+        """
+        Args:
+            max_concurrency: the maximum number of operations running at once
+            max_queue_size: the maximum number of operations waiting for their turn
+        """
+        self.__semaphore = asyncio.Semaphore(max_concurrency)
+        self.__max_queue_size = max_queue_size
+        self.__queue_size = 0
+
+    @property
+    def queue_size(self) -> int:
+        """The number of operations waiting for their turn"""
+        return self.__queue_size
+
+    def try_enter_queue(self) -> bool:
+        """Reserves a place in the queue, returning False if the queue is full"""
+        if self.__semaphore.locked() and self.__queue_size >= self.__max_queue_size:
+            return False
+        self.__queue_size += 1
+        return True
+
+    async def acquire(self):
+        """Waits for a free slot, leaving the queue whether it gets one or is cancelled"""
+        try:
+            await self.__semaphore.acquire()
+        finally:
+            self.__queue_size -= 1
+
+    def release(self):
+        """Frees the slot of a finished operation"""
+        self.__semaphore.release()
+
+
+class StoreLimits:
+    """The deadline of each operation and the concurrency limiter of one database"""
+
+    def __init__(
+        self,
+        timeout: Optional[float],
+        max_concurrency: int,
+        max_queue_size: int,
+        retry_after: int,
+    ):
+        """
+        Args:
+            timeout: the number of seconds within which each operation must complete; None means no deadline
+            max_concurrency: the maximum number of concurrent operations per event loop; 0 means no limit
+            max_queue_size: the maximum number of operations waiting for their turn per event loop
+            retry_after: the number of seconds after which shed operations can be retried
+        """
+        self.__config: Optional[Dict[str, Any]] = None
+        self.__timeout: Optional[float] = None
+        self.__retry_after = retry_after
+        self.__limiters: Optional[LoopLocal[ConcurrencyLimiter]] = None
+        self.configure(
+            timeout=timeout,
+            max_concurrency=max_concurrency,
+            max_queue_size=max_queue_size,
+            retry_after=retry_after,
+        )
+
+    def configure(
+        self,
+        timeout: Optional[float],
+        max_concurrency: int,
+        max_queue_size: int,
+        retry_after: int,
+    ):
+        """Changes the deadline and the concurrency limits, for all the stores sharing these limits
+
+        Operations already running or queued keep the limiter they started with.
+        It does nothing if the limits are unchanged, lest it reset the limiters.
+        """
+        config = {
+            "timeout": timeout,
+            "max_concurrency": max_concurrency,
+            "max_queue_size": max_queue_size,
+            "retry_after": retry_after,
+        }
+        if config == self.__config:
+            return
+
+        self.__config = config
+        self.__timeout = timeout
+        self.__retry_after = retry_after
+        self.__limiters = None
+        if max_concurrency > 0:
+            self.__limiters = LoopLocal(
+                factory=lambda: ConcurrencyLimiter(max_concurrency, max_queue_size),
+                discard=lambda _: None,
+            )
+
+    @property
+    def is_unlimited(self) -> bool:
+        """Whether operations run without deadlines or concurrency limits"""
+        return self.__timeout is None and self.__limiters is None
+
+    async def run(self, name: str, operation: Callable[[], Awaitable[R]]) -> R:
+        """Runs the operation within its deadline, after getting a free slot in the concurrency limiter
+
+        The wait for a free slot counts towards the deadline.
+
+        Args:
+            name: the name of the operation for the errors e.g. 'get on songs'
+            operation: the function returning the awaitable of the operation
+
+        Returns:
+            the result of the operation
+
+        Raises:
+            StoreOverloadedError: the queue of the concurrency limiter is full
+            StoreTimeoutError: the operation did not complete within its deadline
+        """
+        if self.is_unlimited or _within_limited_operation.get():
+            return await operation()
+
+        limiter = None if self.__limiters is None else self.__limiters.get()
+        if limiter is not None and not limiter.try_enter_queue():
+            raise StoreOverloadedError(name, retry_after=self.__retry_after)
+
+        try:
+            return await asyncio.wait_for(
+                self.__run_in_slot(limiter, operation), timeout=self.__timeout
+            )
+        except asyncio.TimeoutError:
+            raise StoreTimeoutError(f"{name} took longer than {self.__timeout}s")
+
+    @staticmethod
+    async def __run_in_slot(
+        limiter: Optional[ConcurrencyLimiter], operation: Callable[[], Awaitable[R]]
+    ) -> R:
+        """Runs the operation once the limiter, if any, has a free slot for it
+
+        The operations it calls, e.g. `update_fields` calling `get`, run in its slot. The flag marking that is
+        reset afterwards since `wait_for` may run this in the caller's task, whose later operations must be limited.
+        """
+        token = _within_limited_operation.set(True)
+        try:
+            if limiter is None:
+                return await operation()
+
+            await limiter.acquire()
+            try:
+                return await operation()
+            finally:
+                limiter.release()
+        finally:
+            _within_limited_operation.reset(token)
+
+
+def limited(method: Callable[..., Awaitable[R]]) -> Callable[..., Awaitable[R]]:
+    """Decorates a store method to run within the deadline and concurrency limits of the store's database"""
+
+    @functools.wraps(method)
+    async def wrapper(self, *args: Any, **kwargs: Any) -> R:
+        return await self._limits.run(
+            f"{method.__name__} on {self._name}",
+            lambda: method(self, *args, **kwargs),
+        )
+
+    return wrapper
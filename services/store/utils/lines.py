@@ -0,0 +1,35 @@
+"""Utilities for changing the lines of songs"""
+from typing import Any, Dict, List, Optional
+
+from services.hymns.models import LineOperation, apply_line_operations
+
+
+async def rewrite_lines(
+    store: Any,
+    k: str,
+    operations: List[LineOperation],
+    fields: Optional[Dict[str, Any]] = None,
+) -> Optional[Any]:
+    """Applies the line operations by reading the song and writing back its new lines and the given fields
+
+    This is for the songs whose lines cannot be changed within the database e.g. compressed lines, in stores
+    without concurrent writers e.g. the sqlite replicas of edge nodes, as the read and the write are not atomic.
+
+    Args:
+        store: the Store of the song
+        k: the key of the song
+        operations: the operations on the lines of the song, applied in order
+        fields: a map of field name to the new value of the other fields to update, if any
+
+    Returns:
+        the updated song or None if no song exists for that key
+
+    Raises:
+        ValueError: the index of some operation is beyond the lines of the song
+    """
+    value = await store.get(k)
+    if value is None:
+        return None
+
+    lines = apply_line_operations(getattr(value, "lines"), operations)
+    return await store.update_fields(k, {**(fields or {}), "lines": lines})
@@ -0,0 +1,51 @@
+"""Utilities for objects bound to event loops e.g. connection pools"""
+import asyncio
+from typing import TypeVar, Generic, Callable, Dict, List, Tuple
+
+V = TypeVar("V")
+
+
+class LoopLocal(Generic[V]):
+    """Lazily creates a value e.g. a connection pool for each event loop it is used on.
+
+    Connection pools cannot be shared across event loops e.g. those of successive
+    `asyncio.run` calls, so each running loop gets its own.
+    The values of closed loops are discarded when a value for a new loop is created.
+    """
+
+    def __init__(self, factory: Callable[[], V], discard: Callable[[V], None]):
+        """
+        Args:
+            factory: the function that creates the value on the running loop
+            discard: the function that releases the value of a closed loop without awaiting
+        """
+        self.__factory = factory
+        self.__discard = discard
+        self.__values: Dict[asyncio.AbstractEventLoop, V] = {}
+
+    def get(self) -> V:
+        """Gets the value of the running event loop, creating it if it does not exist
+
+        Raises:
+            RuntimeError: no running event loop
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return self.__values[loop]
+        except KeyError:
+            self.__discard_closed_loops()
+            value = self.__factory()
+            self.__values[loop] = value
+            return value
+
+    def pop_all(self) -> List[Tuple[asyncio.AbstractEventLoop, V]]:
+        """Removes all the values, returning them with their event loops"""
+        items = [*self.__values.items()]
+        self.__values.clear()
+        return items
+
+    def __discard_closed_loops(self):
+        """Discards the values of the event loops that have been closed"""
+        for loop in [*self.__values.keys()]:
+            if loop.is_closed():
+                self.__discard(self.__values.pop(loop))
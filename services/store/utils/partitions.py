@@ -0,0 +1,162 @@
+"""Utilities for list-partitioning postgres tables e.g. the songs table by language"""
+import hashlib
+import re
+from typing import Optional, List
+
+from sqlalchemy import Table, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+_non_word_regex = re.compile(r"\W+")
+_unpartitioned_suffix = "unpartitioned"
+
+
+def get_partition_name(table_name: str, value: str) -> str:
+    """Gets the name of the partition of the given table that holds the rows of the given value
+
+    The hash suffix ensures values that differ only in case or punctuation get different partitions.
+
+    Args:
+        table_name: the name of the partitioned table
+        value: the value of the partition key e.g. the language
+
+    Returns:
+        a valid postgres identifier for the partition
+    """
+    slug = _non_word_regex.sub("_", value.lower())[:32]
+    suffix = hashlib.md5(value.encode()).hexdigest()[:8]
+    return f"{table_name}_{slug}_{suffix}"
+
+
+def get_default_partition_name(table_name: str) -> str:
+    """Gets the name of the partition that holds rows of values without their own partition"""
+    return f"{table_name}_default"
+
+
+async def lock_partitions(conn: AsyncConnection, table_name: str):
+    """Serializes changes to the partitions of the given table until the end of the transaction"""
+    await conn.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:key))"),
+        {"key": f"{table_name}_partitions"},
+    )
+
+
+async def rename_unpartitioned_table_if_exists(
+    conn: AsyncConnection, table_name: str
+) -> Optional[str]:
+    """Renames the table if it exists but is not partitioned, so that a partitioned one can take its name.
+
+    Args:
+        conn: the connection, within a transaction, to the database
+        table_name: the name of the table
+
+    Returns:
+        the new name of the unpartitioned table or None if there was no unpartitioned table
+    """
+    res = await conn.execute(
+        text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass(:table_name)"),
+        {"table_name": table_name},
+    )
+    if res.scalar() != "r":
+        return None
+
+    new_name = f"{table_name}_{_unpartitioned_suffix}"
+    await conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {new_name}"))
+
+    # index names are unique per schema so free them for the partitioned table
+    res = await conn.execute(
+        text("SELECT indexname FROM pg_indexes WHERE tablename = :table_name"),
+        {"table_name": new_name},
+    )
+    for index_name in res.scalars().all():
+        await conn.execute(
+            text(
+                f"ALTER INDEX {index_name} RENAME TO {index_name}_{_unpartitioned_suffix}"
+            )
+        )
+
+    return new_name
+
+
+async def move_rows_from_unpartitioned_table(
+    conn: AsyncConnection, table: Table, unpartitioned_table_name: str
+):
+    """Copies all rows of the unpartitioned table into the partitioned table and drops the unpartitioned table
+
+    Args:
+        conn: the connection, within a transaction, to the database
+        table: the partitioned table
+        unpartitioned_table_name: the name of the old unpartitioned table
+    """
+    res = await conn.execute(
+        text(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = :t"
+        ),
+        {"t": unpartitioned_table_name},
+    )
+    old_columns = set(res.scalars().all())
+    columns = _to_column_list([c.name for c in table.c if c.name in old_columns])
+
+    await conn.execute(
+        text(
+            f"INSERT INTO {table.name} ({columns}) "
+            f"SELECT {columns} FROM {unpartitioned_table_name}"
+        )
+    )
+    await conn.execute(text(f"DROP TABLE {unpartitioned_table_name}"))
+
+
+async def create_default_partition_if_not_exists(
+    conn: AsyncConnection, table_name: str
+):
+    """Creates the partition for rows whose partition key values have no partition of their own"""
+    default_partition = get_default_partition_name(table_name)
+    await conn.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {default_partition} PARTITION OF {table_name} DEFAULT"
+        )
+    )
+
+
+async def create_partition_if_not_exists(
+    conn: AsyncConnection, table: Table, key: str, value: str
+):
+    """Creates the partition of the given table for the given value of the partition key
+
+    Any rows of that value that are in the default partition are moved to the new partition.
+
+    Args:
+        conn: the connection, within a transaction, to the database
+        table: the partitioned table
+        key: the partition key column name e.g. language
+        value: the value of the partition key whose partition is to be created
+    """
+    partition = get_partition_name(table.name, value)
+    res = await conn.execute(text("SELECT to_regclass(:name)"), {"name": partition})
+    if res.scalar() is not None:
+        return
+
+    default_partition = get_default_partition_name(table.name)
+    columns = _to_column_list([c.name for c in table.c])
+    literal_value = value.replace("'", "''")
+
+    await conn.execute(
+        text(f"CREATE TABLE {partition} (LIKE {table.name} INCLUDING DEFAULTS)")
+    )
+    await conn.execute(
+        text(
+            f"WITH moved AS ("
+            f"DELETE FROM {default_partition} WHERE {key} = :value RETURNING {columns}"
+            f") INSERT INTO {partition} ({columns}) SELECT {columns} FROM moved"
+        ),
+        {"value": value},
+    )
+    # the value is not parsed for bind parameters when executed directly by the driver
+    await conn.exec_driver_sql(
+        f"ALTER TABLE {table.name} ATTACH PARTITION {partition} "
+        f"FOR VALUES IN ('{literal_value}')"
+    )
+
+
+def _to_column_list(columns: List[str]) -> str:
+    """Converts the column names into a comma-separated list of quoted identifiers"""
+    return ", ".join(f'"{col}"' for col in columns)
@@ -1,12 +1,28 @@
 """Utilities associated with sqlalchemy"""
 import json
 
-from typing import List, Dict, Any, TypeVar, Type, Mapping
+from typing import List, Dict, Any, TypeVar, Type, Mapping, Optional
 
 from pydantic import BaseModel
-from sqlalchemy import String, Integer, JSON, Enum, Column
+from sqlalchemy import (
+    String,
+    Integer,
+    JSON,
+    Enum,
+    Column,
+    DateTime,
+    LargeBinary,
+    Table,
+    cast,
+)
+from sqlalchemy.sql.elements import ColumnElement
 
 from services.hymns.models import LineSection
+from services.store.utils.compression import (
+    conv_lines_to_json,
+    COMPRESSED_LINES_FIELD,
+    DICTIONARY_ID_FIELD,
+)
 from services.types import MusicalNote
 
 T = TypeVar("T", bound=BaseModel)
@@ -29,9 +45,27 @@ class ColumnData:
         return Column(*self.args, **self.kwargs)
 
 
+EXPIRES_AT_FIELD = "expires_at"
+UPDATED_AT_FIELD = "updated_at"
+
+_expires_at_column = ColumnData(
+    EXPIRES_AT_FIELD, DateTime(timezone=True), nullable=True, index=True
+)
+_updated_at_column = ColumnData(
+    UPDATED_AT_FIELD, DateTime(timezone=True), nullable=True, index=True
+)
 _table_name_columns_map: Dict[str, List[ColumnData]] = {
-    "configs": [ColumnData("key", String, primary_key=True), ColumnData("data", JSON)],
-    "apps": [ColumnData("key", String, primary_key=True)],
+    "configs": [
+        ColumnData("key", String, primary_key=True),
+        ColumnData("data", JSON),
+        _expires_at_column,
+        _updated_at_column,
+    ],
+    "apps": [
+        ColumnData("key", String, primary_key=True),
+        _expires_at_column,
+        _updated_at_column,
+    ],
     "users": [
         ColumnData("username", String(255), primary_key=True),
         ColumnData("email", String(255), nullable=False),  # encrypted
@@ -39,16 +73,55 @@ _table_name_columns_map: Dict[str, List[ColumnData]] = {
         ColumnData("otp_counter", String(255)),  # encrypted
         ColumnData("otp_secret", String(255)),  # encrypted
         ColumnData("login_attempts", Integer, default=0),
+        _expires_at_column,
+        _updated_at_column,
     ],
     "songs": [
         ColumnData("number", String(255), primary_key=True),
         ColumnData("language", String(255), primary_key=True),
         ColumnData("title", String(255), primary_key=True),
         ColumnData("key", Enum(MusicalNote), nullable=False),
-        ColumnData("lines", JSON, nullable=False),  # List[List[LineSection]]
+        # List[List[LineSection]] or CompactLines; NULL if compressed
+        ColumnData("lines", JSON, nullable=True),
+        ColumnData(COMPRESSED_LINES_FIELD, LargeBinary, nullable=True),
+        ColumnData(DICTIONARY_ID_FIELD, String(255), nullable=True),
+        _expires_at_column,
+        _updated_at_column,
+    ],
+    "dictionaries": [
+        ColumnData("id", String(255), primary_key=True),
+        ColumnData("language", String(255), nullable=False),
+        ColumnData("data", LargeBinary, nullable=False),
+        ColumnData("created_at", DateTime(timezone=True), nullable=False),
+        _expires_at_column,
+        _updated_at_column,
+    ],
+    "language_versions": [
+        ColumnData("language", String(255), primary_key=True),
+        ColumnData("version", Integer, nullable=False, default=0),
+        _expires_at_column,
+        _updated_at_column,
+    ],
+}
+# the changes that bring tables created by older versions up to date, applied on creation
+_table_migrations_map: Dict[str, List[str]] = {
+    "songs": [
+        f"ADD COLUMN IF NOT EXISTS {COMPRESSED_LINES_FIELD} BYTEA",
+        f"ADD COLUMN IF NOT EXISTS {DICTIONARY_ID_FIELD} VARCHAR(255)",
+        "ALTER COLUMN lines DROP NOT NULL",
     ],
 }
 
+# the indexes over expressions of the columns, created if they do not exist
+_table_expression_indexes_map: Dict[str, Dict[str, str]] = {
+    # for range scans of the songs of a language, in the numerical order of their numbers
+    "songs": {"ix_songs_number_value": "language, (CAST(number AS INTEGER)), title"},
+}
+
+_table_partition_key_map: Dict[str, str] = {
+    "songs": "language",
+}
+
 _table_fields_map = {
     field: [col.args[0] for col in columns]
     for field, columns in _table_name_columns_map.items()
@@ -61,12 +134,47 @@ def get_table_columns(table_name: str) -> List[Column]:
     return [col_data.to_column() for col_data in col_data_list]
 
 
-def conv_model_to_dict(table_name: str, data: BaseModel) -> Dict[str, Any]:
+def get_table_kwargs(table_name: str) -> Dict[str, Any]:
+    """Gets the extra sqlalchemy Table keyword arguments for a given table_name"""
+    partition_key = get_partition_key(table_name)
+    if partition_key is not None:
+        return {"postgresql_partition_by": f"LIST ({partition_key})"}
+    return {}
+
+
+def get_table_migrations(table_name: str) -> List[str]:
+    """Gets the ALTER TABLE actions that bring the given table, if created by an older version, up to date"""
+    return _table_migrations_map.get(table_name, [])
+
+
+def get_table_index_statements(table_name: str) -> List[str]:
+    """Gets the CREATE INDEX statements of the indexes over expressions of the columns of the given table"""
+    indexes = _table_expression_indexes_map.get(table_name, {})
+    return [
+        f"CREATE INDEX IF NOT EXISTS {name} ON {table_name} ({expression})"
+        for name, expression in indexes.items()
+    ]
+
+
+def get_number_value(table: Table) -> ColumnElement:
+    """Gets the integer value of the number column of the songs table, as indexed for range scans"""
+    return cast(table.c.number, Integer)
+
+
+def get_partition_key(table_name: str) -> Optional[str]:
+    """Gets the column by whose values the given table is list-partitioned, or None if it is not partitioned"""
+    return _table_partition_key_map.get(table_name, None)
+
+
+def conv_model_to_dict(
+    table_name: str, data: BaseModel, compact_lines: bool = False
+) -> Dict[str, Any]:
     """Converts the well-known models of the different collections into dictionaries
 
     Args:
         table_name: the sql table name for the given model
         data: the data to be converted into a dict
+        compact_lines: whether the lines of songs are to be in the compact columnar encoding
 
     Returns:
         a dictionary normalized to the data expected by the postgres table
@@ -75,14 +183,43 @@ def conv_model_to_dict(table_name: str, data: BaseModel) -> Dict[str, Any]:
         return dict(data=data.json())
     elif table_name == "songs":
         lines: List[List[LineSection]] = getattr(data, "lines", [])
-        lines_of_dicts = [[section.dict() for section in line] for line in lines]
-
         number = f"{getattr(data, 'number')}"
-        return {**data.dict(), "number": number, "lines": json.dumps(lines_of_dicts)}
+        return {
+            **data.dict(),
+            "number": number,
+            "lines": conv_lines_to_json(lines, compact=compact_lines),
+        }
     else:
         return data.dict()
 
 
+def conv_fields_to_dict(
+    table_name: str, fields: Dict[str, Any], compact_lines: bool = False
+) -> Dict[str, Any]:
+    """Converts a partial set of model fields into the data expected by the postgres table
+
+    Unknown fields are dropped.
+
+    Args:
+        table_name: the sql table name for the given fields
+        fields: the map of field name to new value
+        compact_lines: whether the lines of songs are to be in the compact columnar encoding
+
+    Returns:
+        a dictionary normalized to the data expected by the postgres table
+    """
+    table_fields = _table_fields_map[table_name]
+    data = {k: v for k, v in fields.items() if k in table_fields}
+
+    if table_name == "songs":
+        if "lines" in data:
+            data["lines"] = conv_lines_to_json(data["lines"], compact=compact_lines)
+        if "number" in data:
+            data["number"] = f"{data['number']}"
+
+    return data
+
+
 def conv_dict_to_model(table_name: str, model: Type[T], data: Mapping[str, Any]) -> T:
     """Converts the mapping into the model given the table name
 
@@ -98,7 +235,9 @@ def conv_dict_to_model(table_name: str, model: Type[T], data: Mapping[str, Any])
         kwargs = json.loads(data.get("data", "{}"))
         return model(**kwargs)
     elif table_name == "songs":
-        kwargs = {**data, "lines": json.loads(data.get("lines", "[]"))}
+        kwargs = {**data}
+        if isinstance(data.get("lines", None), str):
+            kwargs["lines"] = json.loads(data["lines"])
         return model(**kwargs)
     else:
         return model(**data)
@@ -0,0 +1,109 @@
+"""Utilities for units of work i.e. store operations that share one transaction per database"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, Callable, Awaitable, Optional, AsyncIterator, Protocol, List
+
+_logger = logging.getLogger(__name__)
+
+
+class Transaction(Protocol):
+    """A connection or session, with its transaction if any, shared by the operations of a unit of work"""
+
+    async def commit(self):
+        """Commits the transaction and releases the connection or session"""
+
+    async def rollback(self):
+        """Rolls back the transaction and releases the connection or session"""
+
+
+class UnitOfWork:
+    """The transactions, one per database, shared by all store operations within e.g. one request
+
+    Each transaction is begun lazily by the first operation on its database, and all of them
+    are committed once, at the end of the unit of work, or rolled back if it fails.
+    """
+
+    def __init__(self):
+        self.__transactions: Dict[str, Transaction] = {}
+        self.__lock = asyncio.Lock()
+
+    async def get_transaction(
+        self, key: str, begin: Callable[[], Awaitable[Transaction]]
+    ) -> Transaction:
+        """Gets the transaction of the given key, beginning it if it has not been begun yet
+
+        Args:
+            key: the key identifying the database e.g. its store type and uri
+            begin: the function that begins the transaction
+
+        Returns:
+            the transaction shared by all operations on that database in this unit of work
+        """
+        async with self.__lock:
+            if key not in self.__transactions:
+                self.__transactions[key] = await begin()
+            return self.__transactions[key]
+
+    async def commit(self):
+        """Commits all the transactions, rolling back the rest if any of them fails"""
+        transactions = [*self.__transactions.values()]
+        self.__transactions.clear()
+
+        for i, transaction in enumerate(transactions):
+            try:
+                await transaction.commit()
+            except BaseException:
+                await _rollback_all(transactions[i + 1 :])
+                raise
+
+    async def rollback(self):
+        """Rolls back all the transactions"""
+        transactions = [*self.__transactions.values()]
+        self.__transactions.clear()
+        await _rollback_all(transactions)
+
+
+_current_unit_of_work: ContextVar[Optional[UnitOfWork]] = ContextVar(
+    "current_unit_of_work", default=None
+)
+
+
+def get_current_unit_of_work() -> Optional[UnitOfWork]:
+    """Gets the unit of work of the current context, or None if there is none"""
+    return _current_unit_of_work.get()
+
+
+@asynccontextmanager
+async def unit_of_work() -> AsyncIterator[UnitOfWork]:
+    """Runs the store operations within the context in one transaction per database, committed once on exit.
+
+    If the context fails, the transactions are rolled back instead.
+    A unit of work within another unit of work joins the outer one.
+    """
+    current = _current_unit_of_work.get()
+    if current is not None:
+        yield current
+        return
+
+    uow = UnitOfWork()
+    token = _current_unit_of_work.set(uow)
+    try:
+        yield uow
+    except BaseException:
+        await uow.rollback()
+        raise
+    else:
+        await uow.commit()
+    finally:
+        _current_unit_of_work.reset(token)
+
+
+async def _rollback_all(transactions: List[Transaction]):
+    """Rolls back all the given transactions, even if some of the rollbacks fail"""
+    for transaction in transactions:
+        try:
+            await transaction.rollback()
+        except Exception as exp:
+            _logger.warning(f"failed to roll back unit of work transaction: {exp}")
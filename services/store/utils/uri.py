@@ -15,6 +15,11 @@ def get_store_type(uri: str) -> str:
 def escape_db_uri(uri: str) -> str:
     """Properly escapes the uri of the database"""
     parsed_uri = make_url(uri)
+    if parsed_uri.host is None:
+        # embedded databases e.g. sqlite:///path/to/file.db have only a path
+        database = "" if parsed_uri.database is None else f"/{parsed_uri.database}"
+        return f"{parsed_uri.drivername}://{database}"
+
     user_details = ""
     if parsed_uri.username:
         user_details = f"{quote_plus(parsed_uri.username)}"
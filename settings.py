@@ -1,5 +1,7 @@
+import json
 import os
 from pathlib import Path
+from typing import Dict, List, Optional
 
 import aiosmtplib.smtp
 import dotenv
@@ -39,6 +41,101 @@ def get_hymns_db_uri() -> str:
     return os.getenv("HYMNS_DB_PATH", get_db_uri())
 
 
+def get_edge_db_uri() -> Optional[str]:
+    """Gets the uri of the local embedded database of an edge node e.g. sqlite:///./edge.db
+
+    If set, the app runs as a read-only edge node, serving songs from this database
+    into which the changes of the songs at the hymns db uri are pulled periodically.
+    """
+    env_str = os.getenv("EDGE_DB_PATH", "").strip()
+    if env_str == "":
+        return None
+    return env_str
+
+
+def get_edge_sync_interval() -> float:
+    """Gets the number of seconds between the pulls of the changes of the songs by an edge node"""
+    return float(os.getenv("EDGE_SYNC_INTERVAL", "30"))
+
+
+def get_hymns_language_db_uris() -> Dict[str, str]:
+    """Gets the db uris for the languages whose songs are not to be stored at the hymns service db uri.
+
+    The environment variable is of the form `lang1,lang2=uri1;lang3=uri2`
+
+    Returns:
+        the map of language to the db uri where its songs are stored
+    """
+    env_str = os.getenv("HYMNS_LANGUAGE_DB_URIS", "").strip()
+    language_uris = {}
+
+    for group in env_str.split(";"):
+        if group.strip() == "":
+            continue
+
+        try:
+            langs, uri = group.split("=", 1)
+        except ValueError:
+            raise ConfigurationError(
+                f"environment variable 'HYMNS_LANGUAGE_DB_URIS' has an invalid group '{group}'"
+            )
+
+        for lang in langs.split(","):
+            language_uris[lang.strip()] = uri.strip()
+
+    return language_uris
+
+
+def get_db_replica_uris() -> Dict[str, List[str]]:
+    """Gets the uris of the read replicas of the databases.
+
+    The environment variable is a JSON object e.g. `{"primary1": ["replica1", "replica2"], "primary2": ["replica3"]}`,
+    as the uris may themselves contain "=", "," or ";" e.g. in their query strings.
+
+    Returns:
+        the map of primary db uri to the uris of its read replicas
+    """
+    env_str = os.getenv("DB_REPLICA_URIS", "").strip()
+    if env_str == "":
+        return {}
+
+    try:
+        replica_uris = json.loads(env_str)
+    except json.JSONDecodeError as exp:
+        raise ConfigurationError(
+            f"environment variable 'DB_REPLICA_URIS' is not valid JSON: {exp.msg}"
+        )
+
+    if not isinstance(replica_uris, dict) or not all(
+        isinstance(replicas, list) and all(isinstance(uri, str) for uri in replicas)
+        for replicas in replica_uris.values()
+    ):
+        raise ConfigurationError(
+            "environment variable 'DB_REPLICA_URIS' should map each primary uri to a list of replica uris"
+        )
+
+    return {
+        primary_uri.strip(): [uri.strip() for uri in replicas if uri.strip() != ""]
+        for primary_uri, replicas in replica_uris.items()
+    }
+
+
+def get_db_max_staleness_seconds() -> Optional[int]:
+    """Gets the maximum replication lag in seconds of the mongodb secondaries that serve public reads"""
+    env_str = os.getenv("DB_MAX_STALENESS_SECONDS", "").strip()
+    if env_str == "":
+        return None
+    return int(env_str)
+
+
+def get_db_operation_timeout() -> Optional[float]:
+    """Gets the number of seconds within which each database operation must complete"""
+    env_str = os.getenv("DB_OPERATION_TIMEOUT", "").strip()
+    if env_str == "":
+        return None
+    return float(env_str)
+
+
 def get_hymns_service_config() -> ServiceConfig:
     """Gets the service config for the hymns service"""
     return ServiceConfig(
@@ -50,6 +147,18 @@ def get_hymns_service_config() -> ServiceConfig:
             lang.strip()
             for lang in os.getenv("LANGUAGES", "english,runyoro").split(",")
         ],
+        language_db_uris=get_hymns_language_db_uris(),
+        db_replica_uris=get_db_replica_uris(),
+        read_preference=os.getenv("DB_READ_PREFERENCE", None),
+        read_concern=os.getenv("DB_READ_CONCERN", None),
+        max_staleness_seconds=get_db_max_staleness_seconds(),
+        fast_reads=_str_to_bool(os.getenv("DB_FAST_READS", "false")),
+        transactions=_str_to_bool(os.getenv("DB_TRANSACTIONS", "false")),
+        operation_timeout=get_db_operation_timeout(),
+        max_concurrency=int(os.getenv("DB_MAX_CONCURRENCY", "0")),
+        max_queue_size=int(os.getenv("DB_MAX_QUEUE_SIZE", "0")),
+        compact_lines=_str_to_bool(os.getenv("DB_COMPACT_LINES", "false")),
+        compress_lines=_str_to_bool(os.getenv("DB_COMPRESS_LINES", "false")),
     )
 
 
@@ -64,6 +173,16 @@ def get_rate_limit() -> str:
     return os.getenv("RATE_LIMIT", "5/minute")
 
 
+def get_compression_min_size() -> int:
+    """Gets the number of bytes below which response bodies are sent uncompressed"""
+    return int(os.getenv("COMPRESSION_MIN_SIZE", "500").strip())
+
+
+def get_compression_cache_size() -> int:
+    """Gets the maximum number of compressed bodies of GET responses with ETags kept in memory; 0 disables it"""
+    return int(os.getenv("COMPRESSION_CACHE_SIZE", "1000").strip())
+
+
 def get_otp_verification_url() -> str:
     """The URL where the form for verification of OTP for admin users is."""
     try:
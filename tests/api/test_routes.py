@@ -1,3 +1,4 @@
+import json
 import time
 from typing import List, Dict, Any
 
@@ -5,6 +6,8 @@ import pytest
 from fastapi.testclient import TestClient
 from api.models import Song
 from services import auth
+from services.hymns.models import MAX_SONG_NUMBER
+from services.hymns.utils import bulk
 from .conftest import (
     api_songs_langs_fixture,
     get_rate_limit_string,
@@ -41,6 +44,24 @@ async def test_create_song(client: TestClient, song: Song, langs: List[str]):
             )
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_create_song_number_out_of_range(client: TestClient):
+    """create_song rejects songs whose numbers are beyond the range of the index of song numbers"""
+    with client:
+        headers = _get_auth_headers(client, test_user)
+        payload = {**songs[0].dict(), "number": MAX_SONG_NUMBER + 1}
+
+        response = client.post("/api", json=payload, headers=headers)
+        assert response.status_code == 400
+        assert f"{MAX_SONG_NUMBER + 1}" in response.json()["detail"]
+
+        response = client.post(
+            "/api", json={**payload, "number": MAX_SONG_NUMBER}, headers=headers
+        )
+        assert response.status_code == 200
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("client", test_clients_fixture)
 async def test_get_song_detail(client: TestClient):
@@ -71,6 +92,109 @@ async def test_get_song_detail(client: TestClient):
             assert response.json() == expected
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_conditional_requests(client: TestClient):
+    """Songs that have not changed since the client got them are not sent again"""
+    lang = languages[0]
+    song = songs[0]
+    detail_url = f"/api/{lang}/{song.number}"
+    search_url = f"/api/{lang}/find-by-title/{song.title[:2]}"
+
+    with client:
+        headers = _get_auth_headers(client, test_user)
+        payload = Song(**{**song.dict(), "language": lang}).dict()
+        response = client.post("/api", json=payload, headers=headers)
+        assert response.status_code == 200
+
+        etags = {}
+        for url in (detail_url, search_url):
+            response = client.get(url, headers=headers)
+            assert response.status_code == 200
+            etags[url] = response.headers["etag"]
+
+            response = client.get(url, headers={**headers, "If-None-Match": etags[url]})
+            assert response.status_code == 304
+            assert response.content == b""
+            assert response.headers["etag"] == etags[url]
+
+            response = client.get(
+                url, headers={**headers, "If-None-Match": '"stale", W/"other"'}
+            )
+            assert response.status_code == 200
+
+        last_modified = client.get(detail_url, headers=headers).headers["last-modified"]
+        response = client.get(
+            detail_url, headers={**headers, "If-Modified-Since": last_modified}
+        )
+        assert response.status_code == 304
+
+        response = client.patch(detail_url, json=dict(key="D"), headers=headers)
+        assert response.status_code == 200
+
+        for url in (detail_url, search_url):
+            response = client.get(url, headers={**headers, "If-None-Match": etags[url]})
+            assert response.status_code == 200
+            assert response.headers["etag"] != etags[url]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_compression(client: TestClient):
+    """Large responses are compressed with the encoding accepted by the client, and cached if they have ETags"""
+    lang = languages[0]
+    lines = [[dict(note="C", words=f"Praise the Lord, line {i}")] for i in range(50)]
+    payload = dict(key="C", title="Long song", number=1, language=lang, lines=lines)
+    detail_url = f"/api/{lang}/1"
+
+    with client:
+        headers = _get_auth_headers(client, test_user)
+        response = client.post("/api", json=payload, headers=headers)
+        assert response.status_code == 200
+
+        for accept_encoding, expected in [
+            ("gzip, deflate, br", "br"),
+            ("gzip", "gzip"),
+            ("br;q=0.5, gzip;q=0.8", "gzip"),
+            ("*", "br"),
+            ("identity", None),
+            ("br;q=0, gzip;q=0", None),
+        ]:
+            response = client.get(
+                detail_url, headers={**headers, "Accept-Encoding": accept_encoding}
+            )
+            assert response.status_code == 200
+            assert response.headers.get("content-encoding") == expected
+            assert response.json()["translations"][lang] == payload
+
+        response = client.get(detail_url, headers={**headers, "Accept-Encoding": "br"})
+        etag = response.headers["etag"]
+        assert etag.startswith("W/")
+        assert "Accept-Encoding" in response.headers["vary"]
+        compressor = client.app.state.compressor
+        cache_key = (detail_url, b"", etag[2:])
+        assert compressor.compress(b"", "br", cache_key=cache_key) != b""
+
+        response = client.get(
+            detail_url,
+            headers={**headers, "Accept-Encoding": "br", "If-None-Match": etag},
+        )
+        assert response.status_code == 304
+
+        response = client.get(
+            f"/api/{lang}/range",
+            params={"from": 1, "to": 1},
+            headers={**headers, "Accept-Encoding": "gzip"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.json() == [payload]
+
+        response = client.post("/api/register", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("client, song, langs", api_songs_langs_fixture)
 async def test_update_song(client: TestClient, song: Song, langs: List[str]):
@@ -119,6 +243,60 @@ async def test_update_song(client: TestClient, song: Song, langs: List[str]):
                 )
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_patch_song(client: TestClient):
+    """Replaces, inserts and deletes lines of the song, and changes its key"""
+    lang = languages[0]
+    lines = [[dict(note="F", words=f"line {i}")] for i in range(3)]
+    new_line = [dict(note="Am", words="new line")]
+    payload = dict(key="F", title="foo", number=1, language=lang, lines=lines)
+
+    test_data = [
+        (
+            dict(lines=[dict(op="replace", index=1, line=new_line)]),
+            {**payload, "lines": [lines[0], new_line, lines[2]]},
+        ),
+        (
+            dict(
+                key="D",
+                lines=[
+                    dict(op="delete", index=0),
+                    dict(op="insert", index=2, line=new_line),
+                ],
+            ),
+            {**payload, "key": "D", "lines": [new_line, lines[2], new_line]},
+        ),
+    ]
+
+    with client:
+        headers = _get_auth_headers(client, test_user)
+        response = client.post("/api", json=payload, headers=headers)
+        assert response.status_code == 200
+
+        for patch, expected in test_data:
+            response = client.patch(f"/api/{lang}/1", json=patch, headers=headers)
+            assert response.status_code == 200
+            assert response.json() == expected
+            _assert_song_has_content(
+                client, language=lang, number=1, content=expected, headers=headers
+            )
+
+        for number, patch, status_code in [
+            (1, dict(lines=[dict(op="delete", index=3)]), 400),
+            (1, dict(lines=[dict(op="insert", index=0)]), 422),
+            (1, dict(lines=[dict(op="delete", index=-1)]), 422),
+            (2, dict(lines=[dict(op="delete", index=0)]), 404),
+        ]:
+            response = client.patch(
+                f"/api/{lang}/{number}", json=patch, headers=headers
+            )
+            assert response.status_code == status_code
+
+        response = client.patch(f"/api/{lang}/1", json=dict(key="C"))
+        assert response.status_code == 401
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("client", test_clients_fixture)
 async def test_delete_song(client: TestClient):
@@ -265,6 +443,390 @@ async def test_query_by_number(client: TestClient):
                 assert got == dict(data=expected, skip=skip, limit=limit)
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_query_by_number_range(client: TestClient):
+    """Queries the songs whose numbers are in a range, ordered by number"""
+    song_data = dict(key="F", lines=[[dict(note="F", words="hey you")]])
+    nums_and_titles = [
+        (1, "foo"),
+        (2, "food"),
+        (11, "fell"),
+        (20, "fish"),
+        (110, "yogurt"),
+    ]
+    lang = languages[0]
+
+    test_data = [
+        (1, 20, [(1, "foo"), (2, "food"), (11, "fell"), (20, "fish")]),
+        (2, 2, [(2, "food")]),
+        (3, 10, []),
+        (11, 1000, [(11, "fell"), (20, "fish"), (110, "yogurt")]),
+    ]
+
+    with client:
+        headers = _get_auth_headers(client, test_user)
+
+        for num, title in nums_and_titles:
+            payload = dict(**song_data, title=title, number=num, language=lang)
+            response = client.post("/api", json=payload, headers=headers)
+            assert response.status_code == 200
+
+        for start, end, expected_nums_and_titles in test_data:
+            expected = [
+                dict(**song_data, title=title, number=num, language=lang)
+                for num, title in expected_nums_and_titles
+            ]
+            response = client.get(
+                f"/api/{lang}/range",
+                params={"from": start, "to": end},
+                headers=headers,
+            )
+            assert response.status_code == 200
+            assert response.json() == expected
+
+        response = client.get(
+            f"/api/{lang}/range",
+            params={"from": 1, "to": 11, "view": "summary"},
+            headers=headers,
+        )
+        assert response.json() == [
+            dict(key="F", title=title, number=num, language=lang)
+            for num, title in [(1, "foo"), (2, "food"), (11, "fell")]
+        ]
+
+        response = client.get(
+            f"/api/{lang}/range", params={"from": 20, "to": 1}, headers=headers
+        )
+        assert response.status_code == 400
+        response = client.get(
+            "/api/Klingon/range", params={"from": 1, "to": 20}, headers=headers
+        )
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_export_songs(client: TestClient):
+    """Exports all the songs of a language as NDJSON, ordered by number, resuming after `since_number`"""
+    song_data = dict(key="F", lines=[[dict(note="F", words="hey you")]])
+    nums_and_titles = [(110, "yogurt"), (2, "food"), (11, "fell"), (1, "foo")]
+    lang = languages[0]
+
+    test_data = [
+        (None, [(1, "foo"), (2, "food"), (11, "fell"), (110, "yogurt")]),
+        (0, [(1, "foo"), (2, "food"), (11, "fell"), (110, "yogurt")]),
+        (2, [(11, "fell"), (110, "yogurt")]),
+        (110, []),
+    ]
+
+    with client:
+        headers = _get_auth_headers(client, test_user)
+
+        for num, title in nums_and_titles:
+            payload = dict(**song_data, title=title, number=num, language=lang)
+            response = client.post("/api", json=payload, headers=headers)
+            assert response.status_code == 200
+
+        for since_number, expected_nums_and_titles in test_data:
+            expected = [
+                dict(**song_data, title=title, number=num, language=lang)
+                for num, title in expected_nums_and_titles
+            ]
+            params = {} if since_number is None else {"since_number": since_number}
+            response = client.get(f"/api/{lang}/export", params=params, headers=headers)
+            assert response.status_code == 200
+            assert response.headers["content-type"] == "application/x-ndjson"
+            assert [json.loads(line) for line in response.iter_lines()] == expected
+
+        response = client.get(
+            f"/api/{lang}/export", params={"view": "summary"}, headers=headers
+        )
+        assert [json.loads(line) for line in response.iter_lines()] == [
+            dict(key="F", title=title, number=num, language=lang)
+            for num, title in [(1, "foo"), (2, "food"), (11, "fell"), (110, "yogurt")]
+        ]
+
+        response = client.get("/api/Klingon/export", headers=headers)
+        assert response.status_code == 404
+        response = client.get(f"/api/{lang}/export")
+        assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_export_songs_resume_after_title(client: TestClient):
+    """An export resumed after the number and title of the last song got includes the other songs of that number"""
+    song_data = dict(key="F", lines=[[dict(note="F", words="hey you")]])
+    nums_and_titles = [(1, "foo"), (2, "food"), (2, "fog"), (2, "zebra"), (3, "fell")]
+    lang = languages[0]
+
+    test_data = [
+        (
+            {"since_number": 2, "since_title": "fog"},
+            [(2, "food"), (2, "zebra"), (3, "fell")],
+        ),
+        ({"since_number": 2, "since_title": "zebra"}, [(3, "fell")]),
+        (
+            {"since_number": 1, "since_title": "foo"},
+            [(2, "fog"), (2, "food"), (2, "zebra"), (3, "fell")],
+        ),
+    ]
+
+    with client:
+        headers = _get_auth_headers(client, test_user)
+
+        for num, title in nums_and_titles:
+            payload = dict(**song_data, title=title, number=num, language=lang)
+            response = client.post("/api", json=payload, headers=headers)
+            assert response.status_code == 200
+
+        for params, expected_nums_and_titles in test_data:
+            response = client.get(f"/api/{lang}/export", params=params, headers=headers)
+            assert response.status_code == 200
+            assert [
+                (v["number"], v["title"])
+                for v in (json.loads(line) for line in response.iter_lines())
+            ] == expected_nums_and_titles
+
+        response = client.get(
+            f"/api/{lang}/export", params={"since_title": "fog"}, headers=headers
+        )
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_batch(client: TestClient):
+    """Runs several read operations in one request, returning the result or error of each"""
+    lang = languages[0]
+    song = Song(**{**songs[0].dict(), "language": lang}).dict()
+    summary = {k: v for k, v in song.items() if k != "lines"}
+    operations = [
+        dict(op="get-by-number", language=lang, q=song["number"]),
+        dict(op="get-by-title", language=lang, q=song["title"], view="summary"),
+        dict(op="find-by-title", language=lang, q=song["title"][:2], with_total=True),
+        dict(op="find-by-number", language=lang, q=song["number"], limit=1),
+        dict(op="get-by-number", language=lang, q=100_000),
+        dict(op="get-by-title", language="Klingon", q=song["title"]),
+    ]
+
+    with client:
+        headers = _get_auth_headers(client, test_user)
+        response = client.post("/api", json=song, headers=headers)
+        assert response.status_code == 200
+
+        api_key_headers = {"x-api-key": headers["x-api-key"]}
+        response = client.post("/api/batch", json=operations, headers=api_key_headers)
+        assert response.status_code == 200
+        assert response.json() == [
+            dict(status=200, data=song),
+            dict(status=200, data=summary),
+            dict(status=200, data=dict(data=[song], skip=0, limit=0, total=1)),
+            dict(status=200, data=dict(data=[song], skip=0, limit=1)),
+            dict(status=404, detail=response.json()[4]["detail"]),
+            dict(status=404, detail=response.json()[5]["detail"]),
+        ]
+
+        response = client.post(
+            "/api/batch",
+            json=[dict(op="get-by-number", language=lang, q="foo")],
+            headers=api_key_headers,
+        )
+        assert response.status_code == 422
+
+        response = client.post(
+            "/api/batch", json=operations * 10, headers=api_key_headers
+        )
+        assert response.status_code == 400
+
+        response = client.post("/api/batch", json=operations)
+        assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_import_songs(client: TestClient):
+    """Imports the songs of a JSON array or NDJSON body in batches, reporting the invalid records"""
+    valid_songs = [
+        Song(**{**song.dict(), "language": lang}).dict()
+        for lang in languages[:2]
+        for song in songs
+    ]
+    invalid_song = {**valid_songs[0], "number": "not a number"}
+    ndjson = "\n".join([json.dumps(valid_songs[0]), "{oops", json.dumps(invalid_song)])
+
+    with client:
+        headers = _get_auth_headers(client, test_user)
+
+        response = client.post(
+            "/api/bulk",
+            params={"batch_size": 2},
+            content=json.dumps([*valid_songs, invalid_song]),
+            headers=headers,
+        )
+        assert response.status_code == 200
+        report = response.json()
+        assert report["imported"] == len(valid_songs)
+        assert report["failed"] == 1
+        assert report["errors"][0]["index"] == len(valid_songs)
+        assert "number" in report["errors"][0]["detail"]
+
+        for song in valid_songs:
+            _assert_song_has_content(
+                client,
+                language=song["language"],
+                number=song["number"],
+                content=song,
+                headers=headers,
+            )
+
+        response = client.post("/api/bulk", content=ndjson, headers=headers)
+        assert response.status_code == 200
+        report = response.json()
+        assert report["imported"] == 1
+        assert [v["index"] for v in report["errors"]] == [1, 2]
+
+        response = client.post("/api/bulk", content="[{}, ", headers=headers)
+        assert response.status_code == 400
+
+        response = client.post(
+            "/api/bulk", content=ndjson, headers={"x-api-key": headers["x-api-key"]}
+        )
+        assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_import_songs_keeps_saved_batches(client: TestClient, monkeypatch):
+    """The batches imported before a failing batch stay saved, as the import is not run in one unit of work"""
+    valid_songs = [
+        Song(**{**song.dict(), "language": languages[0]}).dict() for song in songs[:2]
+    ]
+    save_songs = bulk.save_songs
+    calls = []
+
+    async def fail_after_first_batch(service, batch):
+        calls.append(batch)
+        if len(calls) > 1:
+            raise Exception("the database went away")
+        await save_songs(service, batch)
+
+    monkeypatch.setattr(bulk, "save_songs", fail_after_first_batch)
+
+    with client:
+        headers = _get_auth_headers(client, test_user)
+
+        response = client.post(
+            "/api/bulk",
+            params={"batch_size": 1},
+            content=json.dumps(valid_songs),
+            headers=headers,
+        )
+        assert response.status_code == 500
+
+        _assert_song_has_content(
+            client,
+            language=valid_songs[0]["language"],
+            number=valid_songs[0]["number"],
+            content=valid_songs[0],
+            headers=headers,
+        )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_query_with_summary_view(client: TestClient):
+    """Queries by title or number with view=summary return songs without lines"""
+    song_data = dict(key="F", lines=[[dict(note="F", words="hey you")]])
+    nums_and_titles = [(1, "foo"), (2, "food"), (11, "fell")]
+    lang = languages[0]
+
+    with client:
+        headers = _get_auth_headers(client, test_user)
+
+        for num, title in nums_and_titles:
+            payload = dict(**song_data, title=title, number=num, language=lang)
+            response = client.post("/api", json=payload, headers=headers)
+            assert response.status_code == 200
+
+        for path, expected_nums_and_titles in [
+            ("find-by-title/fo", [(1, "foo"), (2, "food")]),
+            ("find-by-number/1", [(1, "foo"), (11, "fell")]),
+        ]:
+            expected = [
+                dict(key="F", title=title, number=num, language=lang)
+                for num, title in expected_nums_and_titles
+            ]
+            response = client.get(
+                f"/api/{lang}/{path}", params=dict(view="summary"), headers=headers
+            )
+            assert response.status_code == 200
+            got = response.json()
+            got["data"].sort(key=_song_key_func)
+            expected.sort(key=_song_key_func)
+            assert got == dict(data=expected, skip=0, limit=0)
+
+        response = client.get(
+            f"/api/{lang}/find-by-title/fo", params=dict(view="foo"), headers=headers
+        )
+        assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client", test_clients_fixture)
+async def test_compact_view(client: TestClient):
+    """Songs can be sent and received with their lines as arrays of note codes, words and line offsets"""
+    lang = languages[0]
+    lines = [
+        [dict(note="F", words="hey"), dict(note="Am", words="you")],
+        [dict(note="C", words="there")],
+    ]
+    compact_lines = dict(
+        notes=[10, 19, 0], words=["hey", "you", "there"], offsets=[0, 2]
+    )
+    song_data = dict(key="F", language=lang)
+
+    with client:
+        headers = _get_auth_headers(client, test_user)
+
+        payload = dict(**song_data, title="foo", number=1, lines=lines)
+        response = client.post("/api", json=payload, headers=headers)
+        assert response.status_code == 200
+        # compact lines are also accepted on writes
+        payload = dict(**song_data, title="food", number=2, lines=compact_lines)
+        response = client.post("/api", json=payload, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["lines"] == lines
+
+        for number, title in [(1, "foo"), (2, "food")]:
+            expected = dict(**song_data, title=title, number=number)
+            response = client.get(
+                f"/api/{lang}/{number}", params=dict(view="compact"), headers=headers
+            )
+            assert response.status_code == 200
+            assert response.json()["translations"] == {
+                lang: dict(**expected, lines=compact_lines)
+            }
+
+            response = client.get(f"/api/{lang}/{number}", headers=headers)
+            assert response.json()["translations"] == {
+                lang: dict(**expected, lines=lines)
+            }
+
+        response = client.get(
+            f"/api/{lang}/find-by-title/fo",
+            params=dict(view="compact"),
+            headers=headers,
+        )
+        assert response.status_code == 200
+        got = response.json()["data"]
+        assert sorted(got, key=_song_key_func) == [
+            dict(**song_data, title=title, number=number, lines=compact_lines)
+            for number, title in [(1, "foo"), (2, "food")]
+        ]
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("client", test_clients_fixture)
 async def test_api_key(client: TestClient):
@@ -2,7 +2,7 @@ import os
 
 import pytest
 
-from services.store import PgStore, MongoStore
+from services.store import PgStore, MongoStore, SqliteStore
 from tests.utils.mongo import clear_mongo_db
 from tests.utils.postgres import drop_pg_db_if_exists, create_pg_db_if_not_exists
 from tests.utils.shared import (
@@ -40,3 +40,12 @@ async def test_mongo_path(app_settings):
 
     await MongoStore._clean_up()
     clear_mongo_db(db_path)
+
+
+@aio_pytest_fixture
+async def test_sqlite_path(app_settings, tmp_path):
+    """the db path to the test embedded sqlite db"""
+    db_path = f"sqlite:///{tmp_path / 'test_hymns_api.db'}"
+
+    yield db_path
+    await SqliteStore._clean_up()
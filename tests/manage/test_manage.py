@@ -1,4 +1,7 @@
 import asyncio
+import json
+import os
+from typing import Dict, Optional
 
 import pytest
 from typer.testing import CliRunner
@@ -6,7 +9,10 @@ from typer.testing import CliRunner
 from cli import shutdown
 from cli.auth import login
 from manage import app
+from services import config
 from services.auth.errors import AuthenticationError
+from services.hymns.utils.init import initialize_one_language_store
+from tests.utils.shared import songs
 from .conftest import cli_runner_fixture
 
 
@@ -143,6 +149,188 @@ def test_change_password(cli_runner: CliRunner):
         asyncio.run(_guarded_login(username=username, password=old_password))
 
 
+@pytest.mark.parametrize("cli_runner", cli_runner_fixture)
+def test_dump_and_restore(cli_runner: CliRunner, test_sqlite_path, tmp_path):
+    """Can dump the database into a folder and restore it into another database"""
+    dump_path = str(tmp_path / "dump")
+    source_uri = os.environ["DB_PATH"]
+    _seed_db(cli_runner, source_uri)
+
+    result = cli_runner.invoke(app, ["dump", dump_path])
+    assert result.exit_code == 0
+    assert "dumped successfully" in result.stdout
+    assert "songs.English: 2 records" in result.stdout
+    assert "users: 1 records" in result.stdout
+    assert not os.path.exists(os.path.join(dump_path, ".checkpoint.json"))
+
+    result = cli_runner.invoke(app, ["restore", dump_path, "--to", test_sqlite_path])
+    assert result.exit_code == 0
+    assert "restored successfully" in result.stdout
+    assert asyncio.run(_get_songs(test_sqlite_path)) == _sort_songs(songs)
+
+    # the checksums of a tampered dump do not match its manifest
+    with open(os.path.join(dump_path, "songs.English.ndjson"), "a") as file:
+        file.write(songs[0].copy(update={"title": "Tampered"}).json() + "\n")
+    result = cli_runner.invoke(app, ["restore", dump_path, "--to", test_sqlite_path])
+    assert result.exit_code != 0
+    assert "checksum mismatch for: songs.English" in str(result.exception)
+
+
+@pytest.mark.parametrize("cli_runner", cli_runner_fixture)
+def test_copy(cli_runner: CliRunner, test_sqlite_path, tmp_path):
+    """Can copy the data from one database to another in batches, resuming from the checkpoint"""
+    source_uri = os.environ["DB_PATH"]
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    _seed_db(cli_runner, source_uri)
+
+    result = cli_runner.invoke(
+        app,
+        [
+            "copy",
+            "--from",
+            source_uri,
+            "--to",
+            test_sqlite_path,
+            "--batch-size",
+            "1",
+            "--checkpoint",
+            checkpoint_path,
+        ],
+    )
+    assert result.exit_code == 0
+    assert "copied successfully" in result.stdout
+    assert "records/s" in result.stdout
+    assert not os.path.exists(checkpoint_path)
+    assert asyncio.run(_get_songs(test_sqlite_path)) == _sort_songs(songs)
+    assert asyncio.run(_get_usernames(test_sqlite_path)) == ["johndoe"]
+
+
+@pytest.mark.parametrize("cli_runner", cli_runner_fixture)
+def test_dump_and_restore_language_db_uris(
+    cli_runner: CliRunner, test_sqlite_path, tmp_path
+):
+    """Dumps and restores the songs of the languages routed to their own databases from and to those databases"""
+    dump_path = str(tmp_path / "dump")
+    source_uri = os.environ["DB_PATH"]
+    restored_uri = f"sqlite:///{tmp_path / 'restored.db'}"
+    language_db_uris = {v.language: test_sqlite_path for v in songs}
+    _seed_db(cli_runner, source_uri, language_db_uris=language_db_uris)
+
+    result = cli_runner.invoke(app, ["dump", dump_path])
+    assert result.exit_code == 0
+    assert "songs.English: 2 records" in result.stdout
+
+    result = cli_runner.invoke(app, ["restore", dump_path, "--to", restored_uri])
+    assert result.exit_code == 0
+    assert asyncio.run(_get_songs(restored_uri)) == _sort_songs(songs)
+    assert asyncio.run(_get_songs(restored_uri, is_routed=False)) == []
+
+
+@pytest.mark.parametrize("cli_runner", cli_runner_fixture)
+def test_train_dictionaries(cli_runner: CliRunner):
+    """Can train a compression dictionary per language and recompress the songs with it"""
+    source_uri = os.environ["DB_PATH"]
+    _seed_db(cli_runner, source_uri)
+
+    result = cli_runner.invoke(
+        app, ["train-dictionaries", "--language", "English", "--recompress"]
+    )
+    assert result.exit_code == 0
+    assert "English: dictionary English:" in result.stdout
+    assert "2 songs recompressed" in result.stdout
+    assert asyncio.run(_get_songs(source_uri)) == _sort_songs(songs)
+
+
+@pytest.mark.parametrize("cli_runner", cli_runner_fixture)
+def test_import_songs(cli_runner: CliRunner, tmp_path):
+    """Can import the songs of JSON array and NDJSON files, reporting the invalid records"""
+    array_path = str(tmp_path / "songs.json")
+    with open(array_path, "w") as file:
+        json.dump([json.loads(song.json()) for song in songs], file)
+
+    ndjson_path = str(tmp_path / "songs.ndjson")
+    with open(ndjson_path, "w") as file:
+        file.write(f"{songs[0].json()}\n{{oops\n")
+
+    result = cli_runner.invoke(
+        app, ["import-songs", array_path, "--batch-size", "1", "--workers", "2"]
+    )
+    assert result.exit_code == 0
+    assert "songs imported successfully" in result.stdout
+    assert f"imported: {len(songs)} songs, failed: 0 records" in result.stdout
+    assert "songs/s" in result.stdout
+    assert asyncio.run(_get_songs(os.environ["DB_PATH"])) == _sort_songs(songs)
+
+    result = cli_runner.invoke(app, ["import-songs", ndjson_path, "--workers", "0"])
+    assert result.exit_code == 0
+    assert "record 1: invalid JSON" in result.stdout
+    assert "imported: 1 songs, failed: 1 records" in result.stdout
+
+
+def _seed_db(
+    cli_runner: CliRunner, uri: str, language_db_uris: Optional[Dict[str, str]] = None
+):
+    """Adds a user, a config and some songs to the database, or to the databases of their languages"""
+    result = cli_runner.invoke(
+        app,
+        [
+            "create-account",
+            "--username",
+            "johndoe",
+            "--email",
+            "johndoe@example.com",
+            "--password",
+            "password123",
+        ],
+    )
+    assert result.exit_code == 0
+    asyncio.run(_add_songs(uri, language_db_uris=language_db_uris or {}))
+
+
+async def _add_songs(uri: str, language_db_uris: Dict[str, str]):
+    """Saves the songs and their languages in the database, or in the databases of their languages"""
+    try:
+        conf = config.ServiceConfig(
+            languages=sorted({v.language for v in songs}),
+            language_db_uris=language_db_uris,
+        )
+        await config.save_service_config(uri, conf)
+        for song in songs:
+            store = initialize_one_language_store(conf, uri, song.language)
+            await store.titles_store.set(song.title, song)
+    finally:
+        await shutdown()
+
+
+async def _get_songs(uri: str, is_routed: bool = True):
+    """Gets all the songs in the database, or in the databases of their languages, sorted by language and number"""
+    try:
+        conf = await config.get_service_config(uri)
+        if not is_routed:
+            conf = conf.copy(update={"language_db_uris": {}})
+        result = []
+        for lang in conf.languages:
+            store = initialize_one_language_store(conf, uri, lang)
+            result.extend(await store.titles_store.search(""))
+    finally:
+        await shutdown()
+    return _sort_songs(result)
+
+
+async def _get_usernames(uri: str):
+    """Gets the usernames of all users in the database"""
+    try:
+        store = config.get_users_store(config.ServiceConfig(), uri)
+        return [v.username for v in await store.search("")]
+    finally:
+        await shutdown()
+
+
+def _sort_songs(values):
+    """Sorts the songs by language and number"""
+    return sorted(values, key=lambda v: (v.language, v.number))
+
+
 def _user_exists(username: str, password: str) -> bool:
     """Checks that the user of the given username and password exists"""
     try:
@@ -1,8 +1,14 @@
 from pytest_lazyfixture import lazy_fixture
 from services import hymns
+from services.store import PgStore
 from services.config import save_service_config
 from tests.utils.mongo import is_mongo_titles_store, is_mongo_numbers_store
-from tests.utils.postgres import is_pg_titles_store, is_pg_numbers_store
+from tests.utils.postgres import (
+    is_pg_titles_store,
+    is_pg_numbers_store,
+    drop_pg_db_if_exists,
+    create_pg_db_if_not_exists,
+)
 
 from tests.utils.shared import (
     aio_pytest_fixture,
@@ -38,6 +44,13 @@ numbers_stores_fixture = [
     for conf in service_configs
 ]
 
+# For testing the primitives of the stores
+store_db_path_fixture = (
+    [(lazy_fixture("test_mongo_path"), conf) for conf in service_configs[:1]]
+    + [(lazy_fixture("test_pg_path"), conf) for conf in service_configs[:1]]
+    + [(lazy_fixture("test_sqlite_path"), conf) for conf in service_configs[:1]]
+)
+
 # For testing initializing service
 service_db_path_fixture = [
     lazy_fixture("mongo_service_db_path"),
@@ -89,3 +102,15 @@ async def pg_hymns_service(pg_service_db_path):
     """the hymns service for use during tests  when running on postgres"""
     service = await hymns.initialize(pg_service_db_path)
     yield service
+
+
+@aio_pytest_fixture
+async def other_pg_path(test_pg_path):
+    """the db path to another test postgres db, besides the one at test_pg_path"""
+    db_path = f"{test_pg_path}_other"
+    await drop_pg_db_if_exists(db_path)
+    await create_pg_db_if_not_exists(db_path)
+
+    yield db_path
+    await PgStore._clean_up()
+    await drop_pg_db_if_exists(db_path)
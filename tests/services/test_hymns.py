@@ -1,13 +1,30 @@
+import asyncio
+from datetime import datetime, timedelta
 from typing import List
 
 import funml as ml
 import pytest
 from services import hymns
-from services.hymns.errors import ValidationError
+from services.hymns.errors import ValidationError, ReadOnlyError
 from services.errors import NotFoundError
-from services.hymns.models import Song, LineSection, PaginatedResponse
+from services.hymns.models import (
+    Song,
+    LineSection,
+    PaginatedResponse,
+    SongSummary,
+    SongView,
+)
+from services.store import Store, PgConfig, postgres
 from services.types import MusicalNote
 from services.hymns.types import HymnsService
+from services.config import ServiceConfig, save_service_config, get_config_store
+from tests.utils.shared import songs
+from tests.utils.postgres import (
+    create_pg_unpartitioned_songs_table,
+    get_pg_songs_latest_updated_at,
+    get_pg_table_partitions,
+    set_pg_songs_updated_at,
+)
 from .conftest import (
     songs_fixture,
     songs_langs_fixture,
@@ -25,6 +42,216 @@ async def test_initialize(service_db_uri):
     assert isinstance(hymns_service, hymns.types.HymnsService)
 
 
+@pytest.mark.asyncio
+async def test_initialize_with_language_db_uris(test_pg_path, other_pg_path):
+    """initialize routes the languages in language_db_uris to their own databases"""
+    lang, other_lang = "English", "Luganda"
+    conf = ServiceConfig(languages=[lang], language_db_uris={other_lang: other_pg_path})
+    await save_service_config(test_pg_path, conf)
+    service = await hymns.initialize(test_pg_path)
+    song = songs[0]
+
+    assert service.stores[lang].numbers_store._uri == test_pg_path
+    await hymns.add_song(service, song=Song(**{**song.dict(), "language": other_lang}))
+    assert service.stores[other_lang].numbers_store._uri == other_pg_path
+    assert service.stores[other_lang].titles_store._uri == other_pg_path
+
+    other_conf = ServiceConfig(languages=[other_lang])
+    await save_service_config(other_pg_path, other_conf)
+    other_service = await hymns.initialize(other_pg_path)
+
+    for svc in (service, other_service):
+        res = await hymns.get_song_by_number(
+            svc, number=song.number, language=other_lang
+        )
+        assert res.value.title == song.title
+
+    res = await hymns.get_song_by_number(service, number=song.number, language=lang)
+    assert isinstance(_extract_exception(res), NotFoundError)
+
+
+@pytest.mark.asyncio
+async def test_initialize_applies_limits_after_config_store(test_pg_path):
+    """the limits of the service config apply even though the config store, which has none, is created first"""
+    conf = ServiceConfig(languages=["English"], operation_timeout=10, max_concurrency=2)
+    # the limits are shared by all stores of the database, even those of other tests
+    await Store.destroy_stores()
+    try:
+        # as at startup, the service config is saved before the service is initialized
+        await save_service_config(test_pg_path, conf)
+        config_store = get_config_store(test_pg_path)
+        assert config_store._limits.is_unlimited
+
+        service = await hymns.initialize(test_pg_path)
+        titles_store = service.stores["English"].titles_store
+        assert not titles_store._limits.is_unlimited
+        assert config_store._limits is titles_store._limits
+    finally:
+        await Store.destroy_stores()
+
+
+@pytest.mark.asyncio
+async def test_initialize_reads_from_replicas_after_config_store(
+    test_pg_path, other_pg_path
+):
+    """the replicas of the service config are read from even though the config store, which has none, is created first"""
+    song = [song for song in songs if song.language == "English"][0]
+    replica_song = Song(**{**song.dict(), "key": MusicalNote.D_MAJOR})
+    replica_store = Store.retrieve_store(
+        uri=other_pg_path, name="English_title", model=Song, options=PgConfig()
+    )
+    await replica_store.set(song.title, replica_song)
+
+    conf = ServiceConfig(
+        languages=["English"], db_replica_uris={test_pg_path: [other_pg_path]}
+    )
+    # as at startup, the service config is saved before the service is initialized
+    await save_service_config(test_pg_path, conf)
+    service = await hymns.initialize(test_pg_path)
+    await hymns.add_song(service, song=song)
+    res = await hymns.get_song_by_title(service, title=song.title, language="English")
+    assert res == ml.Result.OK(song)
+
+    # reads go to the replicas once this worker's writes are out of the read-your-writes window
+    await asyncio.sleep(PgConfig().read_your_writes_window + 0.1)
+    res = await hymns.get_song_by_title(service, title=song.title, language="English")
+    assert res == ml.Result.OK(replica_song)
+
+
+@pytest.mark.asyncio
+async def test_initialize_uses_fast_reads_after_config_store(test_pg_path, monkeypatch):
+    """the fast reads of the service config are used even though the config store, which has none, is created first"""
+    fast_reads = []
+
+    async def fetch_song(*args, **kwargs):
+        fast_reads.append(kwargs["value"])
+        return await original_fetch_song(*args, **kwargs)
+
+    original_fetch_song = postgres.fetch_song
+    monkeypatch.setattr(postgres, "fetch_song", fetch_song)
+
+    song = [song for song in songs if song.language == "English"][0]
+    conf = ServiceConfig(languages=["English"], fast_reads=True)
+    # as at startup, the service config is saved before the service is initialized
+    await save_service_config(test_pg_path, conf)
+    service = await hymns.initialize(test_pg_path)
+    await hymns.add_song(service, song=song)
+
+    res = await hymns.get_song_by_title(service, title=song.title, language="English")
+    assert res == ml.Result.OK(song)
+    assert song.title in fast_reads
+
+
+@pytest.mark.asyncio
+async def test_initialize_edge_node(pg_hymns_service, test_sqlite_path):
+    """an edge node serves the songs of the primary stores from its embedded store, pulling their changes"""
+    primary = pg_hymns_service
+    first, second = [song for song in songs if song.language == "English"][:2]
+    third = Song(**{**first.dict(), "number": 1000, "title": "A new song"})
+    await hymns.add_song(primary, song=first)
+    await hymns.add_song(primary, song=second)
+    # as if the songs were saved before their update times were recorded
+    await set_pg_songs_updated_at(primary.store_uri, None)
+
+    edge = await hymns.initialize(
+        primary.store_uri, edge_db_uri=test_sqlite_path, sync_interval=60
+    )
+    try:
+        assert edge.is_read_only
+        res = await hymns.get_song_by_number(
+            edge, number=first.number, language="English"
+        )
+        assert res == ml.Result.OK(first)
+        # the songs without update times are not pulled again
+        assert await edge.replicator.sync() == 0
+
+        changed_first = Song(**{**first.dict(), "key": MusicalNote.D_MAJOR})
+        await hymns.add_song(primary, song=changed_first)
+        await hymns.add_song(primary, song=third)
+        await hymns.delete_song(primary, number=second.number, language="English")
+
+        assert await edge.replicator.sync() == 2
+        res = await hymns.get_song_by_title(edge, title=first.title, language="English")
+        assert res == ml.Result.OK(changed_first)
+        res = await hymns.get_song_by_number(
+            edge, number=third.number, language="English"
+        )
+        assert res == ml.Result.OK(third)
+        # the songs re-pulled within the overlap are not saved again
+        assert await edge.replicator.sync() == 0
+
+        # the idle rounds do not move the watermark back, so older changes are left to the full rounds
+        for _ in range(4):
+            assert await edge.replicator.sync() == 0
+        latest = await get_pg_songs_latest_updated_at(primary.store_uri)
+        await hymns.add_song(
+            primary, song=Song(**{**third.dict(), "key": MusicalNote.F_MAJOR})
+        )
+        await set_pg_songs_updated_at(
+            primary.store_uri, latest - timedelta(seconds=15), title=third.title
+        )
+        assert await edge.replicator.sync() == 0
+
+        # deletions, and changes timestamped before the last round, are picked up by the full rounds
+        changed_third = Song(**{**third.dict(), "key": MusicalNote.E_MAJOR})
+        await hymns.add_song(primary, song=changed_third)
+        await set_pg_songs_updated_at(
+            primary.store_uri, datetime(2000, 1, 1), title=third.title
+        )
+        assert await edge.replicator.sync() == 0
+        res = await hymns.get_song_by_number(
+            edge, number=second.number, language="English"
+        )
+        assert res == ml.Result.OK(second)
+        assert await edge.replicator.sync(full=True) == 2
+        res = await hymns.get_song_by_number(
+            edge, number=second.number, language="English"
+        )
+        assert isinstance(res.value, NotFoundError)
+        res = await hymns.get_song_by_number(
+            edge, number=third.number, language="English"
+        )
+        assert res == ml.Result.OK(changed_third)
+
+        res = await hymns.add_song(edge, song=second)
+        assert isinstance(res.value, ReadOnlyError)
+        res = await hymns.delete_song(edge, number=first.number)
+        assert isinstance(res.value, ReadOnlyError)
+    finally:
+        await hymns.shutdown(edge)
+
+
+@pytest.mark.asyncio
+async def test_initialize_partitions_songs_by_language(test_pg_path):
+    """initialize moves songs of an unpartitioned postgres songs table into a partition per language"""
+    other_lang = "Luganda"
+    old_songs = [*songs, Song(**{**songs[0].dict(), "language": other_lang})]
+    await create_pg_unpartitioned_songs_table(test_pg_path, old_songs)
+    await save_service_config(test_pg_path, ServiceConfig(languages=["English"]))
+
+    service = await hymns.initialize(test_pg_path)
+    for song in songs:
+        res = await hymns.get_song_by_number(
+            service, number=song.number, language=song.language
+        )
+        assert res == ml.Result.OK(song)
+
+    partitions = await get_pg_table_partitions(test_pg_path, "songs")
+    assert partitions == {
+        "DEFAULT": 1,
+        "FOR VALUES IN ('English')": 2,
+    }
+
+    new_lang_song = Song(**{**songs[1].dict(), "language": "Rukiga"})
+    await hymns.add_song(service, song=new_lang_song)
+    partitions = await get_pg_table_partitions(test_pg_path, "songs")
+    assert partitions == {
+        "DEFAULT": 1,
+        "FOR VALUES IN ('English')": 2,
+        "FOR VALUES IN ('Rukiga')": 1,
+    }
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("service, song", songs_fixture)
 async def test_add_song(service: HymnsService, song: Song):
@@ -140,6 +367,64 @@ async def test_query_song_by_title(service: HymnsService):
             assert res == expected
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("service", hymns_service_fixture)
+async def test_query_song_with_total(service: HymnsService):
+    """query_songs_by_title and query_songs_by_number return the total if with_total is True"""
+    song_data = dict(
+        key=MusicalNote.F_MAJOR,
+        lines=[[LineSection(note=MusicalNote.F_MAJOR, words="hey you")]],
+    )
+    nums_and_titles = [(1, "foo"), (11, "food"), (12, "fell"), (2, "yell")]
+    lang = languages[0]
+
+    for num, title in nums_and_titles:
+        song = Song(**song_data, title=title, number=num, language=lang)
+        await hymns.add_song(service, song=song)
+
+    res = await hymns.query_songs_by_title(
+        service, "f", language=lang, limit=1, with_total=True
+    )
+    assert len(res.value.data) == 1
+    assert res.value.total == 3
+
+    res = await hymns.query_songs_by_number(
+        service, 1, language=lang, skip=1, with_total=True
+    )
+    assert len(res.value.data) == 2
+    assert res.value.total == 3
+
+    res = await hymns.query_songs_by_number(service, 1, language=lang)
+    assert res.value.total is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("service", hymns_service_fixture)
+async def test_query_song_summaries(service: HymnsService):
+    """query_songs_by_title and query_songs_by_number return summaries if the view is SongView.SUMMARY"""
+    song_data = dict(
+        key=MusicalNote.F_MAJOR,
+        lines=[[LineSection(note=MusicalNote.F_MAJOR, words="hey you")]],
+    )
+    lang = languages[0]
+    song = Song(**song_data, title="foo", number=1, language=lang)
+    await hymns.add_song(service, song=song)
+    expected = [SongSummary(**song.dict())]
+
+    res = await hymns.query_songs_by_title(
+        service, "fo", language=lang, view=SongView.SUMMARY
+    )
+    assert res.value.data == expected
+
+    res = await hymns.query_songs_by_number(
+        service, 1, language=lang, view=SongView.SUMMARY
+    )
+    assert res.value.data == expected
+
+    res = await hymns.query_songs_by_number(service, 1, language=lang)
+    assert res.value.data == [song]
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("service", hymns_service_fixture)
 async def test_query_song_by_number(service: HymnsService):
@@ -0,0 +1,667 @@
+import asyncio
+import contextvars
+import gc
+
+import pytest
+
+from services.auth.models import UserInDb, Application
+from pymongo import ReadPreference
+
+from services.config import (
+    get_users_store,
+    get_auth_store,
+    get_titles_store,
+    ServiceConfig,
+)
+from services.errors import StoreOverloadedError, StoreTimeoutError
+from services.store import Store, PgConfig, PgStore, unit_of_work, consistent_reads
+from services.store.utils.limits import StoreLimits
+from services.hymns.models import (
+    Song,
+    SongSummary,
+    SongVersion,
+    LineSection,
+    LineOperation,
+)
+from services.types import MusicalNote
+from tests.utils.shared import songs
+from .conftest import store_db_path_fixture
+
+_user = UserInDb(
+    username="johndoe",
+    email="encrypted-email",
+    password="hashed-password",
+    otp_counter="encrypted-counter",
+    otp_secret="encrypted-secret",
+    login_attempts=0,
+)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+async def test_insert_if_absent(db_path, conf):
+    """insert_if_absent inserts the value only if the key does not exist yet"""
+    store = get_auth_store(service_conf=conf, uri=db_path)
+    app = Application(key="foo")
+
+    assert await store.insert_if_absent(app.key, app)
+    assert not await store.insert_if_absent(app.key, app)
+    assert await store.get(app.key) == app
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+async def test_update_fields(db_path, conf):
+    """update_fields updates only the given fields of the value"""
+    store = get_users_store(service_conf=conf, uri=db_path)
+    await store.set(_user.username, _user)
+
+    expected = UserInDb(**{**_user.dict(), "otp_counter": "new", "login_attempts": 3})
+    got = await store.update_fields(
+        _user.username, {"otp_counter": "new", "login_attempts": 3}
+    )
+    assert got == expected
+    assert await store.get(_user.username) == expected
+    assert await store.update_fields("unknown", {"login_attempts": 3}) is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+async def test_increment(db_path, conf):
+    """increment increments the integer field of the value"""
+    store = get_users_store(service_conf=conf, uri=db_path)
+    await store.set(_user.username, _user)
+
+    for i in range(1, 4):
+        got = await store.increment(_user.username, "login_attempts")
+        assert got.login_attempts == i
+
+    got = await store.increment(_user.username, "login_attempts", by=-3)
+    assert got == _user
+    assert await store.increment("unknown", "login_attempts") is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+async def test_set_with_ttl(db_path, conf):
+    """set with a ttl makes the value expire after the ttl seconds"""
+    store = get_auth_store(service_conf=conf, uri=db_path)
+    app = Application(key="foo")
+    permanent_app = Application(key="bar")
+
+    await store.set(app.key, app, ttl=1)
+    await store.set(permanent_app.key, permanent_app)
+    assert await store.get(app.key) == app
+    assert not await store.insert_if_absent(app.key, app)
+
+    await asyncio.sleep(1.5)
+    assert await store.get(app.key) is None
+    assert await store.get(permanent_app.key) == permanent_app
+
+    assert await store.insert_if_absent(app.key, app)
+    await asyncio.sleep(1.5)
+    assert await store.get(app.key) == app
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+async def test_exists(db_path, conf):
+    """exists checks whether a value exists for the given key"""
+    store = get_auth_store(service_conf=conf, uri=db_path)
+    app = Application(key="foo")
+
+    assert not await store.exists(app.key)
+    await store.set(app.key, app)
+    assert await store.exists(app.key)
+    assert not await store.exists("fo")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+async def test_count(db_path, conf):
+    """count counts the values whose keys start with the given term, up to the limit"""
+    store = get_auth_store(service_conf=conf, uri=db_path)
+    for key in ["foo", "food", "fell", "yell"]:
+        await store.set(key, Application(key=key))
+
+    test_data = [
+        ("", 0, 4),
+        ("f", 0, 3),
+        ("fo", 0, 2),
+        ("fo", 1, 1),
+        ("f", 2, 2),
+        ("y", 0, 1),
+        ("z", 0, 0),
+    ]
+    for term, limit, expected in test_data:
+        assert await store.count(term, limit=limit) == expected
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+async def test_get_with_projection(db_path, conf):
+    """get with a projection gets only the fields of the projection, including when the value was last updated"""
+    store = get_titles_store(service_conf=conf, uri=db_path, lang="English")
+    song = next(song for song in songs if song.language == "English")
+    await store.set(song.title, song)
+
+    assert await store.get(song.title, projection=SongSummary) == SongSummary(
+        **song.dict()
+    )
+    assert await store.get("unknown", projection=SongVersion) is None
+
+    version = await store.get(song.title, projection=SongVersion)
+    assert (version.number, version.language) == (song.number, song.language)
+    assert version.updated_at is not None
+
+    await asyncio.sleep(0.01)
+    await store.set(song.title, Song(**{**song.dict(), "key": MusicalNote.D_MAJOR}))
+    new_version = await store.get(song.title, projection=SongVersion)
+    assert new_version.updated_at > version.updated_at
+
+
+@pytest.mark.asyncio
+async def test_pg_read_replicas(test_pg_path, other_pg_path):
+    """postgres song reads go to the replicas except shortly after this worker's own writes, user reads never do"""
+    song = songs[0]
+    replica_song = Song(**{**song.dict(), "key": MusicalNote.D_MAJOR})
+    replica_user = UserInDb(**{**_user.dict(), "login_attempts": 7})
+    replica_songs = Store.retrieve_store(
+        uri=other_pg_path, name=f"{song.language}_title", model=Song, options=PgConfig()
+    )
+    replica_users = Store.retrieve_store(
+        uri=other_pg_path, name="hymns_users", model=UserInDb, options=PgConfig()
+    )
+    await replica_songs.set(song.title, replica_song)
+    await replica_users.set(replica_user.username, replica_user)
+
+    conf = PgConfig(
+        db_replica_uris={test_pg_path: [other_pg_path]}, read_your_writes_window=0.5
+    )
+    store = Store.retrieve_store(
+        uri=test_pg_path, name=f"{song.language}_title", model=Song, options=conf
+    )
+    users_store = Store.retrieve_store(
+        uri=test_pg_path, name="hymns_users", model=UserInDb, options=conf
+    )
+    await store.set(song.title, song)
+    await users_store.set(_user.username, _user)
+    assert await store.get(song.title) == song
+
+    await asyncio.sleep(0.6)
+    assert await store.get(song.title) == replica_song
+    assert await store.exists(song.title)
+    assert await store.count(song.title[:2]) == 1
+    assert await store.search(song.title[:2]) == [replica_song]
+    assert await users_store.get(_user.username) == _user
+    assert await users_store.search("john") == [_user]
+
+
+@pytest.mark.asyncio
+async def test_pg_consistent_reads_use_one_replica(test_pg_path, other_pg_path):
+    """postgres reads within consistent reads all go to the replica chosen by the first of them"""
+    song = songs[0]
+    stale_song = Song(**{**song.dict(), "key": MusicalNote.D_MAJOR})
+    lagging_replica = Store.retrieve_store(
+        uri=other_pg_path, name=f"{song.language}_title", model=Song, options=PgConfig()
+    )
+    await lagging_replica.set(song.title, stale_song)
+
+    # the primary doubles as an up-to-date replica, next to the lagging one
+    conf = PgConfig(
+        db_replica_uris={test_pg_path: [other_pg_path, test_pg_path]},
+        read_your_writes_window=0,
+    )
+    store = Store.retrieve_store(
+        uri=test_pg_path, name=f"{song.language}_title", model=Song, options=conf
+    )
+    await store.set(song.title, song)
+
+    got = [await store.get(song.title) for _ in range(4)]
+    assert song in got and stale_song in got
+
+    for _ in range(4):
+        async with consistent_reads():
+            version = await store.get(song.title, projection=SongVersion)
+            first = await store.get(song.title)
+            got = [await store.get(song.title) for _ in range(3)]
+            assert got == [first] * 3
+            assert (await store.get(song.title, projection=SongVersion)) == version
+
+
+@pytest.mark.asyncio
+async def test_pg_read_replicas_ejects_failing_replica(test_pg_path):
+    """postgres reads fall back to the primary when a replica cannot be reached"""
+    conf = PgConfig(
+        db_replica_uris={test_pg_path: ["postgresql://postgres@127.0.0.1:1/foo"]},
+        read_your_writes_window=0,
+    )
+    song = songs[0]
+    store = Store.retrieve_store(
+        uri=test_pg_path, name=f"{song.language}_title", model=Song, options=conf
+    )
+    await store.set(song.title, song)
+
+    assert await store.get(song.title) == song
+    assert await store.get(song.title) == song
+
+
+@pytest.mark.asyncio
+async def test_mongo_read_options(test_mongo_path):
+    """mongo public reads use the configured read preference while auth reads stay on the primary"""
+    conf = ServiceConfig(
+        read_preference="secondaryPreferred",
+        read_concern="local",
+        max_staleness_seconds=90,
+    )
+    song = songs[0]
+    titles_store = get_titles_store(conf, uri=test_mongo_path, lang=song.language)
+    auth_store = get_auth_store(conf, uri=test_mongo_path)
+    app = Application(key="foo")
+
+    await titles_store.set(song.title, song)
+    await auth_store.set(app.key, app)
+
+    read_pref = titles_store._read_collection.read_preference
+    assert read_pref.mongos_mode == "secondaryPreferred"
+    assert read_pref.max_staleness == 90
+    assert titles_store._read_collection.read_concern.level == "local"
+    assert auth_store._read_collection.read_preference == ReadPreference.PRIMARY
+    assert await titles_store.get(song.title) == song
+    assert await auth_store.get(app.key) == app
+
+    # consistent reads run in one causally consistent session, concurrent ones included
+    async with consistent_reads():
+        got = await asyncio.gather(
+            titles_store.get(song.title),
+            titles_store.search(song.title[:2]),
+            auth_store.get(app.key),
+        )
+        assert got == [song, [song], app]
+
+
+def test_pg_store_across_event_loops(test_pg_path):
+    """the postgres store can be used on successive event loops, each getting its own connection pool"""
+    store = get_auth_store(service_conf=ServiceConfig(), uri=test_pg_path)
+    app = Application(key="foo")
+
+    asyncio.run(store.set(app.key, app))
+    assert asyncio.run(store.get(app.key)) == app
+    assert asyncio.run(store.exists(app.key))
+
+    # connections of closed event loops are released only when garbage collected
+    asyncio.run(PgStore._clean_up())
+    gc.collect()
+
+
+@pytest.mark.asyncio
+async def test_pg_fast_reads(test_pg_path):
+    """postgres fast reads get songs by number or title and search them by prefix"""
+    conf = PgConfig(fast_reads=True, fast_reads_pool_size=2)
+    titles_store, numbers_store = [
+        Store.retrieve_store(
+            uri=test_pg_path, name=f"English_{field}", model=Song, options=conf
+        )
+        for field in ("title", "number")
+    ]
+    english_songs = sorted(
+        [song for song in songs if song.language == "English"], key=lambda v: v.number
+    )
+    expired_song = Song(**{**english_songs[0].dict(), "number": 1000, "title": "Gone"})
+    for song in english_songs:
+        await titles_store.set(song.title, song)
+    await titles_store.set(expired_song.title, expired_song, ttl=0.1)
+    await asyncio.sleep(0.2)
+
+    for song in english_songs:
+        assert await titles_store.get(song.title) == song
+        assert await numbers_store.get(f"{song.number}") == song
+        assert await titles_store.search(song.title[:3].lower()) == [song]
+    assert await titles_store.get(expired_song.title) is None
+    assert await numbers_store.get(f"{expired_song.number}") is None
+    assert await numbers_store.get("9999") is None
+
+    got = await titles_store.search("", skip=0, limit=0)
+    assert sorted(got, key=lambda v: v.number) == english_songs
+    assert len(await titles_store.search("", skip=1, limit=1)) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+async def test_delete_many(db_path, conf):
+    """delete_many deletes the values matching any of the fields in the given languages"""
+    langs = ["English", "Runyoro", "Luganda"]
+    stores = {lang: get_titles_store(conf, uri=db_path, lang=lang) for lang in langs}
+    versions = {
+        lang: [
+            Song(**{**song.dict(), "language": lang, "number": number})
+            for number, song in zip((1, 2), songs)
+        ]
+        for lang in langs
+    }
+    for lang, lang_songs in versions.items():
+        for song in lang_songs:
+            await stores[lang].set(song.title, song)
+
+    assert stores["English"].is_colocated_with(stores["Runyoro"])
+    assert not stores["English"].is_colocated_with(get_auth_store(conf, uri=db_path))
+
+    got = await stores["English"].delete_many({"number": 1, "title": "unknown"})
+    assert got == [versions["English"][0]]
+
+    got = await stores["English"].delete_many(
+        {"title": songs[0].title, "number": 2}, languages=["Runyoro", "Luganda"]
+    )
+    expected = [*versions["Runyoro"], *versions["Luganda"]]
+    key = lambda v: (v.language, v.number)
+    assert sorted(got, key=key) == sorted(expected, key=key)
+
+    assert await stores["English"].get(songs[1].title) == versions["English"][1]
+    assert await stores["Luganda"].get(songs[0].title) is None
+    assert await stores["English"].delete_many({"number": 1}) == []
+
+
+@pytest.mark.asyncio
+async def test_pg_unit_of_work(test_pg_path):
+    """postgres operations within a unit of work are committed once on exit, or rolled back on error"""
+    conf = PgConfig(fast_reads=True)
+    titles_store, numbers_store = [
+        Store.retrieve_store(
+            uri=test_pg_path, name=f"English_{field}", model=Song, options=conf
+        )
+        for field in ("title", "number")
+    ]
+    first, second = [song for song in songs if song.language == "English"][:2]
+
+    async def get_outside_unit_of_work(title: str):
+        task = asyncio.create_task(
+            titles_store.get(title), context=contextvars.Context()
+        )
+        return await task
+
+    async with unit_of_work():
+        await titles_store.set(first.title, first)
+        assert await numbers_store.get(f"{first.number}") == first
+        assert await get_outside_unit_of_work(first.title) is None
+
+    assert await get_outside_unit_of_work(first.title) == first
+
+    with pytest.raises(ValueError):
+        async with unit_of_work():
+            await titles_store.set(second.title, second)
+            await titles_store.delete(first.title)
+            raise ValueError("request failed")
+
+    assert await titles_store.get(first.title) == first
+    assert await titles_store.get(second.title) is None
+
+
+@pytest.mark.asyncio
+async def test_store_limits_shed_operations_beyond_the_queue():
+    """operations beyond the concurrency limit and the queue size are shed immediately"""
+    limits = StoreLimits(
+        timeout=None, max_concurrency=1, max_queue_size=1, retry_after=3
+    )
+    running = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_operation():
+        running.set()
+        await release.wait()
+        return "done"
+
+    first = asyncio.create_task(limits.run("first", slow_operation))
+    await running.wait()
+    queued = asyncio.create_task(limits.run("queued", slow_operation))
+    await asyncio.sleep(0)
+
+    with pytest.raises(StoreOverloadedError) as exc_info:
+        await limits.run("shed", slow_operation)
+    assert exc_info.value.retry_after == 3
+
+    release.set()
+    assert await asyncio.gather(first, queued) == ["done", "done"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("timeout", [None, 10])
+async def test_store_limits_apply_to_each_operation_of_a_task(timeout):
+    """operations run one after another in the same task are each limited, not just the first"""
+    limits = StoreLimits(
+        timeout=timeout, max_concurrency=1, max_queue_size=0, retry_after=3
+    )
+    running = asyncio.Event()
+    release = asyncio.Event()
+
+    async def quick_operation():
+        return "done"
+
+    async def slow_operation():
+        running.set()
+        await release.wait()
+        return "done"
+
+    assert await limits.run("first", quick_operation) == "done"
+
+    holder = asyncio.create_task(limits.run("holder", slow_operation))
+    await running.wait()
+
+    with pytest.raises(StoreOverloadedError):
+        await limits.run("second", quick_operation)
+
+    release.set()
+    assert await holder == "done"
+    assert await limits.run("third", quick_operation) == "done"
+
+
+@pytest.mark.asyncio
+async def test_pg_operation_timeout(test_pg_path):
+    """store operations that take longer than the operation timeout fail with StoreTimeoutError"""
+    store = get_auth_store(
+        service_conf=ServiceConfig(operation_timeout=0.5), uri=test_pg_path
+    )
+    app = Application(key="foo")
+    await store.set(app.key, app)
+    assert await store.get(app.key) == app
+
+    await Store.destroy_stores()
+    store = get_auth_store(
+        service_conf=ServiceConfig(operation_timeout=0.000001), uri=test_pg_path
+    )
+    try:
+        with pytest.raises(StoreTimeoutError):
+            await store.get(app.key)
+    finally:
+        # the limits are shared by all stores of the database, even those of later tests
+        await Store.destroy_stores()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+async def test_set_many_and_scan(db_path, conf):
+    """set_many upserts many values at once and scan streams them in batches, resumable from a cursor"""
+    store = get_titles_store(conf, uri=db_path, lang="English")
+    english_songs = [
+        Song(**{**songs[0].dict(), "number": number, "title": f"Song {number}"})
+        for number in range(1, 8)
+    ]
+    await store.set_many([(song.title, song) for song in english_songs])
+    await store.set_many([])
+    other_store = get_titles_store(conf, uri=db_path, lang="Runyoro")
+    await other_store.set(
+        songs[0].title, Song(**{**songs[0].dict(), "language": "Runyoro"})
+    )
+
+    batches = [(batch, cursor) async for batch, cursor in store.scan(batch_size=3)]
+    assert [len(batch) for batch, _ in batches] == [3, 3, 1]
+    key = lambda v: v.number
+    got = [song for batch, _ in batches for song in batch]
+    assert sorted(got, key=key) == english_songs
+
+    resumed = [
+        song async for batch, _ in store.scan(3, after=batches[0][1]) for song in batch
+    ]
+    assert sorted(resumed, key=key) == sorted(got[3:], key=key)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+async def test_scan_range(db_path, conf):
+    """scan_range streams the songs whose numbers are in the range, in numerical order, in batches"""
+    store = get_titles_store(conf, uri=db_path, lang="English")
+    numbers = [1, 2, 9, 10, 11, 20, 100, 110]
+    english_songs = [
+        Song(**{**songs[0].dict(), "number": number, "title": f"Song {number}"})
+        for number in numbers
+    ]
+    await store.set_many([(song.title, song) for song in english_songs])
+    other_store = get_titles_store(conf, uri=db_path, lang="Runyoro")
+    await other_store.set(
+        songs[0].title, Song(**{**songs[0].dict(), "language": "Runyoro"})
+    )
+
+    batches = [batch async for batch in store.scan_range(2, 100, batch_size=3)]
+    assert [len(batch) for batch in batches] == [3, 3]
+    assert [song for batch in batches for song in batch] == english_songs[1:7]
+
+    summaries = [
+        song
+        async for batch in store.scan_range(10, 11, projection=SongSummary)
+        for song in batch
+    ]
+    assert summaries == [SongSummary(**song.dict()) for song in english_songs[3:5]]
+    assert [batch async for batch in store.scan_range(3, 8)] == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+@pytest.mark.parametrize("options", [{}, {"compact_lines": True}])
+async def test_patch_lines(db_path, conf, options):
+    """patch_lines replaces, inserts and deletes lines in order, and changes the given fields"""
+    store = get_titles_store(conf.copy(update=options), uri=db_path, lang="English")
+    song = songs[0]
+    line = [LineSection(note=MusicalNote.A_MINOR, words="a $new line")]
+    await store.set(song.title, song)
+
+    got = await store.patch_lines(
+        song.title,
+        [
+            LineOperation(op="replace", index=0, line=line),
+            LineOperation(op="insert", index=2, line=line),
+            LineOperation(op="delete", index=1),
+        ],
+        fields={"key": MusicalNote.A_MINOR},
+    )
+    expected = song.copy(
+        update={"key": MusicalNote.A_MINOR, "lines": [line, line, *song.lines[2:]]}
+    )
+    assert got == expected
+    assert await store.get(song.title) == expected
+
+    got = await store.patch_lines(
+        song.title, [LineOperation(op="replace", index=1, line=song.lines[1])]
+    )
+    expected = expected.copy(update={"lines": [line, song.lines[1], *song.lines[2:]]})
+    assert got == expected
+
+    number_of_lines = len(expected.lines)
+    got = await store.patch_lines(
+        song.title, [LineOperation(op="insert", index=number_of_lines, line=line)]
+    )
+    assert got.lines == [*expected.lines, line]
+
+    with pytest.raises(ValueError):
+        await store.patch_lines(
+            song.title, [LineOperation(op="delete", index=number_of_lines + 1)]
+        )
+    assert await store.get(song.title) == got
+    assert (
+        await store.patch_lines("unknown", [LineOperation(op="delete", index=0)])
+        is None
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture[:2])
+async def test_patch_lines_concurrently(db_path, conf):
+    """concurrent patch_lines of songs whose lines are rewritten, not changed in place, all apply"""
+    store = get_titles_store(
+        conf.copy(update={"compact_lines": True}), uri=db_path, lang="English"
+    )
+    song = songs[0]
+    await store.set(song.title, song)
+    new_lines = [
+        [LineSection(note=MusicalNote.A_MINOR, words=f"line {i}")] for i in range(5)
+    ]
+
+    await asyncio.gather(
+        *(
+            store.patch_lines(
+                song.title, [LineOperation(op="insert", index=0, line=line)]
+            )
+            for line in new_lines
+        )
+    )
+    got = await store.get(song.title)
+    assert got.lines[len(new_lines) :] == song.lines
+    assert sorted(got.lines[: len(new_lines)], key=str) == sorted(new_lines, key=str)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("db_path, conf", store_db_path_fixture)
+async def test_compact_lines(db_path, conf):
+    """songs saved with compact lines are read back losslessly, alongside songs saved with nested lines"""
+    compact_store = get_titles_store(
+        conf.copy(update={"compact_lines": True}), uri=db_path, lang="English"
+    )
+    nested_store = get_titles_store(conf, uri=db_path, lang="English")
+    compact_song, nested_song = songs[0], songs[1]
+
+    await compact_store.set(compact_song.title, compact_song)
+    await nested_store.set(nested_song.title, nested_song)
+
+    for store in (compact_store, nested_store):
+        assert await store.get(compact_song.title) == compact_song
+        assert await store.get(nested_song.title) == nested_song
+
+    new_lines = [nested_song.lines[1], [], nested_song.lines[0]]
+    got = await compact_store.update_fields(nested_song.title, {"lines": new_lines})
+    assert got == nested_song.copy(update={"lines": new_lines})
+    assert await nested_store.get(nested_song.title) == got
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "db_path, conf", [p for p in store_db_path_fixture if "sqlite" not in f"{p}"]
+)
+async def test_compressed_lines(db_path, conf):
+    """songs are compressed with the latest dictionary of their language, and read back losslessly by any store"""
+    compressing_store = get_titles_store(
+        conf.copy(update={"compress_lines": True}), uri=db_path, lang="English"
+    )
+    plain_store = get_titles_store(conf, uri=db_path, lang="English")
+    first, second = songs[0], songs[1]
+
+    # without a dictionary, songs are saved uncompressed
+    await compressing_store.set(first.title, first)
+    assert await plain_store.train_compression_dictionary() is None
+    dictionary_id = await compressing_store.train_compression_dictionary()
+    assert dictionary_id.startswith("English:")
+    await compressing_store.set(second.title, second)
+
+    # a fresh process loads the dictionaries from the database
+    await Store.destroy_stores()
+    compressing_store = get_titles_store(
+        conf.copy(update={"compress_lines": True}), uri=db_path, lang="English"
+    )
+    plain_store = get_titles_store(conf, uri=db_path, lang="English")
+    for store in (compressing_store, plain_store):
+        assert await store.get(first.title) == first
+        assert await store.get(second.title) == second
+        got = await store.search("", projection=None)
+        assert sorted(got, key=lambda v: v.number) == [first, second]
+
+    new_lines = [second.lines[1], second.lines[0]]
+    got = await compressing_store.update_fields(second.title, {"lines": new_lines})
+    assert got == second.copy(update={"lines": new_lines})
+    assert await plain_store.delete(second.title) == [got]
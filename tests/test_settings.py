@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+import settings
+from errors import ConfigurationError
+
+
+def test_get_db_replica_uris(monkeypatch):
+    """get_db_replica_uris parses the JSON map of primary uris to replica uris, query strings included"""
+    primary = (
+        "postgresql://postgres@primary:5432/hymns?sslmode=require&options=-c%20a=b"
+    )
+    replicas = [
+        "postgresql://postgres@replica1:5432/hymns?sslmode=require&target_session_attrs=any",
+        "postgresql://postgres@replica2:5432/hymns?application_name=a,b;c",
+    ]
+    monkeypatch.setenv("DB_REPLICA_URIS", json.dumps({primary: replicas}))
+    assert settings.get_db_replica_uris() == {primary: replicas}
+
+    monkeypatch.setenv("DB_REPLICA_URIS", "")
+    assert settings.get_db_replica_uris() == {}
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "postgresql://primary=postgresql://replica",
+        '["postgresql://replica"]',
+        '{"postgresql://primary": "postgresql://replica"}',
+    ],
+)
+def test_get_db_replica_uris_invalid(monkeypatch, value):
+    """get_db_replica_uris raises a ConfigurationError if the value is not a JSON map of uris to lists of uris"""
+    monkeypatch.setenv("DB_REPLICA_URIS", value)
+    with pytest.raises(ConfigurationError):
+        settings.get_db_replica_uris()
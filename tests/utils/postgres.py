@@ -1,3 +1,7 @@
+import json
+from datetime import datetime
+from typing import List, Dict, Optional
+
 import asyncpg
 import pyotp
 from cryptography.fernet import Fernet
@@ -5,7 +9,9 @@ from sqlalchemy import make_url
 
 from services.auth.models import UserDTO
 from services.auth.utils import encrypt_str, hash_password
+from services.hymns.models import Song
 from services.store import PgStore, Store
+from services.types import MusicalNote
 
 
 async def create_pg_db_if_not_exists(db_uri: str):
@@ -130,6 +136,112 @@ async def pg_upsert_user(db_uri: str, fernet: Fernet, user: UserDTO):
         await conn.close()
 
 
+async def create_pg_unpartitioned_songs_table(db_uri: str, songs: List[Song]):
+    """Creates the `songs` table as it was before it was partitioned, and inserts the given songs into it
+
+    Args:
+        db_uri: the postgres database url to connect to
+        songs: the songs to insert
+    """
+    conn = await asyncpg.connect(db_uri)
+    notes = ", ".join(f"'{note.name}'" for note in MusicalNote)
+    try:
+        await conn.execute(
+            f"""
+            CREATE TYPE musicalnote AS ENUM ({notes});
+            CREATE TABLE IF NOT EXISTS public.songs (
+            "number" varchar (255) NOT NULL,
+            "language" varchar (255) NOT NULL,
+            "title" varchar (255) NOT NULL,
+            "key" musicalnote NOT NULL,
+            "lines" json NOT NULL,
+             CONSTRAINT songs_pkey PRIMARY KEY (number, language, title)
+        )
+        """
+        )
+        await conn.executemany(
+            "INSERT INTO public.songs VALUES ($1, $2, $3, $4, $5)",
+            [
+                (
+                    f"{song.number}",
+                    song.language,
+                    song.title,
+                    song.key.name,
+                    json.dumps(json.dumps(song.dict()["lines"])),
+                )
+                for song in songs
+            ],
+        )
+    finally:
+        await conn.close()
+
+
+async def set_pg_songs_updated_at(
+    db_uri: str, updated_at: Optional[datetime], title: Optional[str] = None
+):
+    """Sets the update time of the songs e.g. to None as for songs saved before update times were recorded
+
+    Args:
+        db_uri: the postgres database url to connect to
+        updated_at: the update time to set
+        title: the title of the song to update; if None, all songs are updated
+    """
+    conn = await asyncpg.connect(db_uri)
+    try:
+        if title is None:
+            await conn.execute("UPDATE public.songs SET updated_at = $1", updated_at)
+        else:
+            await conn.execute(
+                "UPDATE public.songs SET updated_at = $1 WHERE title = $2",
+                updated_at,
+                title,
+            )
+    finally:
+        await conn.close()
+
+
+async def get_pg_songs_latest_updated_at(db_uri: str) -> Optional[datetime]:
+    """Gets the latest update time of the songs
+
+    Args:
+        db_uri: the postgres database url to connect to
+
+    Returns:
+        the latest update time of the songs, or None if none has one
+    """
+    conn = await asyncpg.connect(db_uri)
+    try:
+        return await conn.fetchval("SELECT max(updated_at) FROM public.songs")
+    finally:
+        await conn.close()
+
+
+async def get_pg_table_partitions(db_uri: str, table: str) -> Dict[str, int]:
+    """Gets the partitions of the given postgres table and the number of rows in each
+
+    Args:
+        db_uri: the postgres database url to connect to
+        table: the partitioned table
+
+    Returns:
+        a map of partition bound e.g. "FOR VALUES IN ('English')" to the number of rows in the partition
+    """
+    conn = await asyncpg.connect(db_uri)
+    try:
+        records = await conn.fetch(
+            f"""SELECT 
+                    pg_get_expr(c.relpartbound, c.oid) AS bound,
+                    (SELECT count(*) FROM {table} t WHERE t.tableoid = c.oid) AS count
+                FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = '{table}'::regclass
+            """
+        )
+    finally:
+        await conn.close()
+
+    return {record["bound"]: record["count"] for record in records}
+
+
 async def pg_table_exists(db_uri: str, table: str) -> bool:
     """Checks to see a given postgres table exists
 